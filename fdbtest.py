@@ -2,18 +2,56 @@ import os
 import fdb  # requires external package
 import logging
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import cProfile
+import csv
+import datetime
+import decimal
+import difflib
+import fnmatch
+import glob
+import hashlib
+import io
+import multiprocessing
+import multiprocessing.util
+import pickle
+import pstats
+import random
+import re
+import shutil
+import signal
+import sqlite3
+import statistics
 import yaml  # requires external package
 import json  # requires external package
 import subprocess
 import sys
+import threading
 import time
+import urllib.parse
+import weakref
+import xml.etree.ElementTree as ET
 import requests  # requires external package
+import urllib3  # comes with requests
 
 __version__ = '2.1'
 
+# libyaml based loader is several times faster when available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 opt = 0
 log = 0
 fb = 0
+snapshot = None
+ledger = None
+watchdog = None
+pool = None
+profiler = None
+cassette = None
+# shared by workers of a parallel run, grows whenever metadata may change
+metadata_version = None
 
 
 class FBTOptions:
@@ -21,10 +59,14 @@ class FBTOptions:
     Place to share all common/global options including passed via command line
     """
 
-    def __init__(self):
+    def __init__(self, cmdargs=None):
         """
-        During initialization process command line arguments
+        During initialization process command line arguments. Worker processes
+        get already parsed arguments from the main process instead.
         """
+        if cmdargs is not None:
+            self.cmdargs = cmdargs
+            return
         parser = argparse.ArgumentParser()
         parser.add_argument(
             "-s",
@@ -56,6 +98,28 @@ class FBTOptions:
         parser.add_argument(
             "-b", "--use_backup", help="restore given backup file for testing"
         )
+        parser.add_argument(
+            "--snapshot_cache",
+            help=(
+                "directory to keep restored golden copies of backups given"
+                " with -b, so subsequent runs just copy the database file"
+            ),
+        )
+        parser.add_argument(
+            "--snapshot_copy",
+            choices=("copy", "reflink"),
+            default="reflink",
+            help=(
+                "how to copy golden database: plain copy or copy-on-write"
+                " clone where filesystem supports it (default reflink)"
+            ),
+        )
+        parser.add_argument(
+            "--snapshot_per_test",
+            action="store_true",
+            default=False,
+            help="reset database from golden copy before every test",
+        )
         parser.add_argument(
             "-n",
             "--no_test_data",
@@ -63,12 +127,54 @@ class FBTOptions:
             action="store_true",
             default=False,
         )
+        parser.add_argument(
+            "--fixture_ledger",
+            action="store_true",
+            default=False,
+            help=(
+                "remember applied data files in FDBTEST_FIXTURES table of"
+                " the tested database and skip them if already applied"
+            ),
+        )
         parser.add_argument(
             "-t",
             "--run_test",
             help="run given test or all tests from given directory",
             required=True,
         )
+        parser.add_argument(
+            "--profiles",
+            help=(
+                "YAML file with named connection profiles that tests and"
+                " statements may use"
+            ),
+        )
+        parser.add_argument(
+            "--select",
+            help=(
+                "run only tests matching expression like"
+                " 'tag:stock and not slow', see README for details"
+            ),
+        )
+        parser.add_argument(
+            "--id",
+            help="run only tests with id matching given pattern, e.g. '00*'",
+        )
+        parser.add_argument(
+            "--cache_dir",
+            default=".fdbtest_cache",
+            help=(
+                "directory to keep parsed tests and their index"
+                " (default .fdbtest_cache), empty string disables the cache"
+            ),
+        )
+        parser.add_argument(
+            "--history_db",
+            help=(
+                "sqlite database to keep timings of all runs in (default"
+                " history.db in cache dir)"
+            ),
+        )
         parser.add_argument(
             "-i",
             "--isql",
@@ -78,6 +184,33 @@ class FBTOptions:
             ),
             default="",
         )
+        parser.add_argument(
+            "--isql_scripts",
+            action="store_true",
+            default=False,
+            help=(
+                "always run .sql files through isql instead of executing"
+                " them over the script's own attachment"
+            ),
+        )
+        parser.add_argument(
+            "--script_batch",
+            type=int,
+            default=256,
+            help=(
+                "max number of consecutive INSERTs of .sql files executed"
+                " as one EXECUTE BLOCK (default 256, 1 disables batching)"
+            ),
+        )
+        parser.add_argument(
+            "--script_commit",
+            type=int,
+            default=0,
+            help=(
+                "commit .sql files every N statements in addition to their"
+                " own COMMITs (default 0 - only at COMMIT and at the end)"
+            ),
+        )
         parser.add_argument(
             "-g",
             "--gbak",
@@ -100,10 +233,222 @@ class FBTOptions:
             "--force_clean",
             action="store_true",
             help=(
-                "remove .log files from directory with results"
+                "remove .log and .jsonl files from directory with results"
                 " before executing tests"
             ),
         )
+        parser.add_argument(
+            "--transaction",
+            choices=("commit", "rollback"),
+            default="commit",
+            help=(
+                "commit every statement (default) or run all statements of"
+                " a test in one transaction rolled back at the end"
+            ),
+        )
+        parser.add_argument(
+            "--verbose",
+            action="store_true",
+            default=False,
+            help=(
+                "store full statement and variables in results files for"
+                " passed statements too, not only for failed ones"
+            ),
+        )
+        parser.add_argument(
+            "--stmt_cache",
+            type=int,
+            default=64,
+            help=(
+                "number of prepared statements kept per attachment for reuse,"
+                " 0 disables the cache (default 64)"
+            ),
+        )
+        parser.add_argument(
+            "--fetch_batch",
+            type=int,
+            default=1000,
+            help=(
+                "number of rows fetched at once by statements checking"
+                " the whole result set (default 1000)"
+            ),
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help=(
+                "number of worker processes to run tests in parallel,"
+                " each with its own database attachment (default 1)"
+            ),
+        )
+        parser.add_argument(
+            "--statement_timeout",
+            type=float,
+            help=(
+                "seconds after which a running statement is cancelled on"
+                " the server and fails"
+            ),
+        )
+        parser.add_argument(
+            "--file_timeout",
+            type=float,
+            help="seconds after which data or test file execution is stopped",
+        )
+        parser.add_argument(
+            "--test_timeout",
+            type=float,
+            help="seconds after which the whole test is stopped and fails",
+        )
+        parser.add_argument(
+            "--http_record",
+            help="directory to store responses of http requests to",
+        )
+        parser.add_argument(
+            "--http_replay",
+            help=(
+                "directory with responses stored by --http_record to serve"
+                " http requests from instead of the network"
+            ),
+        )
+        parser.add_argument(
+            "--http_latency",
+            help=(
+                "delay of replayed responses: 'recorded' for the original"
+                " ones, SECONDS or SECONDS+-JITTER (none by default)"
+            ),
+        )
+        parser.add_argument(
+            "--metrics",
+            help=(
+                "directory to write duration histograms to as fdbtest.prom"
+                " (OpenMetrics) and fdbtest.json (results dir by default)"
+            ),
+        )
+        parser.add_argument(
+            "--metrics_interval",
+            type=float,
+            default=0,
+            help=(
+                "seconds between writing histograms during the run,"
+                " 0 writes them only at the end (default)"
+            ),
+        )
+        parser.add_argument(
+            "--timing_profile",
+            nargs="?",
+            const="phases",
+            choices=("phases", "cprofile"),
+            help=(
+                "report how test time splits between database, http, child"
+                " processes and the script itself; 'cprofile' adds hot spots"
+                " of the script"
+            ),
+        )
+        parser.add_argument(
+            "--fail_fast",
+            action="store_true",
+            help="stop the run after the first failed test",
+        )
+        parser.add_argument(
+            "--max_failures",
+            type=int,
+            default=0,
+            help="stop the run after given number of failed tests",
+        )
+        parser.add_argument(
+            "--time_budget",
+            type=float,
+            help=(
+                "seconds the run should fit in; recently failed, changed"
+                " and new tests are preferred, the rest may be skipped"
+            ),
+        )
+        parser.add_argument(
+            "--soak",
+            type=float,
+            help=(
+                "run selected tests over and over for given number of"
+                " seconds, sampling resource usage of the server"
+            ),
+        )
+        parser.add_argument(
+            "--soak_interval",
+            type=float,
+            default=60,
+            help="seconds between samples of a soak run",
+        )
+        parser.add_argument(
+            "--max_memory_slope",
+            type=float,
+            help="bytes per hour database memory may grow in a soak run",
+        )
+        parser.add_argument(
+            "--max_gap_slope",
+            type=float,
+            help=(
+                "transactions per hour the gap between the oldest active"
+                " and the next transaction may grow in a soak run"
+            ),
+        )
+        parser.add_argument(
+            "--max_latency_drift",
+            type=float,
+            help=(
+                "percent per hour duration of a loop of tests may grow in a"
+                " soak run"
+            ),
+        )
+        parser.add_argument(
+            "--plan_baseline",
+            help=(
+                "directory with plans saved by a previous run (plans"
+                " subdirectory of results dir); changed plans fail statements"
+            ),
+        )
+        parser.add_argument(
+            "--io_stats",
+            action="store_true",
+            default=False,
+            help=(
+                "record page reads, writes, fetches and table reads from"
+                " MON$ tables for every sql statement"
+            ),
+        )
+        parser.add_argument(
+            "--load",
+            type=int,
+            default=0,
+            help=(
+                "replay statements of every test from given number of"
+                " concurrent sessions after the test passed"
+            ),
+        )
+        parser.add_argument(
+            "--load_iterations",
+            type=int,
+            default=10,
+            help="how many times every session of --load replays statements",
+        )
+        parser.add_argument(
+            "--load_duration",
+            type=float,
+            help="replay statements for given seconds instead of iterations",
+        )
+        parser.add_argument(
+            "--benchmark_baseline",
+            help=(
+                "json file with baseline results of statements with"
+                " benchmark section (default benchmark.json in results dir)"
+            ),
+        )
+        parser.add_argument(
+            "--benchmark_update",
+            action="store_true",
+            default=False,
+            help="overwrite baseline with results of this run",
+        )
         parser.add_argument(
             "-v",
             "--version",
@@ -111,6 +456,31 @@ class FBTOptions:
             version='%(prog)s {version}'.format(version=__version__)
         )
         self.cmdargs = parser.parse_args()
+        if self.cmdargs.snapshot_cache and not self.cmdargs.use_backup:
+            parser.error("--snapshot_cache requires --use_backup")
+        if self.cmdargs.snapshot_per_test:
+            if not self.cmdargs.snapshot_cache:
+                parser.error("--snapshot_per_test requires --snapshot_cache")
+            if self.cmdargs.jobs > 1:
+                parser.error(
+                    "--snapshot_per_test can not be used with parallel jobs"
+                )
+            if self.cmdargs.soak:
+                # the sampler keeps its attachment while the file is replaced
+                parser.error("--snapshot_per_test can not be used with --soak")
+        if self.cmdargs.fail_fast:
+            self.cmdargs.max_failures = 1
+        if self.cmdargs.http_record and self.cmdargs.http_replay:
+            parser.error("--http_record and --http_replay exclude each other")
+        if self.cmdargs.http_latency:
+            if not self.cmdargs.http_replay:
+                parser.error("--http_latency requires --http_replay")
+            try:
+                HttpCassette.Latency(self.cmdargs.http_latency)
+            except ValueError:
+                parser.error(
+                    f"invalid --http_latency {self.cmdargs.http_latency}"
+                )
         # now set proper gbak and isql values
         if self.cmdargs.gbak == "":
             if os.name == "posix":
@@ -129,7 +499,11 @@ class FBTLog:
     Place to keep loggging
     """
 
-    def __init__(self, opt):
+    def __init__(self, opt, worker=None):
+        """
+        Worker processes of a parallel run pass their id as `worker` and get
+        their own log file next to the main one
+        """
         if sys.stdout.isatty():
             formatter = logging.Formatter(
                 fmt="%(asctime)s %(message)s", datefmt="%H:%M:%S"
@@ -138,22 +512,30 @@ class FBTLog:
             handler.setFormatter(formatter)
             logstd = logging.getLogger("stdout")
             logstd.setLevel(logging.INFO)
+            # forked workers inherit handlers of the main process
+            logstd.handlers.clear()
             logstd.addHandler(handler)
         else:
             logstd = logging.getLogger("dummy")
 
+        if worker is None:
+            logname = "fdbtest.log"
+        else:
+            logname = f"fdbtest.{worker}.log"
         if opt.cmdargs.results_dir:
-            if opt.cmdargs.force_clean and os.path.exists(
-                opt.cmdargs.results_dir
+            if (
+                worker is None
+                and opt.cmdargs.force_clean
+                and os.path.exists(opt.cmdargs.results_dir)
             ):
                 for file in os.scandir(opt.cmdargs.results_dir):
-                    if file.name.endswith(".log"):
+                    if file.name.endswith((".log", ".jsonl")):
                         os.remove(file.path)
             if not os.path.exists(opt.cmdargs.results_dir):
                 os.makedirs(opt.cmdargs.results_dir)
-            logfilename = opt.cmdargs.results_dir + os.sep + "fdbtest.log"
+            logfilename = opt.cmdargs.results_dir + os.sep + logname
         else:
-            logfilename = "fdbtest.log"
+            logfilename = logname
 
         formatter = logging.Formatter(
             fmt="%(asctime)s %(levelname)s %(message)s",
@@ -163,17 +545,410 @@ class FBTLog:
         handler.setFormatter(formatter)
         logfile = logging.getLogger("logfile")
         logfile.setLevel(logging.INFO)
+        logfile.handlers.clear()
         logfile.addHandler(handler)
 
         self.stdout = logstd
         self.file = logfile
 
 
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    """
+    Connection that leaves the time of its connect to the calling thread
+    """
+
+    def connect(self):
+        timestart = time.perf_counter()
+        super().connect()
+        HttpPool.timing.connect = time.perf_counter() - timestart
+
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def connect(self):
+        timestart = time.perf_counter()
+        super().connect()
+        HttpPool.timing.connect = time.perf_counter() - timestart
+
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(requests.adapters.HTTPAdapter):
+    """
+    Adapter whose pools measure connect time (TCP and TLS handshake)
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class HttpPool:
+    """
+    Keeps one requests session with a pool of keep-alive connections per
+    host, shared by all tests of the process
+    """
+
+    POOL_SIZE = 16
+    sessions = {}
+    lock = threading.Lock()
+    # connect time of the last request of the thread, None if the request
+    # reused a keep-alive connection
+    timing = threading.local()
+
+    def Session(url):
+        """
+        Returns session for the host of url
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        with HttpPool.lock:
+            session = HttpPool.sessions.get(key)
+            if session is not None:
+                return session
+            session = requests.Session()
+            adapter = TimedAdapter(
+                pool_connections=1, pool_maxsize=HttpPool.POOL_SIZE
+            )
+            session.mount(f"{parts.scheme}://", adapter)
+            HttpPool.sessions[key] = session
+            return session
+
+
+class HttpCassette:
+    """
+    Stores responses of http requests on disk and serves them back, so tests
+    can run without the services they call. Every response is a json file
+    named after hash of method, URL and body of the request; index.json
+    lists them all.
+    """
+
+    def __init__(self, directory, replay, latency=None):
+        self.directory = directory
+        self.replay = replay
+        self.latency = HttpCassette.Latency(latency)
+        self.responses = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def Latency(spec):
+        """
+        Parses latency profile: None, "recorded", SECONDS or SECONDS+-JITTER
+        """
+        if not spec:
+            return None
+        if spec == "recorded":
+            return spec
+        delay, _, jitter = spec.partition("+-")
+        delay, jitter = float(delay), float(jitter or 0)
+        if delay < 0 or jitter < 0:
+            raise ValueError(spec)
+        return (delay, jitter)
+
+    def Key(method, url, data):
+        # GET requests are sent without body
+        body = "" if method == "GET" else json.dumps(data, sort_keys=True)
+        return hashlib.sha256(
+            "\n".join(
+                (method, url, hashlib.sha256(body.encode()).hexdigest())
+            ).encode()
+        ).hexdigest()
+
+    def Record(self, method, url, data, response):
+        """
+        Stores the response of the request, raises OSError if it can not be
+        written
+        """
+        key = HttpCassette.Key(method, url, data)
+        entry = {
+            "method": method,
+            "url": url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": dict(response.headers),
+            "body": response.text,
+            "elapsed": response.elapsed.total_seconds(),
+        }
+        # workers of a parallel run and parallel statements may record the
+        # same request
+        filename = self.directory + os.sep + key + ".json"
+        tmpname = f"{filename}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmpname, mode="w", encoding="utf-8") as f:
+                json.dump(entry, f, indent=1)
+            os.replace(tmpname, filename)
+        except OSError:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+
+    def Replay(self, method, url, data):
+        """
+        Returns recorded response for the request after simulated latency
+        """
+        key = HttpCassette.Key(method, url, data)
+        with self.lock:
+            entry = self.responses.get(key)
+            if entry is None:
+                try:
+                    with open(
+                        self.directory + os.sep + key + ".json",
+                        mode="r",
+                        encoding="utf-8",
+                    ) as f:
+                        entry = json.load(f)
+                except FileNotFoundError:
+                    raise requests.RequestException(
+                        f"No recorded response for {method} {url}"
+                    )
+                except ValueError as error:
+                    raise requests.RequestException(
+                        f"Broken recorded response for {method} {url}:"
+                        f" {error}"
+                    )
+                self.responses[key] = entry
+        if self.latency == "recorded":
+            delay = entry["elapsed"]
+        elif self.latency is not None:
+            delay = max(
+                self.latency[0]
+                + random.uniform(-self.latency[1], self.latency[1]),
+                0.0,
+            )
+        else:
+            delay = 0.0
+        time.sleep(delay)
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = requests.structures.CaseInsensitiveDict(
+            entry["headers"]
+        )
+        # the body is stored decoded, compression does not apply any more
+        response.headers.pop("Content-Encoding", None)
+        response._content = entry["body"].encode()
+        response.encoding = "utf-8"
+        response.url = url
+        response.elapsed = datetime.timedelta(seconds=delay)
+        return response
+
+    def Save(self):
+        """
+        Writes index of all recorded responses
+        """
+        index = {}
+        for file in os.scandir(self.directory):
+            if not file.name.endswith(".json") or file.name == "index.json":
+                continue
+            with open(file.path, mode="r", encoding="utf-8") as f:
+                entry = json.load(f)
+            index[file.name[: -len(".json")]] = {
+                key: entry[key] for key in ("method", "url", "status")
+            }
+        with open(
+            self.directory + os.sep + "index.json", mode="w", encoding="utf-8"
+        ) as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+
+
+class ResultWriter:
+    """
+    Collects detailed results of a test and writes them to results dir at
+    once: free text to <id>.log and one json record per statement to
+    <id>.jsonl
+    """
+
+    # flush buffers when they grow that big
+    BUFFER_LIMIT = 1024 * 1024
+
+    def __init__(self, test_id):
+        self.enabled = bool(opt.cmdargs.results_dir)
+        if self.enabled:
+            self.basename = opt.cmdargs.results_dir + os.sep + str(test_id)
+        self.text = []
+        self.records = []
+        self.size = 0
+        # statements of parallel groups report from their own threads
+        self.lock = threading.Lock()
+
+    def Write(self, datastring):
+        if self.enabled:
+            with self.lock:
+                self.text.append(datastring + "\n" + ("=" * 80) + "\n")
+                self.size += len(datastring)
+                if self.size > self.BUFFER_LIMIT:
+                    self._flush()
+
+    def Record(self, record):
+        if self.enabled:
+            with self.lock:
+                self.records.append(record)
+
+    def Flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.text:
+            with open(self.basename + ".log", mode="a", encoding="utf-8") as f:
+                f.write("".join(self.text))
+        if self.records:
+            with open(
+                self.basename + ".jsonl", mode="a", encoding="utf-8"
+            ) as f:
+                for record in self.records:
+                    f.write(json.dumps(record, default=str) + "\n")
+        self.text = []
+        self.records = []
+        self.size = 0
+
+    def Close(self):
+        if self.enabled:
+            self.Flush()
+
+
+class Profiler:
+    """
+    Splits wall time of tests into phases: preparing, executing and fetching
+    sql statements, http requests, child processes, checking results and
+    logging. The rest of the test time is the overhead of the script itself.
+    Only the thread running the test is measured, time it waits for parallel
+    statements and load sessions is a phase of its own. In cprofile mode
+    python profiler is run as well to find hot spots.
+    """
+
+    PHASES = (
+        "prepare",
+        "execute",
+        "fetch",
+        "http",
+        "subprocess",
+        "check",
+        "logging",
+        "parallel",
+        "load",
+    )
+
+    def __init__(self, mode, dumpfile=None):
+        """
+        dumpfile is where worker processes leave profiler stats for the main
+        one
+        """
+        self.phases = collections.Counter()
+        self.lock = threading.Lock()
+        self.cprofile = cProfile.Profile() if mode == "cprofile" else None
+        self.dumpfile = dumpfile
+        self.thread = None
+
+    def Add(self, name, seconds):
+        with self.lock:
+            self.phases[name] += seconds
+
+    def Start(self):
+        with self.lock:
+            self.phases.clear()
+        self.thread = threading.get_ident()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def Stop(self, duration):
+        """
+        Returns phases of the test finished, duration is its wall time
+        """
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            if self.dumpfile:
+                self.cprofile.dump_stats(self.dumpfile)
+        with self.lock:
+            phases = {name: self.phases[name] for name in self.PHASES}
+        phases["harness"] = max(duration - sum(phases.values()), 0.0)
+        return phases
+
+
+class Phase:
+    """
+    Measures time spent in a block of code for the profiler
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timestart = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        profiler.Add(self.name, time.perf_counter() - self.timestart)
+
+
+NO_PHASE = contextlib.nullcontext()
+
+
+def phase(name):
+    """
+    Returns context manager measuring given phase when --timing_profile is
+    on and it is called from the thread running the test
+    """
+    if profiler is None or profiler.thread != threading.get_ident():
+        return NO_PHASE
+    return Phase(name)
+
+
 class Firebird:
     """
     Implements database processing
     """
 
+    # statements that change metadata and so make prepared statements stale
+    DDL = re.compile(
+        r"\s*(CREATE|ALTER|DROP|RECREATE|COMMENT|GRANT|REVOKE|DECLARE|SET)\b",
+        re.IGNORECASE,
+    )
+
+    # isolation levels available for sessions of a test
+    ISOLATION = {
+        "read_committed": (
+            fdb.isc_tpb_read_committed,
+            fdb.isc_tpb_rec_version,
+        ),
+        "read_committed_no_record_version": (
+            fdb.isc_tpb_read_committed,
+            fdb.isc_tpb_no_rec_version,
+        ),
+        "snapshot": fdb.isc_tpb_concurrency,
+        "snapshot_table_stability": fdb.isc_tpb_consistency,
+    }
+
+    # all attachments of the process, they drop prepared statements
+    # together when metadata changes
+    live = weakref.WeakSet()
+    live_lock = threading.Lock()
+
+    def __init__(self, cache_size=64):
+        """
+        cache_size is the number of prepared statements kept for reuse
+        """
+        self.cache_size = cache_size
+        self.statements = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.cache_version = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # statement prepared by the last Execute, its plan is read from it
+        self.last_prepared = None
+        self.autocommit = True
+        self.io_overhead = None
+        with Firebird.live_lock:
+            Firebird.live.add(self)
+
     def Connect(
         self,
         database,
@@ -182,9 +957,13 @@ class Firebird:
         host="127.0.0.1",
         port=3050,
         charset="UTF8",
+        tpb=None,
+        role=None,
+        buffers=None,
     ):
         """
-        Connect to database with the params provided
+        Connect to database with the params provided. tpb is used for all
+        transactions started with Begin.
         """
         self.username = username
         self.password = password
@@ -199,184 +978,1616 @@ class Firebird:
             port=self.port,
             database=self.database,
             charset=self.charset,
+            role=role,
+            buffers=buffers,
         )
+        if tpb is not None:
+            self.db.main_transaction.default_tpb = tpb
+        self.cur = self.db.cursor()
 
-    def Execute(self, statement, params=None):
+    def Tpb(isolation="read_committed", lock_timeout=None):
+        """
+        Returns transaction parameters block. Without lock_timeout the
+        transaction waits for locks forever, 0 means no wait.
+        """
+        tpb = fdb.TPB()
+        tpb.isolation_level = Firebird.ISOLATION[isolation]
+        if lock_timeout is None:
+            tpb.lock_resolution = fdb.isc_tpb_wait
+        elif int(lock_timeout) == 0:
+            tpb.lock_resolution = fdb.isc_tpb_nowait
+        else:
+            tpb.lock_resolution = fdb.isc_tpb_wait
+            tpb.lock_timeout = int(lock_timeout)
+        return tpb.render()
+
+    def LockWaits(self):
+        """
+        Returns number of record lock waits of the attachment or None if
+        the server does not count them (Firebird 2.5 and older)
+        """
+        if self.db.engine_version < 3.0:
+            return None
+        tr = self.db.trans(fdb.ISOLATION_LEVEL_READ_COMMITED_RO)
+        try:
+            cur = tr.cursor()
+            cur.execute(
+                "select rec.mon$record_waits from mon$attachments a"
+                " join mon$record_stats rec on rec.mon$stat_id = a.mon$stat_id"
+                " where a.mon$attachment_id = current_connection"
+            )
+            return cur.fetchone()[0]
+        except fdb.Error:
+            return None
+        finally:
+            tr.commit()
+
+    def ServerSnapshot(self):
+        """
+        Returns database wide counters from monitoring tables: transaction
+        markers, memory of the database and numbers of other attachments and
+        their transactions. Returns error message on failure.
+        """
+        tr = self.db.trans(fdb.ISOLATION_LEVEL_READ_COMMITED_RO)
+        try:
+            cur = tr.cursor()
+            cur.execute(
+                "select d.mon$oldest_transaction, d.mon$oldest_active,"
+                " d.mon$oldest_snapshot, d.mon$next_transaction,"
+                " mem.mon$memory_used, mem.mon$memory_allocated,"
+                " (select count(*) from mon$attachments a"
+                " where a.mon$attachment_id <> current_connection),"
+                " (select count(*) from mon$transactions t"
+                " where t.mon$attachment_id <> current_connection)"
+                " from mon$database d"
+                " join mon$memory_usage mem on mem.mon$stat_id = d.mon$stat_id"
+            )
+            snap = dict(
+                zip(
+                    (
+                        "oldest",
+                        "oldest_active",
+                        "oldest_snapshot",
+                        "next",
+                        "memory",
+                        "memory_allocated",
+                        "attachments",
+                        "transactions",
+                    ),
+                    cur.fetchone(),
+                )
+            )
+        except fdb.Error as error:
+            return str(error)
+        finally:
+            # a lost attachment must not stop the sampler thread
+            try:
+                tr.commit()
+            except fdb.Error:
+                pass
+        # transactions after the oldest active one keep record versions
+        # garbage collection can not remove
+        snap["gap"] = snap["next"] - snap["oldest_active"]
+        return snap
+
+    def MetadataHash(self):
+        """
+        Returns hash of table columns and indices of the database or None if
+        they can not be read
+        """
+        tr = self.db.trans(fdb.ISOLATION_LEVEL_READ_COMMITED_RO)
+        digest = hashlib.sha256()
+        try:
+            cur = tr.cursor()
+            cur.execute(
+                "select trim(rdb$relation_name), trim(rdb$field_name),"
+                " trim(rdb$field_source) from rdb$relation_fields"
+                " order by 1, 2"
+            )
+            for row in cur.fetchall():
+                digest.update("\t".join(row).encode() + b"\n")
+            cur.execute(
+                "select trim(s.rdb$index_name), trim(s.rdb$field_name)"
+                " from rdb$index_segments s"
+                " order by 1, s.rdb$field_position"
+            )
+            for row in cur.fetchall():
+                digest.update("\t".join(row).encode() + b"\n")
+        except fdb.Error:
+            return None
+        finally:
+            tr.commit()
+        return digest.hexdigest()
+
+    def Close(self):
+        """
+        Disconnect from database
+        """
+        self.InvalidateCache()
+        self.last_prepared = None
+        self.db.close()
+
+    def InvalidateCache(self):
+        """
+        Drop all prepared statements of the attachment
+        """
+        with self.cache_lock:
+            self.statements.clear()
+
+    def MetadataChanged():
+        """
+        Drops prepared statements of all attachments of the process, workers
+        of a parallel run drop theirs before their next statement. Must be
+        called before metadata is changed, as prepared statements keep locks
+        on objects they use.
+        """
+        if metadata_version is not None:
+            with metadata_version.get_lock():
+                metadata_version.value += 1
+        with Firebird.live_lock:
+            conns = list(Firebird.live)
+        for conn in conns:
+            conn.InvalidateCache()
+
+    def Prepare(self, statement, cache=True):
+        """
+        Returns prepared statement for the given text, reusing previously
+        prepared one when possible. DDL statements are not cached and
+        invalidate the cache instead.
+        """
+        statement = statement.strip()
+        if self.DDL.match(statement):
+            Firebird.MetadataChanged()
+            return statement
+        version = 0 if metadata_version is None else metadata_version.value
+        with self.cache_lock:
+            if version != self.cache_version:
+                # another worker changed metadata
+                self.statements.clear()
+                self.cache_version = version
+            prepared = self.statements.get(statement)
+            if prepared is not None:
+                self.cache_hits += 1
+                self.statements.move_to_end(statement)
+                return prepared
+            if cache:
+                self.cache_misses += 1
+        prepared = self.cur.prep(statement)
+        if cache and self.cache_size > 0:
+            with self.cache_lock:
+                self.statements[statement] = prepared
+                if len(self.statements) > self.cache_size:
+                    self.statements.popitem(last=False)
+        return prepared
+
+    def Plan(self, statement):
+        """
+        Returns plan of the statement just executed by Execute or None if it
+        was not prepared
+        """
+        prepared = self.last_prepared
+        if prepared is None or isinstance(prepared, str):
+            return None
+        if prepared.sql != statement.strip():
+            return None
+        try:
+            return prepared.plan
+        except fdb.Error:
+            return None
+
+    def IoSnapshot(self):
+        """
+        Returns I/O, memory and per table record counters of the current
+        attachment from monitoring tables. Every call starts a new transaction
+        as monitoring snapshot is stable within one.
+        """
+        tr = self.db.trans(fdb.ISOLATION_LEVEL_READ_COMMITED_RO)
+        try:
+            cur = tr.cursor()
+            cur.execute(
+                "select io.mon$page_reads, io.mon$page_writes,"
+                " io.mon$page_fetches, io.mon$page_marks,"
+                " mem.mon$memory_used, mem.mon$max_memory_used,"
+                " rec.mon$record_seq_reads, rec.mon$record_idx_reads"
+                " from mon$attachments a"
+                " join mon$io_stats io on io.mon$stat_id = a.mon$stat_id"
+                " join mon$memory_usage mem on mem.mon$stat_id = a.mon$stat_id"
+                " join mon$record_stats rec on rec.mon$stat_id = a.mon$stat_id"
+                " where a.mon$attachment_id = current_connection"
+            )
+            row = cur.fetchone()
+            snap = dict(
+                zip(
+                    (
+                        "reads",
+                        "writes",
+                        "fetches",
+                        "marks",
+                        "memory",
+                        "max_memory",
+                        "seq_reads",
+                        "idx_reads",
+                    ),
+                    row,
+                )
+            )
+            # mon$table_stats appeared in Firebird 3, None tells the checks
+            # that per table counters are not available
+            snap["tables"] = None
+            if self.db.engine_version >= 3.0:
+                snap["tables"] = {}
+                cur.execute(
+                    "select trim(t.mon$table_name), rec.mon$record_seq_reads,"
+                    " rec.mon$record_idx_reads"
+                    " from mon$attachments a"
+                    " join mon$table_stats t on t.mon$stat_id = a.mon$stat_id"
+                    " join mon$record_stats rec"
+                    " on rec.mon$stat_id = t.mon$record_stat_id"
+                    " where a.mon$attachment_id = current_connection"
+                )
+                for table, seq_reads, idx_reads in cur.fetchall():
+                    snap["tables"][table] = (seq_reads, idx_reads)
+        finally:
+            tr.commit()
+        return snap
+
+    def IoDelta(self, before, after):
+        """
+        Difference between two snapshots. Counters produced by taking the
+        snapshots themselves are measured once and subtracted.
+        """
+        if self.io_overhead is None:
+            first = self.IoSnapshot()
+            self.io_overhead = self._io_diff(first, self.IoSnapshot(), {})
+        return self._io_diff(before, after, self.io_overhead)
+
+    def _io_diff(self, before, after, overhead):
+        delta = {}
+        for key in (
+            "reads",
+            "writes",
+            "fetches",
+            "marks",
+            "seq_reads",
+            "idx_reads",
+        ):
+            delta[key] = max(
+                after[key] - before[key] - overhead.get(key, 0), 0
+            )
+        delta["memory"] = after["memory"] - before["memory"]
+        delta["max_memory"] = after["max_memory"]
+        if after["tables"] is None:
+            delta["tables"] = None
+            return delta
+        delta["tables"] = {}
+        for table, (seq_reads, idx_reads) in after["tables"].items():
+            seq_before, idx_before = before["tables"].get(table, (0, 0))
+            if seq_reads != seq_before or idx_reads != idx_before:
+                delta["tables"][table] = (
+                    seq_reads - seq_before,
+                    idx_reads - idx_before,
+                )
+        return delta
+
+    def CacheStats(self):
+        """
+        Returns current values of the statement cache counters
+        """
+        return self.cache_hits, self.cache_misses
+
+    def Begin(self):
+        """
+        Start a transaction that spans all following statements until
+        Commit or Rollback is called
+        """
+        self.autocommit = False
+        if not self.db.main_transaction.active:
+            self.db.main_transaction.begin()
+
+    def Commit(self):
+        """
+        Commit the transaction started by Begin
+        """
+        self.db.main_transaction.commit()
+        self.autocommit = True
+
+    def Rollback(self):
+        """
+        Rollback the transaction started by Begin
+        """
+        self.db.main_transaction.rollback()
+        self.autocommit = True
+
+    def _finish(self, cur, savepoint, failed):
+        """
+        Ends statement: commits or rolls back the whole transaction in
+        autocommit mode, otherwise undoes failed statement up to savepoint
+        """
+        cur.close()
+        if self.autocommit:
+            if failed:
+                cur.transaction.rollback()
+            else:
+                cur.transaction.commit()
+        elif failed and savepoint:
+            cur.transaction.rollback(savepoint=savepoint)
+
+    def Execute(
+        self, statement, params=None, savepoint=None, cache=True, stream=None
+    ):
         """
         Executes statement and returns dict with corresponding values or tulip
         with error information (error string, deprecated sql error code, gds
-        error code)
+        error code). Within transaction started by Begin the statement is not
+        committed, and if savepoint name is given, failure of the statement
+        is rolled back to it. One-off statements should be executed with
+        cache=False to keep them out of the statement cache. If ResultStream
+        is given, all rows are passed through it, otherwise only the first
+        one is fetched.
         """
-        cur = self.db.cursor()
+        cur = self.cur
         noresset = (
             "Attempt to fetch row of results after statement that does"
             " not produce result set."
         )
+        if savepoint and not self.autocommit:
+            cur.transaction.savepoint(savepoint)
+        self.last_prepared = None
         try:
-            cur.execute(statement, params)
-            res = cur.fetchonemap()
-            cur.transaction.commit()
+            with phase("prepare"):
+                prepared = self.Prepare(statement, cache)
+            self.last_prepared = prepared
+            if stream is not None:
+                stream.started = time.perf_counter()
+            with phase("execute"):
+                cur.execute(prepared, params)
+            with phase("fetch"):
+                if stream is not None:
+                    res = stream.Consume(cur)
+                else:
+                    res = cur.fetchonemap()
+            self._finish(cur, savepoint, False)
         except fdb.Error as fdberror:
             if fdberror.args[0] == noresset:
-                cur.transaction.commit()
-                cur.close()
+                self._finish(cur, savepoint, False)
                 res = dict()
             else:
-                cur.transaction.rollback()
-                cur.close()
+                self._finish(cur, savepoint, True)
                 res = fdberror.args
         except Exception as error:
-            cur.transaction.rollback()
-            cur.close()
+            self._finish(cur, savepoint, True)
             res = error.args
         finally:
             return res
 
+    def ExecuteMany(self, statement, rows):
+        """
+        Executes statement once for every set of params in rows, returns
+        empty dict on success and error tulip like Execute otherwise
+        """
+        cur = self.cur
+        try:
+            with phase("execute"):
+                cur.executemany(self.Prepare(statement), rows)
+            self._finish(cur, None, False)
+            res = dict()
+        except fdb.Error as fdberror:
+            self._finish(cur, None, True)
+            res = fdberror.args
+        return res
+
+    def Values(self, statement):
+        """
+        Returns list of values of the first column of all rows returned by
+        statement or error tulip like Execute
+        """
+        cur = self.cur
+        try:
+            cur.execute(self.Prepare(statement, False))
+            res = [row[0] for row in cur.fetchall()]
+            self._finish(cur, None, False)
+        except fdb.Error as fdberror:
+            self._finish(cur, None, True)
+            res = fdberror.args
+        return res
+
 
 class Adds:
-    def IsDigit(value):
+    def Percentile(values, percent):
+        """
+        Nearest-rank percentile of already sorted values
+        """
+        if not values:
+            return 0.0
+        rank = max(int(-(-len(values) * percent // 100)), 1)
+        return values[min(rank, len(values)) - 1]
+
+
+class Matcher:
+    """
+    Expected value compiled once into a predicate. Supported forms are
+    numbers, `>x`, `<x`, `>=x`, `<=x`, ranges `10..20`, tolerance
+    `100 +- 0.5` or `100 +- 1%`, `re:pattern`, `decimal:12.50`, null and
+    lists of allowed values. Anything else is compared as a string.
+    """
+
+    RANGE = re.compile(r"^\s*(\S+?)\s*\.\.\s*(\S+)\s*$")
+    TOLERANCE = re.compile(r"^\s*(\S+)\s*\+-\s*(\S+?)(%?)\s*$")
+    COMPARISON = re.compile(r"^(>=|<=|>|<)(.*)$")
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.Match = self._compile(expected)
+
+    def __repr__(self):
+        return repr(self.expected)
+
+    def __reduce__(self):
+        # predicates are closures, so matchers are compiled again when tests
+        # are passed to worker processes
+        return (Matcher, (self.expected,))
+
+    def Number(value):
+        """
+        Returns value as float or None if it is not a number
+        """
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float, decimal.Decimal)):
+            return float(value)
         try:
-            float(value)
-            return True
-        except ValueError:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def _compile(self, expected):
+        text = str(expected)
+        if expected is None:
+            return lambda value: value is None or str(value) == "None"
+        if isinstance(expected, (list, tuple, set)):
+            options = [Matcher(item).Match for item in expected]
+            return lambda value: any(match(value) for match in options)
+        if isinstance(expected, str):
+            # a typo in one expectation must make only its test unloadable
+            try:
+                if text.startswith("re:"):
+                    pattern = re.compile(text[3:])
+                elif text.startswith("decimal:"):
+                    exact = decimal.Decimal(text[8:].strip())
+            except (re.error, decimal.InvalidOperation) as error:
+                raise ValueError(f"bad expectation {expected!r}: {error}")
+            if text.startswith("re:"):
+                return lambda value: pattern.search(str(value)) is not None
+            if text.startswith("decimal:"):
+                return lambda value: Matcher._decimal(value) == exact
+            found = self.RANGE.match(text)
+            if found:
+                low, high = map(Matcher.Number, found.groups())
+                if low is not None and high is not None:
+                    return lambda value: self._numeric(
+                        value, lambda number: low <= number <= high
+                    )
+            found = self.TOLERANCE.match(text)
+            if found:
+                center, delta = map(Matcher.Number, found.groups()[:2])
+                if center is not None and delta is not None:
+                    if found.group(3):
+                        delta = abs(center) * delta / 100
+                    return lambda value: self._numeric(
+                        value, lambda number: abs(number - center) <= delta
+                    )
+            found = self.COMPARISON.match(text)
+            if found and Matcher.Number(found.group(2)) is not None:
+                limit = Matcher.Number(found.group(2))
+                check = {
+                    ">": lambda number: number > limit,
+                    "<": lambda number: number < limit,
+                    ">=": lambda number: number >= limit,
+                    "<=": lambda number: number <= limit,
+                }[found.group(1)]
+                return lambda value: self._numeric(value, check)
+        number = Matcher.Number(expected)
+        if number is not None:
+            return lambda value: self._numeric(
+                value, lambda received: received == number
+            )
+        return lambda value: str(value) == text
+
+    def _decimal(value):
+        try:
+            return decimal.Decimal(str(value))
+        except decimal.InvalidOperation:
+            return None
+
+    def _numeric(self, value, check):
+        """
+        Applies numeric check, values that are not numbers are compared with
+        the expected one as strings
+        """
+        number = Matcher.Number(value)
+        if number is None:
+            return str(value) == str(self.expected)
+        return check(number)
+
+
+class FixtureLedger:
+    """
+    Keeps hashes of data files already applied to the database in a table of
+    that database, so restoring or resetting it also resets the ledger
+    """
+
+    TABLE = "FDBTEST_FIXTURES"
+
+    def __init__(self):
+        self.hashes = {}
+
+    def Hash(self, filename):
+        if filename not in self.hashes:
+            digest = hashlib.sha256()
+            with open(filename, mode="rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            self.hashes[filename] = digest.hexdigest()
+        return self.hashes[filename]
+
+    def _exists(self, conn):
+        res = conn.Execute(
+            "select count(*) as cnt from rdb$relations"
+            f" where rdb$relation_name = '{self.TABLE}'"
+        )
+        return type(res) is dict and res.get("CNT") == 1
+
+    def Applied(self, conn, filename):
+        """
+        Returns True if file with the same content was already applied
+        """
+        if not self._exists(conn):
             return False
+        res = conn.Execute(
+            f"select count(*) as cnt from {self.TABLE} where hash = ?",
+            [self.Hash(filename)],
+        )
+        return type(res) is dict and res.get("CNT", 0) > 0
 
+    def Record(self, conn, filename):
+        if not self._exists(conn):
+            conn.Execute(
+                f"create table {self.TABLE} ("
+                " hash varchar(64) not null primary key,"
+                " filename varchar(1024),"
+                " applied_at timestamp default current_timestamp)"
+            )
+        res = conn.Execute(
+            f"insert into {self.TABLE} (hash, filename) values (?, ?)",
+            [self.Hash(filename), filename[-1024:]],
+        )
+        if type(res) is tuple:
+            log.file.error(f"Can not record fixture {filename}: {res[0]}")
 
-class SingleTest:
+
+class ResultStream:
     """
-    Processes a single test file
+    Reads the whole result set of a statement in batches, counting and
+    hashing rows and comparing them with a golden CSV file on the fly, so
+    memory use does not depend on the size of the result
     """
 
-    def __init__(self, filename):
+    KEYS = (
+        "expect_rowcount",
+        "expect_result_hash",
+        "expect_result_file",
+        "expect_all",
+    )
+
+    def __init__(self, statement, batch=1000, matchers=None):
+        """
+        matchers is a dict of column names and Matcher objects every value
+        of the column must match
+        """
+        self.batch = statement.get("fetch_batch", batch)
+        self.matchers = matchers or {}
+        self.wrong_value = None
+        self.golden = statement.get("expect_result_file")
+        self.rows = 0
+        self.hash = hashlib.sha256()
+        self.started = time.perf_counter()
+        self.first_row = None
+        self.last_row = None
+        self.mismatch = None
+        self.error = None
+
+    # NULL differs from empty string in hashes and golden files
+    NULL = "\\N"
+
+    def Row(value):
+        """
+        Returns row as a list of strings, NULL is represented by \\N
+        """
+        return [
+            ResultStream.NULL if item is None else str(item) for item in value
+        ]
+
+    def Consume(self, cur):
+        """
+        Fetches all rows from executed cursor, returns the first of them as
+        a dict like fetchonemap does
+        """
+        first = dict()
+        columns = []
+        golden = None
+        if self.golden:
+            try:
+                golden = open(
+                    self.golden, mode="r", encoding="utf-8", newline=""
+                )
+            except OSError as error:
+                self.error = f"Can not read {self.golden}: {error}"
+        try:
+            expected = csv.reader(golden) if golden else None
+            while True:
+                rows = cur.fetchmany(self.batch)
+                if not rows:
+                    break
+                if self.first_row is None:
+                    self.first_row = time.perf_counter() - self.started
+                    first = {
+                        column[0]: value
+                        for column, value in zip(cur.description, rows[0])
+                    }
+                    columns = self._columns(cur.description)
+                if columns and self.wrong_value is None:
+                    self._match(columns, rows)
+                for value in rows:
+                    self.rows += 1
+                    row = ResultStream.Row(value)
+                    self.hash.update(
+                        ("\t".join(row) + "\n").encode("utf-8")
+                    )
+                    if expected is not None and self.mismatch is None:
+                        self._compare(next(expected, None), row)
+            if expected is not None and self.mismatch is None:
+                extra = next(expected, None)
+                if extra is not None:
+                    self.mismatch = (self.rows + 1, extra, None)
+        finally:
+            if golden:
+                golden.close()
+            self.last_row = time.perf_counter() - self.started
+        return first
+
+    def _columns(self, description):
+        """
+        Returns list of (position, name, matcher) for checked columns
+        """
+        names = [column[0] for column in description]
+        columns = []
+        for name, matcher in self.matchers.items():
+            if name not in names:
+                self.error = f"Column {name} is not in the result"
+                continue
+            columns.append((names.index(name), name, matcher))
+        return columns
+
+    def _match(self, columns, rows):
         """
-        Create the necessary object from given yaml
+        Checks the whole batch column by column, remembers the first value
+        that does not match
         """
+        for pos, name, matcher in columns:
+            if all(map(matcher.Match, [row[pos] for row in rows])):
+                continue
+            for number, row in enumerate(rows):
+                if not matcher.Match(row[pos]):
+                    number += self.rows + 1
+                    if self.wrong_value is None or (
+                        number < self.wrong_value[0]
+                    ):
+                        self.wrong_value = (number, name, row[pos], matcher)
+                    break
+
+    def _compare(self, expected, row):
+        if expected != row:
+            self.mismatch = (self.rows, expected, row)
+
+    def Record(self):
+        return {
+            "count": self.rows,
+            "sha256": self.hash.hexdigest(),
+            "first_row": self.first_row,
+            "last_row": self.last_row,
+        }
+
+
+class IsqlOnly(Exception):
+    """
+    Script uses isql commands that can not be executed over an attachment
+    """
+
+
+class SqlScript:
+    """
+    Splits isql script into statements and executes them over an existing
+    attachment. Consecutive INSERTs are sent to the server in EXECUTE BLOCKs.
+    """
+
+    # isql commands which only affect output and are safe to skip
+    OUTPUT_COMMANDS = (
+        "BLOB",
+        "BLOBDISPLAY",
+        "COUNT",
+        "ECHO",
+        "EXEC_PATH_DISPLAY",
+        "EXPLAIN",
+        "HEADING",
+        "KEEP_TRAN_PARAMS",
+        "LIST",
+        "MAXROWS",
+        "PER_TABLE_STATS",
+        "PLAN",
+        "PLANONLY",
+        "ROWCOUNT",
+        "STATS",
+        "TIME",
+        "WARNINGS",
+        "WIDTH",
+        "WNG",
+    )
+    ISQL_COMMANDS = (
+        "ADD",
+        "BLOBDUMP",
+        "BLOBVIEW",
+        "CONNECT",
+        "COPY",
+        "EDIT",
+        "EXIT",
+        "HELP",
+        "INPUT",
+        "OUTPUT",
+        "QUIT",
+        "SHELL",
+        "SHOW",
+    )
+    LEADING_COMMENTS = re.compile(
+        r"(\s*(--[^\n]*(\n|$)|/\*.*?\*/))*\s*", re.DOTALL
+    )
+    INSERT = re.compile(r"INSERT\s+INTO\s", re.IGNORECASE)
+    RETURNING = re.compile(r"\bRETURNING\b", re.IGNORECASE)
+    # Firebird 2.5 refuses statement text over 64K (3.0 raised the limit to
+    # 10M), blocks stay below it to load on every supported server
+    BLOCK_LIMIT = 60000
+
+    def __init__(self, filename, charset="UTF8"):
         with open(filename, mode="r", encoding="utf-8") as f:
-            # self.fullYaml = yaml.safe_load(f)
-            self.__dict__ = yaml.safe_load(f)
+            text = f.read()
+        self.charset = charset
+        self.statements = self.Parse(text)
+        # set by watchdog from other thread to stop the script
+        self.cancelled = False
 
-    def StoreRes(self, datastring):
-        if opt.cmdargs.results_dir:
-            with open(
-                opt.cmdargs.results_dir + os.sep + self.id + ".log",
-                mode="a",
-                encoding="utf-8",
-            ) as f:
-                f.write(datastring + "\n" + ("=" * 80) + "\n")
+    def Parse(self, text):
+        """
+        Returns list of (command, statement) pairs. Raises IsqlOnly when the
+        script can not be executed without isql.
+        """
+        statements = []
+        term = ";"
+        scanner = None
+        current = []
+        pos = 0
+        while True:
+            if scanner is None:
+                scanner = re.compile(r"--|/\*|'|\"|" + re.escape(term))
+            match = scanner.search(text, pos)
+            if match is None:
+                current.append(text[pos:])
+                break
+            token = match.group()
+            current.append(text[pos : match.start()])
+            if token == "--":
+                end = text.find("\n", match.end())
+                end = len(text) if end < 0 else end + 1
+            elif token == "/*":
+                end = text.find("*/", match.end())
+                end = len(text) if end < 0 else end + 2
+            elif token in ("'", '"'):
+                end = match.end()
+                while True:
+                    end = text.find(token, end)
+                    if end < 0:
+                        end = len(text)
+                        break
+                    if text.startswith(token * 2, end):
+                        end += 2
+                    else:
+                        end += 1
+                        break
+            else:
+                newterm = self._add_statement(
+                    statements, "".join(current), term
+                )
+                if newterm != term:
+                    term, scanner = newterm, None
+                current = []
+                pos = match.end()
+                continue
+            current.append(text[match.start() : end])
+            pos = end
+        self._add_statement(statements, "".join(current), term)
+        return statements
 
-    def CompareValues(self, received, expected):
-        if Adds.IsDigit(expected) and Adds.IsDigit(received):
-            return float(received) == float(expected)
-        elif (
-            (expected[:1] == ">")
-            and Adds.IsDigit(received)
-            and Adds.IsDigit(expected[1:])
+    def _add_statement(self, statements, statement, term):
+        """
+        Classifies the statement and adds it to the list. Returns terminator
+        that is in effect after the statement.
+        """
+        head = self.LEADING_COMMENTS.sub("", statement, count=1).strip()
+        if not head:
+            return term
+        words = head.upper().split()
+        if words[0] in self.ISQL_COMMANDS or (
+            words[:2] == ["CREATE", "DATABASE"]
         ):
-            return float(received) > float(expected[1:])
-        elif (
-            (expected[:1] == "<")
-            and Adds.IsDigit(received)
-            and Adds.IsDigit(expected[1:])
+            raise IsqlOnly(" ".join(words[:2]))
+        if words[0] in ("COMMIT", "ROLLBACK") and (
+            len(words) == 1 or words[1:] == ["WORK"]
         ):
-            return float(received) < float(expected[1:])
+            statements.append((words[0].lower(), head))
+        elif words[0] == "SET" and len(words) > 1:
+            if words[1] == "TERM":
+                return head.split()[2]
+            elif words[1] in ("AUTODDL", "BAIL"):
+                statements.append(
+                    (words[1].lower(), len(words) < 3 or words[2] == "ON")
+                )
+            elif words[1] in self.OUTPUT_COMMANDS:
+                pass
+            elif words[1] == "NAMES":
+                if words[2:3] != [self.charset.upper()]:
+                    raise IsqlOnly(head)
+            elif words[1:3] == ["SQL", "DIALECT"]:
+                if words[3:4] != ["3"]:
+                    raise IsqlOnly(head)
+            elif words[1] == "TRANSACTION":
+                raise IsqlOnly(head)
+            else:
+                statements.append(("sql", statement.strip()))
+        else:
+            statements.append(("sql", statement.strip()))
+        return term
+
+    def Run(self, conn):
+        """
+        Executes parsed statements. Returns True if all of them succeeded and
+        text with the details.
+        """
+        self.conn = conn
+        self.errors = []
+        self.executed = 0
+        self.blocks = 0
+        autoddl = True
+        bail = False
+        batch = []
+        batch_size = 0
+        uncommitted = 0
+        timestart = time.perf_counter()
+        conn.Begin()
+        try:
+            for command, statement in self.statements:
+                if self.cancelled:
+                    self.errors.append((statement, "Script cancelled"))
+                    break
+                if bail and self.errors:
+                    break
+                if command == "sql" and (
+                    opt.cmdargs.script_batch > 1
+                    and self.INSERT.match(statement)
+                    and not self.RETURNING.search(statement)
+                ):
+                    # the limit is in bytes of the statement text
+                    size = len(statement.encode("utf-8")) + 2
+                    if batch and (
+                        len(batch) >= opt.cmdargs.script_batch
+                        or batch_size + size > self.BLOCK_LIMIT
+                    ):
+                        self._run_batch(batch)
+                        batch, batch_size = [], 0
+                    batch.append(statement)
+                    batch_size += size
+                    uncommitted += 1
+                    continue
+                if batch:
+                    self._run_batch(batch)
+                    batch, batch_size = [], 0
+                if command == "sql":
+                    self._run_statement(statement)
+                    uncommitted += 1
+                    if autoddl and Firebird.DDL.match(statement):
+                        conn.Commit()
+                        conn.Begin()
+                        uncommitted = 0
+                elif command == "commit":
+                    conn.Commit()
+                    conn.Begin()
+                    uncommitted = 0
+                elif command == "rollback":
+                    conn.Rollback()
+                    conn.Begin()
+                    uncommitted = 0
+                elif command == "autoddl":
+                    autoddl = statement
+                elif command == "bail":
+                    bail = statement
+                if (
+                    opt.cmdargs.script_commit
+                    and uncommitted >= opt.cmdargs.script_commit
+                ):
+                    conn.Commit()
+                    conn.Begin()
+                    uncommitted = 0
+            if batch and not (bail and self.errors) and not self.cancelled:
+                self._run_batch(batch)
+        finally:
+            if (bail and self.errors) or self.cancelled:
+                conn.Rollback()
+            else:
+                conn.Commit()
+        debug_str = (
+            f"{self.executed} statements executed ({self.blocks} insert"
+            f" batches), {len(self.errors)} errors in"
+            f" {time.perf_counter() - timestart:.3f}s"
+        )
+        for statement, error in self.errors:
+            debug_str += f"\n{'-' * 80}\n{statement}\n{error}"
+        return not self.errors, debug_str
+
+    def _run_statement(self, statement):
+        self.executed += 1
+        res = self.conn.Execute(statement, cache=False)
+        if type(res) is tuple:
+            self.errors.append((statement, res[0]))
+
+    def _run_batch(self, batch):
+        """
+        Executes INSERTs as one EXECUTE BLOCK. If it fails, they are
+        repeated one by one to find the failing ones.
+        """
+        if len(batch) == 1:
+            self._run_statement(batch[0])
+            return
+        block = "EXECUTE BLOCK AS BEGIN\n" + ";\n".join(batch) + ";\nEND"
+        res = self.conn.Execute(block, cache=False)
+        if type(res) is tuple:
+            for statement in batch:
+                self._run_statement(statement)
         else:
-            return str(received) == str(expected)
+            self.blocks += 1
+            self.executed += len(batch)
+
+
+class Watchdog:
+    """
+    Cancels statements running for too long. Statements are deleted from
+    MON$STATEMENTS through a separate attachment, so the attachment running
+    them stays usable and gets "operation was cancelled" error.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def Guard(self, seconds, conns, callback=None):
+        """
+        Returns Deadline that cancels statements of given attachments and
+        calls callback if not finished in given number of seconds
+        """
+        return Deadline(self, seconds, conns, callback)
+
+    def Cancel(self, conns):
+        with self.lock:
+            if self.conn is None:
+                self.conn = connect_database(opt, log)
+            for conn in conns:
+                res = self.conn.Execute(
+                    "delete from mon$statements"
+                    " where mon$attachment_id = ? and mon$state <> 0",
+                    [conn.db.attachment_id],
+                    cache=False,
+                )
+                if type(res) is tuple:
+                    log.file.error(
+                        f"Can not cancel statement of attachment"
+                        f" {conn.db.attachment_id}: {res[0]}"
+                    )
+
+    def Close(self):
+        """
+        Closes the attachment of the watchdog, next Cancel opens a new one
+        """
+        with self.lock:
+            if self.conn is not None:
+                self.conn.Close()
+                self.conn = None
+
+
+class Deadline:
+    """
+    Timer of a statement, file or test, used as context manager
+    """
+
+    def __init__(self, watchdog, seconds, conns, callback=None):
+        self.watchdog = watchdog
+        self.seconds = seconds
+        self.conns = conns
+        self.callback = callback
+        self.fired = False
+        self.done = False
+        self.lock = threading.Lock()
+        self.timer = None
+        if seconds:
+            self.timer = threading.Timer(seconds, self._fire)
+            self.timer.daemon = True
+
+    def __enter__(self):
+        if self.timer is not None:
+            self.timer.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.timer is not None:
+            self.timer.cancel()
+        # wait for cancellation in progress, so it can't hit next statement
+        with self.lock:
+            self.done = True
+
+    def _fire(self):
+        with self.lock:
+            if self.done:
+                return
+            self.fired = True
+            log.file.warning(f"Cancelling after {self.seconds}s timeout")
+            if self.callback is not None:
+                self.callback()
+            if self.conns:
+                self.watchdog.Cancel(self.conns)
+
+
+class SingleTest:
+    """
+    Processes a single test file
+    """
+
+    TRANSACTION = re.compile(r"^\s*(COMMIT|ROLLBACK)\s*;?\s*$", re.IGNORECASE)
+    SELECT = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+    def __init__(self, filename, definition=None):
+        """
+        Create the necessary object from given yaml or from already parsed
+        and normalised definition of the test
+        """
+        if definition is None:
+            with open(filename, mode="r", encoding="utf-8") as f:
+                definition = SingleTest.Normalise(
+                    yaml.load(f, Loader=YAML_LOADER)
+                )
+        self.__dict__ = dict(definition)
+        self.matchers = [
+            SingleTest.CompileExpectations(statement)
+            for statement in getattr(self, "test_statements", [])
+        ]
+
+    def CompileExpectations(statement):
+        """
+        Returns matchers for `expect_values` as list of (key, upper key,
+        matcher), for `expect_all` as a dict of upper key and matcher, for
+        counters of I/O, row count and lock wait, and compiled
+        `forbid_plan_pattern` regular expressions
+        """
+        patterns = statement.get("forbid_plan_pattern", [])
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        try:
+            patterns = [
+                re.compile(pattern, re.IGNORECASE) for pattern in patterns
+            ]
+        except (re.error, TypeError) as error:
+            raise ValueError(f"bad forbid_plan_pattern: {error}")
+        return {
+            "values": [
+                (key, str(key).upper(), Matcher(expected))
+                for key, expected in statement.get(
+                    "expect_values", {}
+                ).items()
+            ],
+            "all": {
+                str(key).upper(): Matcher(expected)
+                for key, expected in statement.get("expect_all", {}).items()
+            },
+            "io": {
+                key: Matcher(statement[f"expect_{key}"])
+                for key in ("reads", "writes", "fetches", "marks")
+                if statement.get(f"expect_{key}") is not None
+            },
+            "rowcount": (
+                Matcher(statement["expect_rowcount"])
+                if statement.get("expect_rowcount") is not None
+                else None
+            ),
+            "lock_wait": (
+                Matcher(statement["expect_lock_wait"])
+                if "expect_lock_wait" in statement
+                else None
+            ),
+            "plan": patterns,
+        }
+
+    def Normalise(definition):
+        """
+        Checks structure of the test definition and brings it to the form
+        used by the rest of the code. Raises ValueError for broken tests.
+        """
+        if not isinstance(definition, dict):
+            raise ValueError("test must be a mapping")
+        for key in ("data_files", "test_files", "tags", "generate"):
+            if key in definition and not isinstance(definition[key], list):
+                definition[key] = [definition[key]]
+        if "id" in definition:
+            definition["id"] = str(definition["id"])
+        for item in definition.get("generate", []):
+            if not isinstance(item, dict) or not isinstance(
+                item.get("columns"), dict
+            ):
+                raise ValueError("generate items must have columns mapping")
+            for key in ("table", "rows"):
+                if key not in item:
+                    raise ValueError(f"generate item misses {key}")
+            for column, spec in item["columns"].items():
+                if not isinstance(spec, dict):
+                    item["columns"][column] = {"value": spec}
+        sessions = definition.get("sessions", {})
+        if not isinstance(sessions, dict):
+            raise ValueError("sessions must be a mapping")
+        for name, config in sessions.items():
+            isolation = (config or {}).get("isolation", "read_committed")
+            if isolation not in Firebird.ISOLATION:
+                raise ValueError(
+                    f"session {name}: unknown isolation {isolation}"
+                )
+        statements = definition.get("test_statements", [])
+        if not isinstance(statements, list):
+            raise ValueError("test_statements must be a list")
+        for i, statement in enumerate(statements):
+            if not isinstance(statement, dict):
+                raise ValueError(f"statement {i + 1} must be a mapping")
+            if type(statement.get("sql")) is list:
+                statement["sql"] = " ".join(statement["sql"])
+            if "benchmark" in statement:
+                if not isinstance(statement["benchmark"], dict):
+                    raise ValueError(
+                        f"benchmark of statement {i + 1} must be a mapping"
+                    )
+                # settings are checked now, not in the middle of the run
+                try:
+                    Benchmark(statement["benchmark"])
+                except ValueError as error:
+                    raise ValueError(f"statement {i + 1} benchmark: {error}")
+        return definition
+
+    def StoreRes(self, datastring):
+        if not hasattr(self, "results"):
+            self.results = ResultWriter(self.id)
+        with phase("logging"):
+            self.results.Write(datastring)
+
+    def CompareValues(self, received, expected):
+        """
+        Equality of values of two variables, numeric if both are numbers
+        """
+        first, second = Matcher.Number(received), Matcher.Number(expected)
+        if first is not None and second is not None:
+            return first == second
+        return str(received) == str(expected)
 
     def ExecFile(self, filename):
         """
-        Execute given file. '.sql' files are executing through isql with command line
-        arguments that were passed to the script, others - run directly.
-        Returns True if system's error code is 0 and False otherwise.
+        Execute given file. '.sql' files are executed over the script's own
+        attachment, or through isql with command line arguments that were
+        passed to the script if they use isql-only commands. Others are run
+        directly. Returns True if file was executed without errors and False
+        otherwise.
         """
         file_passed = False
         debug_str = ""
+        timestart = time.perf_counter()
+        # external scripts may change metadata used by prepared statements
+        Firebird.MetadataChanged()
         ext = os.path.splitext(filename)[1]
         if ext == ".sql":
-            cmd = [
-                opt.args.isql,
-                f"{opt.args.server}/{opt.args.port}:{opt.args.database}",
-                "-u",
-                opt.args.username,
-                "-pas",
-                opt.args.password,
-                "-i",
-                filename,
-                "-m",
-                "-e",
-            ]
-            debug_str = (
-                "Exexuting sql script using following command:\n"
-                + " ".join(cmd)
-            )
+            script = None
+            if not opt.cmdargs.isql_scripts:
+                try:
+                    script = SqlScript(filename, fb.charset)
+                except (IsqlOnly, UnicodeDecodeError) as error:
+                    log.file.info(
+                        f"Script {filename} will be run by isql: {error}"
+                    )
+            if script is not None:
+                self.script = script
+                with watchdog.Guard(
+                    opt.cmdargs.file_timeout,
+                    [fb],
+                    lambda: setattr(script, "cancelled", True),
+                ) as deadline:
+                    file_passed, debug_str = script.Run(fb)
+                self.script = None
+                debug_str = f"Executing sql script {filename}\n" + debug_str
+                if deadline.fired:
+                    debug_str += (
+                        f"\nCancelled after {opt.cmdargs.file_timeout}s"
+                    )
+            else:
+                file_passed, debug_str = self._exec_isql(filename)
+            if file_passed:
+                debug_str += "\nPASSED"
+            else:
+                log.file.error(f"Error executing sql script {filename}")
+                debug_str += "\nFAILED"
+        else:
+            debug_str = f"Executing {filename} via system shell "
             p = subprocess.Popen(
-                cmd,
+                filename,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                universal_newlines=True,
+                start_new_session=(os.name == "posix"),
             )
-            res = p.communicate()
-            debug_str += "\n" + ("-" * 80) + "\n" + "".join(res[0]) + ("-" * 80)
+            res, killed = self._communicate(p)
+            if killed:
+                debug_str += f"\nKilled after {opt.cmdargs.file_timeout}s"
             if p.returncode == 0:
                 file_passed = True
                 debug_str += "\nPASSED"
             else:
                 log.file.error(
-                    f"Error executing sql script {filename} with command line {cmd}"
-                )
-                debug_str += "\nFAILED"
-        else:
-            debug_str = f"Executing {filename} via system shell "
-            p = subprocess.Popen(
-                filename, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            res = p.communicate()
-            if p.returncode == 0:
-                file_passed = True
-                debug_str += "\nPASSED"
-            else:
-                log.file.error(
-                    f"Error executing file {filename} with error {p.returncode}"
+                    f"Error executing file {filename} with error {p.returncode}"
                 )
                 debug_str += f"\nCommand returned error {p.returncode}"
                 debug_str += "\nFAILED"
         self.StoreRes(debug_str)
+        duration = time.perf_counter() - timestart
+        self.results.Record(
+            {
+                "test": self.id,
+                "kind": "file",
+                "file": filename,
+                "passed": file_passed,
+                "duration": duration,
+            }
+        )
+        self.timings.Observe(self.id, filename, "file", duration)
+        self.statements.append(
+            {
+                "statement": filename,
+                "kind": "file",
+                "passed": file_passed,
+                "duration": duration,
+            }
+        )
+        if not file_passed:
+            self.failures.append(f"file {filename} failed")
         return file_passed
 
-    def ExecStatement(self, statement, test_vars):
+    def Generate(self, config):
+        """
+        Fill a table according to the item of `generate` section. Returns
+        True if all rows were inserted.
+        """
+        timestart = time.perf_counter()
+        try:
+            generator = DataGenerator(config)
+        except (KeyError, TypeError, ValueError) as error:
+            generated, debug_str = False, f"Wrong generate item: {error!r}"
+        else:
+            try:
+                generated, debug_str = generator.Run(fb, self.background)
+            except fdb.Error as error:
+                generated = False
+                debug_str = f"Can not generate {generator.table}: {error}"
+        if generated:
+            debug_str += "\nPASSED"
+        else:
+            log.file.error(debug_str)
+            debug_str += "\nFAILED"
+        self.StoreRes(debug_str)
+        self.results.Record(
+            {
+                "test": self.id,
+                "kind": "generate",
+                "table": config.get("table"),
+                "rows": config.get("rows"),
+                "passed": generated,
+                "duration": time.perf_counter() - timestart,
+            }
+        )
+        if not generated:
+            self.failures.append(f"generating {config.get('table')} failed")
+        return generated
+
+    def _exec_isql(self, filename):
+        """
+        Runs sql script through isql with command line arguments that were
+        passed to the script
+        """
+        cmd = [
+            opt.cmdargs.isql,
+            f"{opt.cmdargs.server}/{opt.cmdargs.port}:{opt.cmdargs.database}",
+            "-u",
+            opt.cmdargs.username,
+            "-pas",
+            opt.cmdargs.password,
+            "-i",
+            filename,
+            "-m",
+            "-e",
+        ]
+        debug_str = (
+            "Exexuting sql script using following command:\n" + " ".join(cmd)
+        )
+        p = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            start_new_session=(os.name == "posix"),
+        )
+        res, killed = self._communicate(p)
+        debug_str += "\n" + ("-" * 80) + "\n" + "".join(res[0]) + ("-" * 80)
+        if killed:
+            debug_str += f"\nKilled after {opt.cmdargs.file_timeout}s"
+        return p.returncode == 0, debug_str
+
+    def _communicate(self, p):
+        """
+        Waits for the subprocess at most --file_timeout seconds and kills it
+        after that. Returns its output and True if it was killed.
+        """
+        self.process = p
+        try:
+            with phase("subprocess"):
+                output = p.communicate(timeout=opt.cmdargs.file_timeout)
+            return output, False
+        except subprocess.TimeoutExpired:
+            SingleTest.Kill(p)
+            return p.communicate(), True
+        finally:
+            self.process = None
+
+    def Kill(p):
+        """
+        Kills subprocess together with processes it started, which would
+        otherwise keep its output open
+        """
+        try:
+            if os.name == "posix":
+                os.killpg(p.pid, signal.SIGKILL)
+            else:
+                p.kill()
+        except ProcessLookupError:
+            pass
+
+    def ExecStatement(self, statement, test_vars, index=0):
         stmt_passed = False
-        debug_str = self._prepare_debug_str(statement, test_vars)
+        debug_str = ""
 
-        # Fill parameters with their values
+        # Fill parameters with their values. Variables are shown in the
+        # results as the statement got them, not with its own outputs.
         paramlist = self._prepare_param_list(statement, test_vars)
+        vars_before = dict(test_vars)
+
+        if statement.get("delay"):
+            time.sleep(float(statement["delay"]))
 
         # Execute statement and measure execution time
+        io_stats = None
+        http_timings = None
+        lock_wait = None
+        stream = None
+        conn = self._connection(statement)
+        if statement.get("sql") and any(
+            key in statement for key in ResultStream.KEYS
+        ):
+            stream = ResultStream(
+                statement, opt.cmdargs.fetch_batch, self.matchers[index]["all"]
+            )
+        if statement.get("sql") and self._wants_io_stats(statement):
+            io_before = conn.IoSnapshot()
+        if statement.get("sql") and statement.get("session") is not None:
+            waits_before = conn.LockWaits()
         timestart = time.perf_counter()
+        cancelled = False
         if statement.get("sql"):
-            res = self._execute_sql_statement(statement, paramlist)
+            timeout = statement.get("timeout", opt.cmdargs.statement_timeout)
+            with watchdog.Guard(timeout, [conn]) as deadline:
+                res = self._execute_sql_statement(
+                    statement, paramlist, stream=stream
+                )
+            if deadline.fired:
+                cancelled = True
+                res = (
+                    f"Statement cancelled after"
+                    f" {time.perf_counter() - timestart:.3f}s,"
+                    f" timeout is {timeout}s",
+                    None,
+                    None,
+                )
         elif statement.get("curl"):
-            res, http_debug_str = self._execute_http_request(statement, paramlist)
+            with phase("http"):
+                res, http_debug_str, http_timings = (
+                    self._execute_http_request(statement, paramlist)
+                )
             debug_str += http_debug_str
         else:
             res = ("Unsupported statement type",)
         timefinish = time.perf_counter()
+        if statement.get("sql") and statement.get("session") is not None:
+            # the whole statement time is counted as waiting if the server
+            # reports lock waits for it or can not tell
+            waits_after = conn.LockWaits()
+            lock_wait = 0.0
+            if waits_before is None or waits_after is None or (
+                waits_after > waits_before
+            ):
+                lock_wait = timefinish - timestart
+            self.lock_waits[statement["session"]] += lock_wait
+        if statement.get("sql") and self._wants_io_stats(statement):
+            io_stats = conn.IoDelta(io_before, conn.IoSnapshot())
+        plan = None
+        if statement.get("sql") and self._wants_plan(statement):
+            plan = conn.Plan(self._sql_text(statement))
 
         # Check the results
-        stmt_passed, debug_str = self._check_results(
-            statement,
-            res,
-            test_vars,
-            debug_str,
-            timestart,
-            timefinish,
-            paramlist,
-        )
+        if cancelled:
+            stmt_passed = False
+            debug_str += f"\n### Error:\n{res[0]}\nFAILED"
+        else:
+            with phase("check"):
+                stmt_passed, debug_str = self._check_results(
+                    statement,
+                    res,
+                    test_vars,
+                    debug_str,
+                    timestart,
+                    timefinish,
+                    paramlist,
+                    io_stats,
+                    plan,
+                    index,
+                    stream,
+                    lock_wait,
+                )
+
+        if stmt_passed and statement.get("benchmark"):
+            stmt_passed, bench_str = self._run_benchmark(
+                statement, paramlist, index
+            )
+            debug_str += bench_str
 
-        # Store and return results
+        # Store and return results. Statement and variables are rendered in
+        # full only when somebody is going to read them.
+        record = {
+            "test": self.id,
+            "statement": index + 1,
+            "kind": "sql" if statement.get("sql") else "curl",
+            "passed": stmt_passed,
+            "duration": timefinish - timestart,
+        }
+        if type(res) is tuple:
+            record["error"] = str(res[0])
+        if io_stats is not None:
+            record["io"] = io_stats
+        if plan:
+            record["plan"] = plan.strip()
+        if http_timings:
+            record["http"] = http_timings
+        if stream is not None and type(res) is not tuple:
+            record["rows"] = stream.Record()
+        if lock_wait is not None:
+            record["session"] = statement["session"]
+            record["lock_wait"] = lock_wait
+        with phase("logging"):
+            self.results.Record(record)
+        self.timings.Observe(
+            self.id, index + 1, record["kind"], record["duration"]
+        )
+        self.statements.append(
+            {
+                "statement": index + 1,
+                "kind": record["kind"],
+                "passed": stmt_passed,
+                "duration": record["duration"],
+                "rows": record["rows"]["count"] if "rows" in record else None,
+                "error": record.get("error"),
+            }
+        )
+        if not stmt_passed:
+            self.failures.append(
+                f"statement {index + 1} failed"
+                + (f": {res[0]}" if type(res) is tuple else "")
+            )
+        full = opt.cmdargs.verbose or not stmt_passed
+        with phase("logging"):
+            debug_str = (
+                self._prepare_debug_str(statement, vars_before, full)
+                + debug_str
+            )
         self.StoreRes(debug_str)
         return stmt_passed
 
-    def _prepare_debug_str(self, statement, test_vars):
+    def _run_benchmark(self, statement, paramlist, index):
+        """
+        Repeats statement according to its benchmark section and compares
+        timings with the baseline
+        """
+        bench = Benchmark(statement["benchmark"])
+        if not self._benchmark_safe(statement):
+            log.file.error(
+                f"Benchmark of statement {index + 1} of test {self.id}"
+                " refused: it may modify data"
+            )
+            return False, (
+                "\n### Benchmark:\nonly SELECT statements, statements of"
+                " a test with `transaction: rollback` and GET or HEAD http"
+                " requests can be repeated\nFAILED"
+            )
+        if statement.get("sql"):
+            run = lambda: self._execute_sql_statement(statement, paramlist)
+        else:
+            run = lambda: self._execute_http_request(statement, paramlist)[0]
+        samples = bench.Measure(run)
+        if samples is None:
+            log.file.error(f"Benchmark of statement {index + 1} failed")
+            return False, "\n### Benchmark:\nstatement failed\nFAILED"
+        stats = bench.Stats(samples)
+        key = f"{self.id}:{index + 1}"
+        self.benchmarks[key] = stats
+        debug_str = (
+            f"\n### Benchmark:\n{stats['n']} runs, mean {stats['mean']:.6f}s,"
+            f" median {stats['median']:.6f}s, stdev {stats['stdev']:.6f}s,"
+            f" 95% CI [{stats['ci_low']:.6f}, {stats['ci_high']:.6f}]"
+        )
+        base = Benchmark.Baseline().get(key)
+        if base is None:
+            return True, debug_str + "\nNo baseline yet"
+        regressed, compare_str = bench.Compare(stats, base)
+        debug_str += "\n" + compare_str
+        if regressed:
+            log.file.error(
+                f"Statement {index + 1} of test {self.id} is slower than"
+                f" baseline: {compare_str}"
+            )
+            return False, debug_str + "\nFAILED"
+        return True, debug_str
+
+    def _benchmark_safe(self, statement):
+        """
+        Statement may be repeated if it only reads data or its changes are
+        rolled back with the test transaction. Changes made by http requests
+        can not be rolled back, so only GET and HEAD ones are repeated.
+        """
+        if statement.get("curl"):
+            method = statement.get("method", "GET").upper()
+            return method in ("GET", "HEAD")
+        if SingleTest.SELECT.match(self._sql_text(statement)):
+            return True
+        return (
+            getattr(self, "rollback", False)
+            and self._connection(statement) is self.main
+        )
+
+    def _prepare_debug_str(self, statement, test_vars, full=True):
         debug_str = "### Statement:\n"
+        if not full:
+            if statement.get("sql"):
+                return debug_str + self._sql_text(statement)
+            return debug_str + str(statement.get("curl"))
         debug_str += yaml.dump(statement, allow_unicode=True, sort_keys=False)
         debug_str += "\n### Variables:\n"
         debug_str += yaml.dump(test_vars, allow_unicode=True, sort_keys=False)
@@ -389,12 +2600,101 @@ class SingleTest:
                 paramlist.append(test_vars[param.upper()])
         return paramlist
 
-    def _execute_sql_statement(self, statement, paramlist):
+    def _sql_text(self, statement):
         if type(statement.get("sql")) is list:
-            res = fb.Execute(" ".join(statement.get("sql")), paramlist)
-        else:
-            res = fb.Execute(statement.get("sql"), paramlist)
-        return res
+            return " ".join(statement.get("sql"))
+        return statement.get("sql")
+
+    def _connection(self, statement):
+        """
+        Returns attachment of the statement's session or profile
+        """
+        if statement.get("session") is not None:
+            return self.connections[statement["session"]]
+        if statement.get("profile") is not None:
+            return self.profiles[statement["profile"]]
+        return getattr(self, "main", fb)
+
+    def _attachments(self):
+        """
+        All attachments the test may be running statements on
+        """
+        attachments = [fb, getattr(self, "main", fb)]
+        attachments += list(getattr(self, "connections", {}).values())
+        attachments += list(getattr(self, "profiles", {}).values())
+        attachments += list(getattr(self, "background", []))
+        return list({id(conn): conn for conn in attachments}.values())
+
+    def _open_sessions(self):
+        """
+        Takes attachments from the pool for the test profile, for every
+        profile used by statements and for every session, sessions start
+        their own transactions
+        """
+        self.lock_waits = {}
+        if getattr(self, "profile", None) is not None:
+            self.main = pool.Acquire(self.profile)
+        config = getattr(self, "sessions", {})
+        for statement in getattr(self, "test_statements", []):
+            name = statement.get("profile")
+            if name is not None and name not in self.profiles:
+                self.profiles[name] = pool.Acquire(name)
+            name = statement.get("session")
+            if name is None or name in self.connections:
+                continue
+            session = config.get(name) or {}
+            conn = pool.Acquire(
+                session.get("profile"),
+                session.get("isolation"),
+                session.get("lock_timeout"),
+            )
+            conn.Begin()
+            self.connections[name] = conn
+            self.lock_waits[name] = 0.0
+
+    def _close_sessions(self):
+        for name, conn in self.connections.items():
+            conn.Rollback()
+            pool.Release(conn)
+            self.StoreRes(
+                f"Session {name} waited for locks"
+                f" {self.lock_waits[name]:.4f}s"
+            )
+        for conn in self.profiles.values():
+            pool.Release(conn)
+        if self.main is not fb:
+            pool.Release(self.main)
+        self.connections = {}
+        self.profiles = {}
+        self.main = fb
+
+    def _execute_sql_statement(
+        self, statement, paramlist, conn=None, stream=None
+    ):
+        if conn is None:
+            conn = self._connection(statement)
+        if (
+            conn not in (fb, getattr(self, "main", fb))
+            and statement.get("profile") is None
+            and self.TRANSACTION.match(self._sql_text(statement))
+        ):
+            # sessions keep their transactions open until told otherwise
+            if self._sql_text(statement).strip().lower().startswith("commit"):
+                conn.Commit()
+            else:
+                conn.Rollback()
+            conn.Begin()
+            return dict()
+        # statements expected to fail are undone up to a savepoint when the
+        # test runs in one transaction
+        savepoint = None
+        if "expect_error_gdscode" in statement or (
+            "expect_error_string" in statement
+        ):
+            savepoint = "FDBTEST_STMT"
+        return conn.Execute(
+            self._sql_text(statement), paramlist, savepoint, stream=stream
+        )
 
     def _execute_http_request(self, statement, paramlist):
         url = statement['curl']
@@ -403,17 +2703,31 @@ class SingleTest:
         method = statement.get('method', 'GET').upper()
         headers = statement.get('headers', {})
         data = statement.get('data', {})
+        timeout = (
+            statement.get('connect_timeout', 10),
+            statement.get('read_timeout', 10),
+        )
 
         debug_str = f"\n### HTTP Request:\nMethod: {method}\nURL: {url}\nHeaders: {headers}\nData: {data}\n"
+        timestart = time.perf_counter()
+        timings = {}
         try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers, timeout=statement.get('expect_duration', 10))
-            elif method == 'POST':
-                response = requests.post(url, headers=headers, json=data, timeout=statement.get('expect_duration', 10))
+            if cassette is not None and cassette.replay:
+                response = cassette.Replay(method, url, data)
             else:
-                response = requests.request(method, url, headers=headers, json=data, timeout=statement.get('expect_duration', 10))
+                session = HttpPool.Session(url)
+                HttpPool.timing.connect = None
+                if method == 'GET':
+                    response = session.get(url, headers=headers, timeout=timeout)
+                else:
+                    response = session.request(method, url, headers=headers, json=data, timeout=timeout)
+                timings['connect'] = HttpPool.timing.connect or 0.0
+                if cassette is not None:
+                    cassette.Record(method, url, data, response)
+            timings['ttfb'] = response.elapsed.total_seconds()
+            timings['total'] = time.perf_counter() - timestart
             response.raise_for_status()  # Raise an error for bad status codes
-            if 'application/json' in response.headers['Content-Type']:
+            if 'application/json' in response.headers.get('Content-Type', ''):
                 res = response.json()
                 debug_str += f"JSON response:\n{json.dumps(res, indent=4)}\nStatus Code: {response.status_code}\n"
             else:
@@ -421,9 +2735,18 @@ class SingleTest:
                 debug_str += f"Text response: {res}\nStatus Code: {response.status_code}\n"
 
         except requests.RequestException as e:
+            timings['total'] = time.perf_counter() - timestart
             res = (str(e),)
             debug_str += f"Error: {res}\n"
-        return res, debug_str
+        except OSError as e:
+            # cassette files can not be written or read
+            timings['total'] = time.perf_counter() - timestart
+            res = (f"HTTP cassette: {e}",)
+            debug_str += f"Error: {res}\n"
+        debug_str += "Timings: " + ", ".join(
+            f"{key} {value:.4f}s" for key, value in timings.items()
+        )
+        return res, debug_str, timings
 
     def _check_results(
         self,
@@ -434,15 +2757,20 @@ class SingleTest:
         timestart,
         timefinish,
         paramlist,
+        io_stats=None,
+        plan=None,
+        index=0,
+        stream=None,
+        lock_wait=None,
     ):
         stmt_passed = True
         if "sql" in statement:
-            stmt_passed = self._check_sql_results(
-                statement, res, test_vars, debug_str
+            stmt_passed, debug_str = self._check_sql_results(
+                statement, res, test_vars, debug_str, index
             )
         elif "curl" in statement:
-            stmt_passed = self._check_http_results(
-                statement, res, test_vars, debug_str
+            stmt_passed, debug_str = self._check_http_results(
+                statement, res, test_vars, debug_str, index
             )
 
         if stmt_passed and statement.get("expect_duration"):
@@ -450,6 +2778,31 @@ class SingleTest:
                 statement, timestart, timefinish, debug_str
             )
 
+        if io_stats is not None:
+            io_passed, debug_str = self._check_io_stats(
+                statement, io_stats, debug_str, index
+            )
+            stmt_passed = stmt_passed and io_passed
+
+        if stream is not None and type(res) is not tuple:
+            rows_passed, debug_str = self._check_stream(
+                statement, stream, debug_str, index
+            )
+            stmt_passed = stmt_passed and rows_passed
+
+        if plan:
+            plan_passed, debug_str = self._check_plan(
+                statement, plan, index, debug_str
+            )
+            stmt_passed = stmt_passed and plan_passed
+
+        if lock_wait is not None:
+            debug_str += f"\n### Lock wait:\n{lock_wait:.4f}s"
+            matcher = self.matchers[index]["lock_wait"]
+            if matcher is not None and not matcher.Match(lock_wait):
+                stmt_passed = False
+                debug_str += f", expected {matcher!r}"
+
         if stmt_passed:
             debug_str += "\nPASSED"
         else:
@@ -460,26 +2813,30 @@ class SingleTest:
 
         return stmt_passed, debug_str
 
-    def _check_sql_results(self, statement, res, test_vars, debug_str):
+    def _check_sql_results(
+        self, statement, res, test_vars, debug_str, index=0
+    ):
         if type(res) is tuple and len(res) == 3:
-            return self._handle_error(statement, res)
+            debug_str += "\n### Error:\n" + str(res[0])
+            return self._handle_error(statement, res), debug_str
         else:
-            stmt_passed = self._handle_success(statement, res, test_vars)
+            stmt_passed = self._handle_success(
+                statement, res, test_vars, index
+            )
             debug_str += "\n### Results:\n" + str(res)
-            return stmt_passed
+            return stmt_passed, debug_str
 
-    def _check_http_results(self, statement, res, test_vars, debug_str):
+    def _check_http_results(
+        self, statement, res, test_vars, debug_str, index=0
+    ):
         stmt_passed = True
-        if "expect_values" in statement:
-            for key, expected_value in statement["expect_values"].items():
-                actual_value = res.get(key) if isinstance(res, dict) else res
-                stmt_passed = stmt_passed and self.CompareValues(
-                    str(actual_value), str(expected_value)
-                )
-                debug_str += f"\nComparing expected value '{expected_value}' with actual value '{actual_value}'"
+        for key, _, matcher in self.matchers[index]["values"]:
+            actual_value = res.get(key) if isinstance(res, dict) else res
+            stmt_passed = stmt_passed and matcher.Match(actual_value)
+            debug_str += f"\nComparing expected value '{matcher.expected}' with actual value '{actual_value}'"
 
         debug_str += "\n### Results:\n" + str(res)
-        return stmt_passed
+        return stmt_passed, debug_str
 
     def _handle_error(self, statement, res):
         stmt_passed = False
@@ -496,18 +2853,19 @@ class SingleTest:
                 stmt_passed = False
         return stmt_passed
 
-    def _handle_success(self, statement, res, test_vars):
-        stmt_passed = True
+    def _store_vars(self, res, test_vars):
         for item in res:
             test_vars[item] = str(res.get(item))
 
-        if statement.get("expect_values"):
-            for exp in statement.get("expect_values"):
-                exp_value = statement.get("expect_values")[exp]
-                res_value = str(test_vars[exp.upper()])
-                stmt_passed = stmt_passed and self.CompareValues(
-                    res_value, exp_value
-                )
+    def _handle_success(self, statement, res, test_vars, index=0):
+        stmt_passed = True
+        self._store_vars(res, test_vars)
+
+        # values of the statement itself are checked as they were fetched,
+        # the ones set by previous statements as strings
+        for _, key, matcher in self.matchers[index]["values"]:
+            value = res[key] if key in res else test_vars[key]
+            stmt_passed = stmt_passed and matcher.Match(value)
 
         if stmt_passed and statement.get("expect_equals"):
             for i in range(len(statement.get("expect_equals")) - 1):
@@ -519,6 +2877,151 @@ class SingleTest:
 
         return stmt_passed
 
+    def _wants_io_stats(self, statement):
+        return opt.cmdargs.io_stats or any(
+            key in statement
+            for key in (
+                "expect_reads",
+                "expect_writes",
+                "expect_fetches",
+                "expect_marks",
+                "expect_no_natural_reads_on",
+            )
+        )
+
+    def _check_io_stats(self, statement, io_stats, debug_str, index):
+        stmt_passed = True
+        debug_str += (
+            f"\n### I/O:\nreads {io_stats['reads']},"
+            f" writes {io_stats['writes']}, fetches {io_stats['fetches']},"
+            f" marks {io_stats['marks']}, seq reads {io_stats['seq_reads']},"
+            f" idx reads {io_stats['idx_reads']},"
+            f" memory {io_stats['memory']:+d} (max {io_stats['max_memory']})"
+        )
+        for table, (seq_reads, idx_reads) in sorted(
+            (io_stats["tables"] or {}).items()
+        ):
+            debug_str += (
+                f"\n{table}: seq reads {seq_reads}, idx reads {idx_reads}"
+            )
+        for key, matcher in self.matchers[index]["io"].items():
+            if not matcher.Match(io_stats[key]):
+                stmt_passed = False
+                debug_str += (
+                    f"\nExpected {key} {matcher!r}, got {io_stats[key]}"
+                )
+        for table in statement.get("expect_no_natural_reads_on", []):
+            if io_stats["tables"] is None:
+                stmt_passed = False
+                debug_str += (
+                    f"\nexpect_no_natural_reads_on {table.upper()} is"
+                    " unsupported on this server version, it has no"
+                    " MON$TABLE_STATS"
+                )
+                continue
+            seq_reads = io_stats["tables"].get(table.upper(), (0, 0))[0]
+            if seq_reads:
+                stmt_passed = False
+                debug_str += (
+                    f"\nTable {table.upper()} read naturally"
+                    f" {seq_reads} records"
+                )
+        return stmt_passed, debug_str
+
+    def _check_stream(self, statement, stream, debug_str, index):
+        stmt_passed = True
+        debug_str += (
+            f"\n### Rows:\n{stream.rows}, sha256 {stream.hash.hexdigest()},"
+            f" first row in {stream.first_row or 0:.4f}s,"
+            f" last row in {stream.last_row:.4f}s"
+        )
+        matcher = self.matchers[index]["rowcount"]
+        if matcher is not None and not matcher.Match(stream.rows):
+            stmt_passed = False
+            debug_str += f"\nExpected {matcher!r} rows, got {stream.rows}"
+        expected = statement.get("expect_result_hash")
+        if expected is not None and (
+            str(expected).lower() != stream.hash.hexdigest()
+        ):
+            stmt_passed = False
+            debug_str += f"\nExpected result hash {expected}"
+        if stream.error is not None:
+            stmt_passed = False
+            debug_str += "\n" + stream.error
+        if stream.wrong_value is not None:
+            stmt_passed = False
+            number, name, value, matcher = stream.wrong_value
+            debug_str += (
+                f"\nRow {number}: {name} is {value!r}, expected {matcher!r}"
+            )
+        if stream.mismatch is not None:
+            stmt_passed = False
+            number, expected, actual = stream.mismatch
+            debug_str += (
+                f"\nRow {number} differs from {stream.golden}:"
+                f"\n- {expected}\n+ {actual}"
+            )
+        return stmt_passed, debug_str
+
+    def _wants_plan(self, statement):
+        return bool(
+            opt.cmdargs.results_dir
+            or opt.cmdargs.plan_baseline
+            or "expect_plan" in statement
+            or "forbid_plan_pattern" in statement
+        )
+
+    def _check_plan(self, statement, plan, index, debug_str):
+        """
+        Stores plan of the statement in results dir and checks it against
+        expectations and the baseline
+        """
+        stmt_passed = True
+        plan = plan.strip()
+        debug_str += "\n### Plan:\n" + plan
+        planname = f"{self.id}.{index + 1}.plan"
+        if opt.cmdargs.results_dir:
+            plandir = opt.cmdargs.results_dir + os.sep + "plans"
+            if not os.path.exists(plandir):
+                os.makedirs(plandir, exist_ok=True)
+            with open(
+                plandir + os.sep + planname, mode="w", encoding="utf-8"
+            ) as f:
+                f.write(plan + "\n")
+        expected = statement.get("expect_plan")
+        if expected is not None and " ".join(expected.split()) != " ".join(
+            plan.split()
+        ):
+            stmt_passed = False
+            debug_str += f"\nExpected plan {expected}"
+        for pattern in self.matchers[index]["plan"]:
+            if pattern.search(plan):
+                stmt_passed = False
+                debug_str += (
+                    f"\nPlan matches forbidden pattern {pattern.pattern}"
+                )
+        if opt.cmdargs.plan_baseline:
+            basename = opt.cmdargs.plan_baseline + os.sep + planname
+            if os.path.exists(basename):
+                with open(basename, mode="r", encoding="utf-8") as f:
+                    baseplan = f.read().strip()
+                if baseplan != plan:
+                    stmt_passed = False
+                    debug_str += "\nPlan differs from baseline:\n" + "\n".join(
+                        difflib.unified_diff(
+                            baseplan.splitlines(),
+                            plan.splitlines(),
+                            "baseline",
+                            "current",
+                            lineterm="",
+                        )
+                    )
+                    log.file.warning(
+                        f"Plan of statement {index + 1} of test {self.id}"
+                        " differs from baseline"
+                    )
+        return stmt_passed, debug_str
+
     def _check_duration(self, statement, timestart, timefinish, debug_str):
         stmt_passed = True
         timelength = timefinish - timestart
@@ -530,28 +3033,144 @@ class SingleTest:
             )
         return stmt_passed, debug_str
 
+    def _statement_groups(self):
+        """
+        Splits test statements into groups of consecutive statements with
+        the same `parallel` value, other statements go one by one. Sql
+        statements of a group must use different sessions.
+        """
+        groups = []
+        for i, statement in enumerate(self.test_statements):
+            name = statement.get("parallel")
+            joins = (
+                name is not None
+                and groups
+                and groups[-1][0][1].get("parallel") == name
+            )
+            if joins and statement.get("sql"):
+                busy = [
+                    other.get("session")
+                    for _, other in groups[-1]
+                    if other.get("sql")
+                ]
+                if statement.get("session") in busy:
+                    log.file.warning(
+                        f"Statement {i + 1} of test {self.id} uses the same"
+                        " session as other statement of its parallel group"
+                        " and will start a new group"
+                    )
+                    joins = False
+            if joins:
+                groups[-1].append((i, statement))
+            else:
+                groups.append([(i, statement)])
+        return groups
+
+    def _exec_parallel(self, group, test_vars):
+        """
+        Executes statements of a group concurrently, all of them start at
+        the same moment (after their own `delay`). Returns True if all of
+        them passed.
+        """
+        barrier = threading.Barrier(len(group))
+
+        def execute(statement, i):
+            barrier.wait()
+            return self.ExecStatement(statement, test_vars, i)
+
+        with phase("parallel"), concurrent.futures.ThreadPoolExecutor(
+            len(group)
+        ) as executor:
+            futures = [
+                executor.submit(execute, statement, i)
+                for i, statement in group
+            ]
+            return all([future.result() for future in futures])
+
     def RunTest(self):
         """
         Running main test files and statements
         """
         test_passed = True
         test_vars = {}
+        self.benchmarks = {}
         if hasattr(self, "test_files"):
             self.StoreRes("Executing test files")
             for filename in self.test_files:
+                if self.timed_out:
+                    break
                 test_passed = test_passed and self.ExecFile(filename)
         if hasattr(self, "test_statements"):
             self.StoreRes("Processing test statements")
-            for statement in self.test_statements:
-                test_passed = test_passed and self.ExecStatement(
-                    statement, test_vars
-                )
+            rollback = (
+                getattr(self, "transaction", opt.cmdargs.transaction)
+                == "rollback"
+            )
+            self.rollback = rollback
+            self.connections = {}
+            self.profiles = {}
+            self.main = fb
+            begun = False
+            try:
+                self._open_sessions()
+                if rollback:
+                    self.main.Begin()
+                    begun = True
+                for group in self._statement_groups():
+                    if not test_passed or self.timed_out:
+                        break
+                    if len(group) == 1:
+                        i, statement = group[0]
+                        test_passed = self.ExecStatement(
+                            statement, test_vars, i
+                        )
+                    else:
+                        test_passed = self._exec_parallel(group, test_vars)
+            finally:
+                if begun:
+                    self.main.Rollback()
+                    self.StoreRes("Test transaction rolled back")
+                self._close_sessions()
         return test_passed
 
     def RunFulltest(self):
         """
         Running all test routines
         """
+        self.results = ResultWriter(self.id)
+        self.failures = []
+        self.statements = []
+        self.timings = Metrics()
+        self.timed_out = False
+        # attachments of load sessions and generator partitions
+        self.background = []
+        self.process = None
+        self.script = None
+        timeout = getattr(self, "timeout", opt.cmdargs.test_timeout)
+        try:
+            with watchdog.Guard(timeout, [], self._stop):
+                test_passed = self._run_fulltest()
+            if self.timed_out:
+                self.StoreRes(f"Test stopped after {timeout}s timeout")
+                self.failures.append(f"test timed out after {timeout}s")
+                test_passed = False
+            return test_passed
+        finally:
+            self.results.Close()
+
+    def _stop(self):
+        """
+        Called by watchdog when the test is out of time: stops whatever is
+        running now and prevents further statements and files
+        """
+        self.timed_out = True
+        if self.process is not None:
+            SingleTest.Kill(self.process)
+        if self.script is not None:
+            self.script.cancelled = True
+        watchdog.Cancel(self._attachments())
+
+    def _run_fulltest(self):
         global log
         reset = "\x1b[0m"
         red = "\x1b[31;20m"
@@ -559,95 +3178,2357 @@ class SingleTest:
         yellow = "\x1b[33;20m"
         green = "\x1b[32;20m"
         # self.StoreRes(self.__dics__)
-        if hasattr(self, "data_files") and not opt.args.no_test_data:
+        hits, misses = fb.CacheStats()
+        prepared = True
+        # data is loaded over the default attachment, profile of the test
+        # applies to its statements only
+        if hasattr(self, "data_files") and not opt.cmdargs.no_test_data:
             log.stdout.info(
                 f"{yellow}Preparing{reset} data for test "
                 f"No{self.id} {self.name}"
             )
             log.file.info(f"Preparing data for test No{self.id} {self.name}")
             for filename in self.data_files:
+                if self.timed_out:
+                    break
+                if ledger is not None and ledger.Applied(fb, filename):
+                    self.StoreRes(
+                        f"Skipping data_file {filename}, already applied"
+                    )
+                    continue
                 self.StoreRes(f"Processing data_file {filename}")
-                self.ExecFile(filename)
-        log.file.info(f"Running test No {self.id} {self.name}")
-        if self.RunTest():
+                if not self.ExecFile(filename):
+                    prepared = False
+                    break
+                if ledger is not None:
+                    ledger.Record(fb, filename)
+        if hasattr(self, "generate") and not opt.cmdargs.no_test_data:
+            for config in self.generate:
+                if self.timed_out or not prepared:
+                    break
+                prepared = self.Generate(config)
+        if prepared:
+            log.file.info(f"Running test No {self.id} {self.name}")
+            test_passed = self.RunTest()
+        else:
+            self.StoreRes("Test data is not prepared, test is not run")
+            test_passed = False
+        if test_passed:
             log.stdout.info(f"{green}Passed{reset}: {self.id}, {self.name}")
             log.file.info(f"Passed: {self.id}, {self.name}")
         else:
             log.stdout.info(f"{red}Failed{reset}: {self.id}, {self.name}")
             log.file.info(f"Failed: {self.id}, {self.name}")
+        load = getattr(self, "load", None)
+        if load is None and opt.cmdargs.load:
+            load = {"sessions": opt.cmdargs.load}
+        if test_passed and load:
+            log.stdout.info(
+                f"{yellow}Loading{reset}: {self.id}, {self.name}"
+            )
+            with phase("load"):
+                test_passed = LoadTest(self, load).Run()
+            if not test_passed:
+                self.failures.append("load expectations are not met")
+                log.stdout.info(
+                    f"{red}Failed under load{reset}: {self.id}, {self.name}"
+                )
+                log.file.info(f"Failed under load: {self.id}, {self.name}")
+        cache_hits, cache_misses = fb.CacheStats()
+        log.file.info(
+            f"Statement cache: {cache_hits - hits} hits,"
+            f" {cache_misses - misses} misses"
+        )
+        return test_passed
 
 
-def restore_database(opt, log):
-    log.file.info(
-        f"Restoring database {opt.cmdargs.database} from backup file {opt.cmdargs.use_backup}"
-    )
-    cmd = [
-        opt.cmdargs.gbak,
-        "-rep",
-        "-user",
-        opt.cmdargs.username,
-        "-pass",
-        opt.cmdargs.password,
-        opt.cmdargs.use_backup,
-        opt.cmdargs.server
-        + "/"
-        + opt.cmdargs.port
-        + ":"
-        + opt.cmdargs.database,
-    ]
-    p = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
-    )
-    p.communicate()
-    if p.returncode != 0:
-        log.file.error(
-            f"Error restoring backup {opt.cmdargs.use_backup}"
-            f" to database {opt.cmdargs.database}"
+class DataGenerator:
+    """
+    Fills a table with synthetic rows described by an item of the `generate`
+    section of a test. Rows are inserted in batches with executemany, every
+    batch has its own random seed so the data does not depend on the number
+    of partitions inserting it in parallel.
+    """
+
+    def __init__(self, config):
+        self.table = config["table"]
+        self.rows = int(config["rows"])
+        self.batch = int(config.get("batch", 10000))
+        self.seed = config.get("seed", 0)
+        self.partitions = max(int(config.get("partitions", 1)), 1)
+        self.columns = config["columns"]
+        self.values = {}
+
+    def _load_values(self, conn):
+        """
+        Reads values for `choice` from a query and `references` generators
+        """
+        for column, spec in self.columns.items():
+            query = None
+            if isinstance(spec.get("choice"), str):
+                query = spec["choice"]
+            elif "references" in spec:
+                table, _, field = spec["references"].partition(".")
+                query = f"select distinct {field} from {table}"
+            if query is None:
+                continue
+            res = conn.Values(query)
+            if type(res) is tuple:
+                raise ValueError(f"{column}: {res[0]}")
+            if not res:
+                raise ValueError(f"{column}: no values to choose from")
+            self.values[column] = sorted(res, key=str)
+
+    def _value(self, column, spec, rnd, number):
+        if "sequence" in spec:
+            return spec["sequence"] + number * spec.get("step", 1)
+        if "random" in spec:
+            low, high = spec["random"]
+            if isinstance(low, int) and isinstance(high, int):
+                return rnd.randint(low, high)
+            return rnd.uniform(low, high)
+        if column in self.values:
+            return rnd.choice(self.values[column])
+        if "choice" in spec:
+            return rnd.choice(spec["choice"])
+        if "value" in spec:
+            return spec["value"]
+        raise ValueError(f"{column}: unknown generator {spec}")
+
+    def Batch(self, number):
+        """
+        Returns rows of the batch with given number
+        """
+        rnd = random.Random(f"{self.seed}:{self.table}:{number}")
+        first = number * self.batch
+        return [
+            [
+                self._value(column, spec, rnd, row)
+                for column, spec in self.columns.items()
+            ]
+            for row in range(first, min(first + self.batch, self.rows))
+        ]
+
+    def _partition(self, conn, partition, errors):
+        statement = (
+            f"insert into {self.table} ({', '.join(self.columns)})"
+            f" values ({', '.join('?' * len(self.columns))})"
+        )
+        batches = -(-self.rows // self.batch)
+        for number in range(partition, batches, self.partitions):
+            if errors:
+                break
+            # errors of generators must reach Run from partition threads
+            try:
+                res = conn.ExecuteMany(statement, self.Batch(number))
+            except (KeyError, TypeError, ValueError) as error:
+                res = (str(error),)
+            if type(res) is tuple:
+                errors.append(f"batch {number + 1}: {res[0]}")
+
+    def Run(self, conn, background=None):
+        """
+        Inserts all rows, returns (passed, debug string). Attachments of
+        partitions are added to background list while they are open, so the
+        test timeout can cancel them.
+        """
+        if background is None:
+            background = []
+        timestart = time.perf_counter()
+        try:
+            self._load_values(conn)
+        except ValueError as error:
+            return False, f"Can not generate {self.table}: {error}"
+        errors = []
+        if self.partitions == 1:
+            self._partition(conn, 0, errors)
+        else:
+            conns = [
+                connect_database(opt, log) for _ in range(self.partitions)
+            ]
+            background.extend(conns)
+            threads = [
+                threading.Thread(
+                    target=self._partition, args=(conns[i], i, errors)
+                )
+                for i in range(self.partitions)
+            ]
+            with phase("execute"):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            for partition in conns:
+                background.remove(partition)
+                partition.Close()
+        elapsed = time.perf_counter() - timestart
+        if errors:
+            return False, f"Can not generate {self.table}: {errors[0]}"
+        return True, (
+            f"Generated {self.rows} rows into {self.table} in"
+            f" {elapsed:.2f}s ({self.rows / max(elapsed, 1e-9):.0f} rows/s)"
         )
-        sys.exit(1)
 
 
-def run_tests(opt, log):
-    if os.path.isdir(opt.cmdargs.run_test):
-        for filename in sorted(os.listdir(opt.cmdargs.run_test)):
-            ext = os.path.splitext(filename)[1]
-            if ext in (".yaml", ".yml"):
-                atest = SingleTest(opt.cmdargs.run_test + os.sep + filename)
-                atest.RunFulltest()
-    elif os.path.isfile(opt.cmdargs.run_test):
-        atest = SingleTest(opt.cmdargs.run_test)
-        atest.RunFulltest()
-    else:
-        log.stdout.error(
-            f"{opt.cmdargs.run_test} is neither file nor dir so nothing to run"
+class LoadTest:
+    """
+    Replays statements of a test from several concurrent sessions, each with
+    its own attachment, and checks latency and throughput
+    """
+
+    def __init__(self, atest, config):
+        """
+        config is the `load` section of the test
+        """
+        self.test = atest
+        self.sessions = int(config.get("sessions", 1))
+        self.duration = config.get("duration", opt.cmdargs.load_duration)
+        self.iterations = int(
+            config.get("iterations", opt.cmdargs.load_iterations)
         )
-        log.file.error(
-            f"{opt.cmdargs.run_test} is neither file nor dir so nothing to run"
+        self.config = config
+        self.statements = getattr(atest, "test_statements", [])
+        self.rollback = (
+            getattr(atest, "transaction", opt.cmdargs.transaction)
+            == "rollback"
         )
+        # per statement lists of latencies and error counters
+        self.latencies = [[] for _ in self.statements]
+        self.errors = [0 for _ in self.statements]
+        self.rounds = 0
+        self.lock = threading.Lock()
 
+    def _expects_error(self, statement):
+        return "expect_error_gdscode" in statement or (
+            "expect_error_string" in statement
+        )
 
-def main():
-    global log
-    global opt
-    global fb
-    opt = FBTOptions()
-    log = FBTLog(opt)
-    log.file.info(f"Script invoked with {str(opt.cmdargs)}")
-    if opt.cmdargs.use_backup:
-        restore_database(opt, log)
-    fb = Firebird()
-    log.file.info(f"Connect to {opt.cmdargs.server}:{opt.cmdargs.database}")
-    fb.Connect(
-        opt.cmdargs.database,
-        opt.cmdargs.username,
-        opt.cmdargs.password,
-        opt.cmdargs.server,
-        opt.cmdargs.port,
+    def _key(self, statement):
+        """
+        Attachment of a load session the statement runs on: the one of its
+        test session, of its profile or of the profile of the test
+        """
+        if statement.get("session") is not None:
+            return ("session", statement["session"])
+        if statement.get("profile") is not None:
+            return ("profile", statement["profile"])
+        return ("profile", getattr(self.test, "profile", None))
+
+    def _attach(self):
+        """
+        Takes attachments of one load session from the pool, the same way
+        the test gets them for its profiles and sessions
+        """
+        config = getattr(self.test, "sessions", {})
+        conns = {}
+        for statement in self.statements:
+            key = self._key(statement)
+            if not statement.get("sql") or key in conns:
+                continue
+            if key[0] == "session":
+                session = config.get(key[1]) or {}
+                conns[key] = pool.Acquire(
+                    session.get("profile"),
+                    session.get("isolation"),
+                    session.get("lock_timeout"),
+                )
+            else:
+                conns[key] = pool.Acquire(key[1])
+        return conns
+
+    def _session(self, conns, barrier):
+        """
+        Body of one session thread
+        """
+        latencies = [[] for _ in self.statements]
+        errors = [0 for _ in self.statements]
+        rounds = 0
+        barrier.wait()
+        deadline = None
+        if self.duration:
+            deadline = time.perf_counter() + float(self.duration)
+        while True:
+            if deadline is None and rounds >= self.iterations:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if self.test.timed_out:
+                break
+            test_vars = {}
+            if self.rollback:
+                for conn in conns.values():
+                    conn.Begin()
+            for i, statement in enumerate(self.statements):
+                # every round runs in autocommit or in its own transaction
+                if statement.get("sql") and SingleTest.TRANSACTION.match(
+                    self.test._sql_text(statement)
+                ):
+                    continue
+                conn = conns.get(self._key(statement))
+                timestart = time.perf_counter()
+                try:
+                    paramlist = self.test._prepare_param_list(
+                        statement, test_vars
+                    )
+                    if statement.get("sql"):
+                        res = self.test._execute_sql_statement(
+                            statement, paramlist, conn
+                        )
+                    else:
+                        res, _, _ = self.test._execute_http_request(
+                            statement, paramlist
+                        )
+                except KeyError as error:
+                    res = (f"Variable {error} is not set",)
+                latencies[i].append(time.perf_counter() - timestart)
+                if type(res) is tuple:
+                    if not self._expects_error(statement):
+                        errors[i] += 1
+                elif type(res) is dict and statement.get("sql"):
+                    self.test._store_vars(res, test_vars)
+            if self.rollback:
+                for conn in conns.values():
+                    conn.Rollback()
+            rounds += 1
+        with self.lock:
+            for i in range(len(self.statements)):
+                self.latencies[i].extend(latencies[i])
+                self.errors[i] += errors[i]
+            self.rounds += rounds
+
+    def Run(self):
+        """
+        Runs the load and returns True if all expectations are met
+        """
+        sessions = [self._attach() for _ in range(self.sessions)]
+        # the test timeout cancels statements of sessions too
+        for conns in sessions:
+            self.test.background.extend(conns.values())
+        barrier = threading.Barrier(self.sessions + 1)
+        threads = [
+            threading.Thread(target=self._session, args=(conns, barrier))
+            for conns in sessions
+        ]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        timestart = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - timestart
+        for conns in sessions:
+            for conn in conns.values():
+                self.test.background.remove(conn)
+                pool.Release(conn)
+        return self._check(elapsed)
+
+    def _check(self, elapsed):
+        load_passed = True
+        tps = self.rounds / elapsed if elapsed else 0.0
+        report = (
+            f"### Load: {self.sessions} sessions, {self.rounds} rounds"
+            f" in {elapsed:.3f}s, {tps:.2f} rounds/s"
+        )
+        if "expect_tps" in self.config and tps < float(
+            self.config["expect_tps"]
+        ):
+            load_passed = False
+            report += (
+                f"\nThroughput {tps:.2f} is below"
+                f" {self.config['expect_tps']}"
+            )
+        max_errors = int(self.config.get("max_errors", 0))
+        for i, statement in enumerate(self.statements):
+            values = sorted(self.latencies[i])
+            stats = {
+                "p50": Adds.Percentile(values, 50),
+                "p95": Adds.Percentile(values, 95),
+                "p99": Adds.Percentile(values, 99),
+                "max": values[-1] if values else 0.0,
+            }
+            report += (
+                f"\nStatement {i + 1}: {len(values)} runs,"
+                f" {len(values) / elapsed if elapsed else 0.0:.2f}/s,"
+                f" {self.errors[i]} errors, "
+                + ", ".join(f"{k} {v:.4f}s" for k, v in stats.items())
+            )
+            if self.errors[i] > max_errors:
+                load_passed = False
+                report += f"\nStatement {i + 1} failed {self.errors[i]} times"
+            for key, value in stats.items():
+                limit = statement.get(
+                    f"expect_{key}", self.config.get(f"expect_{key}")
+                )
+                if limit is not None and value > float(limit):
+                    load_passed = False
+                    report += (
+                        f"\nStatement {i + 1} {key} {value:.4f}s"
+                        f" exceeds {limit}s"
+                    )
+        report += "\nPASSED" if load_passed else "\nFAILED"
+        self.test.StoreRes(report)
+        log.file.info(
+            f"Load of test {self.test.id}: {self.rounds} rounds,"
+            f" {tps:.2f} rounds/s"
+        )
+        return load_passed
+
+
+class Metrics:
+    """
+    Histograms of statement and file durations labelled by test id,
+    statement number (file name for files) and kind, written as OpenMetrics
+    text for Prometheus textfile collector and as JSON summary
+    """
+
+    BUCKETS = (
+        0.001,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+        30.0,
+        60.0,
+        300.0,
+        float("inf"),
+    )
+    NAME = "fdbtest_statement_duration_seconds"
+
+    def __init__(self, directory=None, interval=0):
+        self.directory = directory
+        self.interval = interval
+        self.written = time.perf_counter()
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def Observe(self, test, statement, kind, seconds):
+        key = (str(test), str(statement), kind)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {
+                    "buckets": [0] * len(self.BUCKETS),
+                    "sum": 0.0,
+                    "count": 0,
+                    "min": seconds,
+                    "max": seconds,
+                }
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    series["buckets"][i] += 1
+                    break
+            series["sum"] += seconds
+            series["count"] += 1
+            series["min"] = min(series["min"], seconds)
+            series["max"] = max(series["max"], seconds)
+
+    def Export(self):
+        """
+        Returns histograms as list of dicts that can be sent between
+        processes and merged with Merge
+        """
+        with self.lock:
+            return [
+                dict(series, test=test, statement=statement, kind=kind)
+                for (test, statement, kind), series in self.series.items()
+            ]
+
+    def Merge(self, exported):
+        with self.lock:
+            for item in exported:
+                key = (item["test"], item["statement"], item["kind"])
+                series = self.series.get(key)
+                if series is None:
+                    self.series[key] = {
+                        "buckets": list(item["buckets"]),
+                        "sum": item["sum"],
+                        "count": item["count"],
+                        "min": item["min"],
+                        "max": item["max"],
+                    }
+                    continue
+                series["buckets"] = [
+                    a + b for a, b in zip(series["buckets"], item["buckets"])
+                ]
+                series["sum"] += item["sum"]
+                series["count"] += item["count"]
+                series["min"] = min(series["min"], item["min"])
+                series["max"] = max(series["max"], item["max"])
+
+    def Collect(self, res):
+        """
+        Adds histograms of finished test, writes all of them if it is time
+        """
+        self.Merge(res.get("histograms", []))
+        if (
+            self.interval
+            and time.perf_counter() - self.written >= self.interval
+        ):
+            self.Write()
+
+    def _labels(self, test, statement, kind):
+        def escape(value):
+            return (
+                value.replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n")
+            )
+
+        return (
+            f'test="{escape(test)}",statement="{escape(statement)}",'
+            f'kind="{kind}"'
+        )
+
+    def _quantile(self, series, percent):
+        """
+        Upper bound of the bucket holding given percentile
+        """
+        rank = series["count"] * percent / 100
+        total = 0
+        for bound, count in zip(self.BUCKETS, series["buckets"]):
+            total += count
+            if total >= rank:
+                return min(bound, series["max"])
+        return series["max"]
+
+    def Write(self):
+        if not self.directory:
+            return
+        self.written = time.perf_counter()
+        with self.lock:
+            items = sorted(self.series.items())
+        lines = [
+            f"# TYPE {self.NAME} histogram",
+            f"# UNIT {self.NAME} seconds",
+            f"# HELP {self.NAME} Duration of test statements and files.",
+        ]
+        summary = []
+        for (test, statement, kind), series in items:
+            labels = self._labels(test, statement, kind)
+            total = 0
+            for bound, count in zip(self.BUCKETS, series["buckets"]):
+                total += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'{self.NAME}_bucket{{{labels},le="{le}"}} {total}'
+                )
+            lines.append(f"{self.NAME}_sum{{{labels}}} {series['sum']!r}")
+            lines.append(f"{self.NAME}_count{{{labels}}} {series['count']}")
+            summary.append(
+                {
+                    "test": test,
+                    "statement": statement,
+                    "kind": kind,
+                    "count": series["count"],
+                    "sum": series["sum"],
+                    "mean": series["sum"] / series["count"],
+                    "min": series["min"],
+                    "max": series["max"],
+                    "p50": self._quantile(series, 50),
+                    "p95": self._quantile(series, 95),
+                    "p99": self._quantile(series, 99),
+                }
+            )
+        lines.append("# EOF")
+        # files are replaced at once, so collectors never read half of them
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = self.directory + os.sep + "fdbtest"
+        with open(prefix + ".prom.tmp", mode="w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(prefix + ".prom.tmp", prefix + ".prom")
+        with open(prefix + ".json.tmp", mode="w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=1)
+        os.replace(prefix + ".json.tmp", prefix + ".json")
+
+
+class Benchmark:
+    """
+    Repeated execution of a statement with statistics of its timings and
+    comparison against a stored baseline
+    """
+
+    # two-sided 95% critical values of Student's t by degrees of freedom
+    T_CRITICAL = (
+        (1, 12.706),
+        (2, 4.303),
+        (3, 3.182),
+        (4, 2.776),
+        (5, 2.571),
+        (6, 2.447),
+        (7, 2.365),
+        (8, 2.306),
+        (9, 2.262),
+        (10, 2.228),
+        (15, 2.131),
+        (20, 2.086),
+        (30, 2.042),
+        (60, 2.000),
+        (120, 1.980),
     )
-    run_tests(opt, log)
+    baseline = None
+
+    def __init__(self, config):
+        """
+        config is the `benchmark` section of a statement
+        """
+        self.warmup = int(config.get("warmup", 3))
+        self.repeat = max(int(config.get("repeat", 20)), 2)
+        self.trim = config.get("trim", 0.1)
+        if self.trim != "iqr":
+            try:
+                self.trim = float(self.trim)
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid trim {self.trim!r}")
+            if not 0 <= self.trim < 0.5:
+                raise ValueError(f"trim {self.trim} is not in [0, 0.5)")
+        self.threshold = float(config.get("threshold", 0.05))
+
+    def TCritical(df):
+        critical = 1.96
+        for limit, value in reversed(Benchmark.T_CRITICAL):
+            if df <= limit:
+                critical = value
+        return critical
+
+    def Measure(self, run):
+        """
+        Returns timings of `repeat` executions after `warmup` ones, or None
+        if any execution failed
+        """
+        samples = []
+        for i in range(self.warmup + self.repeat):
+            timestart = time.perf_counter()
+            res = run()
+            elapsed = time.perf_counter() - timestart
+            if type(res) is tuple:
+                return None
+            if i >= self.warmup:
+                samples.append(elapsed)
+        return samples
+
+    def Stats(self, samples):
+        """
+        Drops outliers according to trim policy: "iqr" or a fraction removed
+        from both ends, and describes what's left
+        """
+        samples = sorted(samples)
+        if self.trim == "iqr":
+            q1 = Adds.Percentile(samples, 25)
+            q3 = Adds.Percentile(samples, 75)
+            low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+            samples = [x for x in samples if low <= x <= high]
+        else:
+            cut = int(len(samples) * self.trim)
+            if cut and len(samples) - 2 * cut >= 2:
+                samples = samples[cut:-cut]
+        mean = statistics.fmean(samples)
+        stdev = statistics.stdev(samples)
+        margin = (
+            Benchmark.TCritical(len(samples) - 1)
+            * stdev
+            / len(samples) ** 0.5
+        )
+        return {
+            "n": len(samples),
+            "mean": mean,
+            "median": statistics.median(samples),
+            "stdev": stdev,
+            "ci_low": mean - margin,
+            "ci_high": mean + margin,
+        }
+
+    def Compare(self, stats, base):
+        """
+        Welch's t-test of the current timings against baseline. Returns True
+        when the statement got significantly slower by more than threshold.
+        """
+        if base["mean"] <= 0:
+            return False, "Baseline mean is zero, comparison skipped"
+        slowdown = (stats["mean"] - base["mean"]) / base["mean"]
+        var_cur = stats["stdev"] ** 2 / stats["n"]
+        var_base = base["stdev"] ** 2 / base["n"]
+        spread = (var_cur + var_base) ** 0.5
+        if spread == 0:
+            significant = slowdown > 0
+        else:
+            t = (stats["mean"] - base["mean"]) / spread
+            # Welch-Satterthwaite degrees of freedom
+            df = (var_cur + var_base) ** 2 / (
+                var_cur**2 / (stats["n"] - 1) + var_base**2 / (base["n"] - 1)
+            )
+            significant = t > Benchmark.TCritical(df)
+        regressed = significant and slowdown > self.threshold
+        verdict = "significant slowdown" if regressed else "no regression"
+        return regressed, (
+            f"Baseline mean {base['mean']:.6f}s, change {slowdown:+.1%},"
+            f" {verdict}"
+        )
+
+    def BaselineFile():
+        if opt.cmdargs.benchmark_baseline:
+            return opt.cmdargs.benchmark_baseline
+        if opt.cmdargs.results_dir:
+            return opt.cmdargs.results_dir + os.sep + "benchmark.json"
+        return "benchmark.json"
+
+    def Baseline():
+        """
+        Baseline results, loaded once per process
+        """
+        if Benchmark.baseline is None:
+            Benchmark.baseline = {}
+            if os.path.exists(Benchmark.BaselineFile()):
+                with open(
+                    Benchmark.BaselineFile(), mode="r", encoding="utf-8"
+                ) as f:
+                    Benchmark.baseline = json.load(f)
+        return Benchmark.baseline
+
+    def SaveBaseline(results):
+        """
+        Adds benchmarks that have no baseline yet, or replaces all of them
+        with --benchmark_update
+        """
+        baseline = dict(Benchmark.Baseline())
+        changed = False
+        for res in results:
+            for key, stats in res.get("benchmarks", {}).items():
+                if opt.cmdargs.benchmark_update or key not in baseline:
+                    baseline[key] = stats
+                    changed = True
+        if changed:
+            with open(
+                Benchmark.BaselineFile(), mode="w", encoding="utf-8"
+            ) as f:
+                json.dump(baseline, f, indent=2, sort_keys=True)
+            log.file.info(
+                f"Benchmark baseline {Benchmark.BaselineFile()} saved"
+            )
+
+
+def restore_database(opt, log, target=None):
+    """
+    Restore backup file given with -b into target database (the tested one
+    by default)
+    """
+    if target is None:
+        target = opt.cmdargs.database
+    log.file.info(
+        f"Restoring database {target} from backup file {opt.cmdargs.use_backup}"
+    )
+    cmd = [
+        opt.cmdargs.gbak,
+        "-rep",
+        "-user",
+        opt.cmdargs.username,
+        "-pass",
+        opt.cmdargs.password,
+        opt.cmdargs.use_backup,
+        f"{opt.cmdargs.server}/{opt.cmdargs.port}:{target}",
+    ]
+    p = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    p.communicate()
+    if p.returncode != 0:
+        log.file.error(
+            f"Error restoring backup {opt.cmdargs.use_backup}"
+            f" to database {target}"
+        )
+        sys.exit(1)
+
+
+class Snapshot:
+    """
+    Keeps restored "golden" copies of backup files, so the tested database
+    can be reset by copying a file instead of running gbak
+    """
+
+    # ODS of databases created by the corresponding server versions
+    ODS_VERSIONS = {
+        (2, 5): "11.2",
+        (3, 0): "12.0",
+        (4, 0): "13.0",
+        (5, 0): "13.1",
+    }
+
+    def __init__(self, opt, log):
+        self.opt = opt
+        self.log = log
+        self.cache_dir = os.path.abspath(opt.cmdargs.snapshot_cache)
+        self.golden = None
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def BackupHash(self):
+        """
+        Returns sha256 of the backup file. Hashes are remembered by file size
+        and mtime to avoid reading multi-GB backups on every run.
+        """
+        backup = os.path.abspath(self.opt.cmdargs.use_backup)
+        stat = os.stat(backup)
+        indexname = self.cache_dir + os.sep + "snapshots.json"
+        index = {}
+        if os.path.exists(indexname):
+            with open(indexname, mode="r", encoding="utf-8") as f:
+                index = json.load(f)
+        known = index.get(backup)
+        if (
+            known
+            and known["size"] == stat.st_size
+            and known["mtime"] == stat.st_mtime
+        ):
+            return known["sha256"]
+        digest = hashlib.sha256()
+        with open(backup, mode="rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        index[backup] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": digest.hexdigest(),
+        }
+        with open(indexname, mode="w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+        return index[backup]["sha256"]
+
+    def OdsVersion(self):
+        """
+        Returns ODS version the server creates databases with
+        """
+        svc = fdb.services.connect(
+            host=f"{self.opt.cmdargs.server}/{self.opt.cmdargs.port}",
+            user=self.opt.cmdargs.username,
+            password=self.opt.cmdargs.password,
+        )
+        try:
+            version = svc.get_server_version()
+        finally:
+            svc.close()
+        match = re.search(r"V(\d+)\.(\d+)", version)
+        if not match:
+            return version.replace(" ", "_")
+        major, minor = int(match.group(1)), int(match.group(2))
+        return self.ODS_VERSIONS.get((major, minor), f"fb{major}.{minor}")
+
+    def Prepare(self):
+        """
+        Finds golden database for the backup or restores it once
+        """
+        key = f"{self.BackupHash()[:16]}-ods{self.OdsVersion()}"
+        self.golden = self.cache_dir + os.sep + key + ".fdb"
+        if os.path.exists(self.golden):
+            self.log.file.info(f"Using cached golden database {self.golden}")
+            return
+        restoring = self.golden + ".tmp"
+        restore_database(self.opt, self.log, restoring)
+        os.replace(restoring, self.golden)
+        self.log.file.info(f"Stored golden database {self.golden}")
+
+    def Reset(self):
+        """
+        Replace tested database with a fresh copy of the golden one. Database
+        must not have any attachments at this moment.
+        """
+        target = self.opt.cmdargs.database
+        timestart = time.perf_counter()
+        if self.opt.cmdargs.snapshot_copy == "reflink" and os.name == "posix":
+            p = subprocess.run(
+                ["cp", "--reflink=auto", self.golden, target],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            if p.returncode != 0:
+                self.log.file.warning(
+                    f"Clone of {self.golden} failed ({p.stderr.strip()}),"
+                    " falling back to plain copy"
+                )
+                shutil.copy(self.golden, target)
+        else:
+            shutil.copy(self.golden, target)
+        self.log.file.info(
+            f"Database {target} reset from golden copy in"
+            f" {time.perf_counter() - timestart:.3f}s"
+        )
+
+
+def connect_database(opt, log, tpb=None, profile=None):
+    """
+    Open an attachment to the tested database with command line credentials
+    or with the ones of connection profile
+    """
+    if profile is None:
+        profile = {}
+    conn = Firebird(opt.cmdargs.stmt_cache)
+    server = profile.get("host", opt.cmdargs.server)
+    database = profile.get("database", opt.cmdargs.database)
+    log.file.info(f"Connect to {server}:{database}")
+    conn.Connect(
+        database,
+        profile.get("user", opt.cmdargs.username),
+        profile.get("password", opt.cmdargs.password),
+        server,
+        profile.get("port", opt.cmdargs.port),
+        charset=profile.get("charset", "UTF8"),
+        tpb=tpb,
+        role=profile.get("role"),
+        buffers=profile.get("buffers"),
+    )
+    return conn
+
+
+def open_cassette(opt):
+    """
+    Returns cassette of http responses for --http_record or --http_replay
+    """
+    if opt.cmdargs.http_replay:
+        return HttpCassette(
+            opt.cmdargs.http_replay, True, opt.cmdargs.http_latency
+        )
+    if opt.cmdargs.http_record:
+        return HttpCassette(opt.cmdargs.http_record, False)
+    return None
+
+
+def load_profiles(opt, log):
+    """
+    Reads connection profiles from --profiles file
+    """
+    if not opt.cmdargs.profiles:
+        return {}
+    keys = (
+        "host",
+        "port",
+        "database",
+        "user",
+        "password",
+        "role",
+        "charset",
+        "isolation",
+        "lock_timeout",
+        "buffers",
+        "wire_compression",
+    )
+    try:
+        with open(opt.cmdargs.profiles, mode="r", encoding="utf-8") as f:
+            profiles = yaml.load(f, Loader=YAML_LOADER) or {}
+        for name, profile in profiles.items():
+            for key in profile:
+                if key not in keys:
+                    raise ValueError(f"profile {name}: unknown item {key}")
+            isolation = profile.get("isolation", "read_committed")
+            if isolation not in Firebird.ISOLATION:
+                raise ValueError(
+                    f"profile {name}: unknown isolation {isolation}"
+                )
+            if profile.get("wire_compression"):
+                log.file.warning(
+                    f"Profile {name}: wire compression can not be set per"
+                    " attachment by fdb, set WireCompression in"
+                    " firebird.conf of the client instead"
+                )
+    except (OSError, ValueError, AttributeError, yaml.YAMLError) as error:
+        log.stdout.error(f"Can not load profiles: {error}")
+        log.file.error(f"Can not load profiles: {error}")
+        sys.exit(1)
+    return profiles
+
+
+class AttachmentPool:
+    """
+    Keeps attachments of connection profiles and sessions between tests, so
+    they are not opened again for every test. Idle attachments are checked
+    before they are handed out.
+    """
+
+    def __init__(self, profiles=None):
+        self.profiles = profiles or {}
+        self.idle = {}
+        self.attached = {}
+        self.reused = {}
+        self.lock = threading.Lock()
+
+    def Acquire(self, name=None, isolation=None, lock_timeout=None):
+        """
+        Returns attachment of the profile (command line settings if name is
+        None). Isolation and lock timeout override the ones of the profile.
+        """
+        if name is not None and name not in self.profiles:
+            raise ValueError(f"unknown connection profile {name}")
+        profile = self.profiles.get(name, {})
+        isolation = isolation or profile.get("isolation")
+        if lock_timeout is None:
+            lock_timeout = profile.get("lock_timeout")
+        tpb = None
+        if isolation or lock_timeout is not None:
+            tpb = Firebird.Tpb(isolation or "read_committed", lock_timeout)
+        key = (name, tpb)
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                conn = idle.pop()
+                res = conn.Execute(
+                    "select 1 as alive from rdb$database", cache=False
+                )
+                if type(res) is dict:
+                    self.reused[name] = self.reused.get(name, 0) + 1
+                    return conn
+                log.file.warning(f"Dropping broken attachment: {res[0]}")
+                try:
+                    conn.Close()
+                except fdb.Error:
+                    pass
+        timestart = time.perf_counter()
+        conn = connect_database(opt, log, tpb, profile)
+        with self.lock:
+            self.attached.setdefault(name, []).append(
+                time.perf_counter() - timestart
+            )
+        conn.pool_key = key
+        return conn
+
+    def Release(self, conn):
+        """
+        Returns attachment to the pool, its transaction must be finished
+        """
+        with self.lock:
+            self.idle.setdefault(conn.pool_key, []).append(conn)
+
+    def Drain(self):
+        """
+        Closes idle attachments, following Acquire opens new ones
+        """
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.Close()
+            self.idle = {}
+
+    def Close(self):
+        self.Drain()
+        for name, latencies in self.attached.items():
+            log.file.info(
+                f"Profile {name or 'default'}: {len(latencies)} attachments,"
+                f" reused {self.reused.get(name, 0)} times, attach latency"
+                f" avg {statistics.mean(latencies):.4f}s"
+                f" max {max(latencies):.4f}s"
+            )
+
+
+class TestCatalog:
+    """
+    Index of test files with their id, name, tags and referenced database
+    objects, and cache of their parsed definitions. Files are parsed again
+    only when their size, mtime and content hash change, or when cached
+    definitions were normalised by another version of the script.
+    """
+
+    # bump when SingleTest.Normalise changes what it produces
+    NORMALISER = 3
+    FORMAT = f"{__version__}-{NORMALISER}"
+
+    OBJECTS = re.compile(
+        r"\b(?:FROM|JOIN|INTO|UPDATE|PROCEDURE|TABLE|VIEW)\s+"
+        r"\"?([A-Z_][A-Z0-9_$]*)",
+        re.IGNORECASE,
+    )
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index = {}
+        self.changed = False
+        if cache_dir:
+            if not os.path.exists(cache_dir + os.sep + "defs"):
+                os.makedirs(cache_dir + os.sep + "defs")
+            if os.path.exists(self._indexname()):
+                with open(self._indexname(), mode="r", encoding="utf-8") as f:
+                    self.index = json.load(f)
+        self.definitions = {}
+
+    def _indexname(self):
+        return self.cache_dir + os.sep + "index.json"
+
+    def _defname(self, digest):
+        return (
+            self.cache_dir
+            + os.sep
+            + "defs"
+            + os.sep
+            + f"{digest}.{TestCatalog.FORMAT}.pickle"
+        )
+
+    def Entry(self, filename):
+        """
+        Returns index entry of the test file, parsing it if necessary
+        """
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        entry = self.index.get(path)
+        if entry and entry.get("format") != TestCatalog.FORMAT:
+            entry = None
+        if (
+            entry
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime
+            and os.path.exists(self._defname(entry["sha256"]))
+        ):
+            return entry
+        with open(path, mode="rb") as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        if (
+            entry
+            and entry["sha256"] == digest
+            and os.path.exists(self._defname(digest))
+        ):
+            entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+            self.changed = True
+            return entry
+        definition = SingleTest.Normalise(
+            yaml.load(content.decode("utf-8"), Loader=YAML_LOADER)
+        )
+        objects = set()
+        for statement in definition.get("test_statements", []):
+            if statement.get("sql"):
+                objects.update(
+                    name.upper()
+                    for name in self.OBJECTS.findall(statement["sql"])
+                )
+        entry = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": digest,
+            "format": TestCatalog.FORMAT,
+            "id": definition.get("id", ""),
+            "name": str(definition.get("name", "")),
+            "tags": [str(tag).lower() for tag in definition.get("tags", [])],
+            "objects": sorted(objects),
+        }
+        self.index[path] = entry
+        self.changed = True
+        self.definitions[path] = definition
+        if self.cache_dir:
+            with open(self._defname(digest), mode="wb") as f:
+                pickle.dump(definition, f)
+        return entry
+
+    def Definition(self, filename):
+        path = os.path.abspath(filename)
+        if path not in self.definitions:
+            with open(
+                self._defname(self.index[path]["sha256"]), mode="rb"
+            ) as f:
+                self.definitions[path] = pickle.load(f)
+        return self.definitions[path]
+
+    def Save(self):
+        if self.cache_dir and self.changed:
+            with open(self._indexname(), mode="w", encoding="utf-8") as f:
+                json.dump(self.index, f, indent=1)
+
+
+class Selector:
+    """
+    Compiled --select expression. Terms are `tag:x`, `id:x`, `name:x`,
+    `object:x` and `file:x` (shell-style patterns allowed), a bare word means
+    a tag. Terms are combined with `and`, `or`, `not` and parentheses.
+    """
+
+    TOKENS = re.compile(r"\s*(\(|\)|[^\s()]+)")
+
+    def __init__(self, expression):
+        self.tokens = self.TOKENS.findall(expression)
+        self.pos = 0
+        self.match = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError(f"unexpected {self.tokens[self.pos]!r}")
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise ValueError("unexpected end of expression")
+        self.pos += 1
+        return token
+
+    def _or(self):
+        parts = [self._and()]
+        while self._peek() and self._peek().lower() == "or":
+            self._next()
+            parts.append(self._and())
+        return lambda entry: any(part(entry) for part in parts)
+
+    def _and(self):
+        parts = [self._not()]
+        while self._peek() and self._peek().lower() == "and":
+            self._next()
+            parts.append(self._not())
+        return lambda entry: all(part(entry) for part in parts)
+
+    def _not(self):
+        if self._peek() and self._peek().lower() == "not":
+            self._next()
+            part = self._not()
+            return lambda entry: not part(entry)
+        return self._atom()
+
+    def _atom(self):
+        token = self._next()
+        if token == "(":
+            part = self._or()
+            if self._next() != ")":
+                raise ValueError("missing )")
+            return part
+        kind, _, pattern = token.rpartition(":")
+        kind = kind.lower() or "tag"
+        if kind in ("tag", "object"):
+            values = kind + "s"
+            pattern = pattern.lower() if kind == "tag" else pattern.upper()
+            return lambda entry: bool(
+                fnmatch.filter(entry[values], pattern)
+            )
+        if kind in ("id", "name"):
+            return lambda entry: fnmatch.fnmatchcase(entry[kind], pattern)
+        if kind == "file":
+            return lambda entry: fnmatch.fnmatch(
+                os.path.basename(entry["file"]), pattern
+            )
+        raise ValueError(f"unknown term {token!r}")
+
+
+class TestHistory:
+    """
+    Durations and outcomes of tests in previous runs, read from the run
+    history database. Used to start long tests first and to choose tests
+    for a time budget.
+    """
+
+    # durations of this many last runs are averaged to smooth out random
+    # variations of single runs
+    RUNS = 3
+
+    def __init__(self, cmdargs):
+        self.tests = {}
+        filename = RunHistory.Filename(cmdargs)
+        if not filename or not os.path.exists(filename):
+            return
+        try:
+            runs = RunHistory(filename)
+            try:
+                rows = runs.Tests(TestHistory.RUNS)
+            finally:
+                runs.Close()
+        except sqlite3.Error as error:
+            log.file.error(f"Can not read test history {filename}: {error}")
+            return
+        durations = {}
+        for file, passed, duration, finished, mtime in rows:
+            path = os.path.abspath(file)
+            durations.setdefault(path, []).append(duration)
+            # rows of a test go from the last run
+            self.tests.setdefault(
+                path,
+                {"passed": passed, "finished": finished, "mtime": mtime},
+            )
+        for path, entry in self.tests.items():
+            entry["duration"] = statistics.fmean(durations[path])
+
+    def Expected(self, atest):
+        """
+        Expected duration of the test, average of known ones for new tests
+        """
+        entry = self.tests.get(os.path.abspath(atest.filename))
+        if entry is not None:
+            return entry["duration"]
+        if not self.tests:
+            return 0.0
+        return statistics.mean(
+            entry["duration"] for entry in self.tests.values()
+        )
+
+    def Priority(self, atest):
+        """
+        Sort key of the test for a time budget: failed last time first,
+        then changed or new ones, then the ones not run for the longest time
+        """
+        path = os.path.abspath(atest.filename)
+        entry = self.tests.get(path)
+        if entry is None:
+            return (1, 0)
+        if not entry["passed"]:
+            return (0, entry["finished"])
+        if os.stat(path).st_mtime != entry["mtime"]:
+            return (1, entry["finished"])
+        return (2, entry["finished"])
+
+
+class RunHistory:
+    """
+    Metadata of every run and timings of all its tests and statements in a
+    sqlite database. Statements much slower than the median of their
+    previous runs are flagged as regressions.
+    """
+
+    SCHEMA = (
+        "create table if not exists runs ("
+        " id integer primary key, started real, finished real,"
+        " tests_rev text, server_version text, database_hash text,"
+        " command text, tests integer, failed integer)",
+        "create table if not exists tests ("
+        " run_id integer references runs (id), test text, file text,"
+        " passed integer, skipped text, duration real, mtime real)",
+        "create table if not exists statements ("
+        " run_id integer references runs (id), test text, statement text,"
+        " kind text, passed integer, duration real, rows integer,"
+        " error text, finished real, regression integer)",
+        "create index if not exists statements_key"
+        " on statements (test, statement, finished)",
+        "create index if not exists statements_finished"
+        " on statements (finished)",
+        "create index if not exists tests_key on tests (test, run_id)",
+    )
+    # regression is a statement slower than RATIO times the median of its
+    # last WINDOW runs, with at least MIN_RUNS of them known
+    WINDOW = 10
+    RATIO = 1.5
+    MIN_RUNS = 3
+    # shorter statements are too noisy to judge
+    MIN_DURATION = 0.001
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+        for statement in RunHistory.SCHEMA:
+            self.db.execute(statement)
+        # databases of older versions have no modification times of tests
+        columns = [
+            row[1] for row in self.db.execute("pragma table_info(tests)")
+        ]
+        if "mtime" not in columns:
+            self.db.execute("alter table tests add column mtime real")
+
+    def Filename(cmdargs):
+        """
+        Returns name of the history database or None if it is disabled
+        """
+        if cmdargs.history_db:
+            return cmdargs.history_db
+        if cmdargs.cache_dir:
+            return cmdargs.cache_dir + os.sep + "history.db"
+        return None
+
+    def Median(self, test, statement, window, before=None):
+        """
+        Returns median duration of last runs of the statement that passed
+        and their number
+        """
+        query = (
+            "select duration from statements"
+            " where test = ? and statement = ? and passed = 1"
+        )
+        params = [test, statement]
+        if before is not None:
+            query += " and finished < ?"
+            params.append(before)
+        query += " order by finished desc limit ?"
+        params.append(window)
+        durations = [row[0] for row in self.db.execute(query, params)]
+        if not durations:
+            return None, 0
+        return statistics.median(durations), len(durations)
+
+    def Tests(self, runs):
+        """
+        Returns (file, passed, duration, finished, mtime) of the last runs
+        of every test that was not skipped, the last run first
+        """
+        return self.db.execute(
+            "select file, passed, duration, finished, mtime from ("
+            " select t.file, t.passed, t.duration, r.finished, t.mtime,"
+            " row_number() over ("
+            " partition by t.file order by t.run_id desc) as n"
+            " from tests t join runs r on r.id = t.run_id"
+            " where t.skipped is null)"
+            " where n <= ? order by file, n",
+            (runs,),
+        ).fetchall()
+
+    def IsRegression(duration, median, runs, ratio):
+        return (
+            median is not None
+            and runs >= RunHistory.MIN_RUNS
+            and median >= RunHistory.MIN_DURATION
+            and duration > ratio * median
+        )
+
+    def Store(self, meta, results):
+        """
+        Stores the run and returns list of regressions as (test, statement,
+        duration, median)
+        """
+        regressions = []
+        finished = time.time()
+        with self.db:
+            run_id = self.db.execute(
+                "insert into runs (started, finished, tests_rev,"
+                " server_version, database_hash, command, tests, failed)"
+                " values (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    meta["started"],
+                    finished,
+                    meta["tests_rev"],
+                    meta["server_version"],
+                    meta["database_hash"],
+                    meta["command"],
+                    len(results),
+                    len([res for res in results if not res["passed"]]),
+                ),
+            ).lastrowid
+            for res in results:
+                path = os.path.abspath(res["file"])
+                self.db.execute(
+                    "insert into tests values (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        run_id,
+                        str(res["id"]),
+                        path,
+                        res["passed"],
+                        res.get("skipped"),
+                        res["duration"],
+                        (
+                            os.stat(path).st_mtime
+                            if os.path.exists(path)
+                            else None
+                        ),
+                    ),
+                )
+                for stmt in res.get("statements", []):
+                    test, statement = str(res["id"]), str(stmt["statement"])
+                    median, runs = self.Median(
+                        test, statement, RunHistory.WINDOW
+                    )
+                    regression = stmt["passed"] and RunHistory.IsRegression(
+                        stmt["duration"], median, runs, RunHistory.RATIO
+                    )
+                    if regression:
+                        regressions.append(
+                            (test, statement, stmt["duration"], median)
+                        )
+                    self.db.execute(
+                        "insert into statements"
+                        " values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            run_id,
+                            test,
+                            statement,
+                            stmt["kind"],
+                            stmt["passed"],
+                            stmt["duration"],
+                            stmt.get("rows"),
+                            stmt.get("error"),
+                            finished,
+                            regression,
+                        ),
+                    )
+        return regressions
+
+    def Close(self):
+        self.db.close()
+
+
+def load_tests(opt, log):
+    """
+    Returns the list of tests to run in the order they should be reported
+    """
+    if os.path.isdir(opt.cmdargs.run_test):
+        filenames = [
+            opt.cmdargs.run_test + os.sep + filename
+            for filename in sorted(os.listdir(opt.cmdargs.run_test))
+            if os.path.splitext(filename)[1] in (".yaml", ".yml")
+        ]
+    elif os.path.isfile(opt.cmdargs.run_test):
+        filenames = [opt.cmdargs.run_test]
+    else:
+        log.stdout.error(
+            f"{opt.cmdargs.run_test} is neither file nor dir so nothing to run"
+        )
+        log.file.error(
+            f"{opt.cmdargs.run_test} is neither file nor dir so nothing to run"
+        )
+        return []
+    selector = None
+    if opt.cmdargs.select:
+        try:
+            selector = Selector(opt.cmdargs.select)
+        except ValueError as error:
+            log.stdout.error(f"Wrong --select expression: {error}")
+            log.file.error(f"Wrong --select expression: {error}")
+            return []
+    catalog = TestCatalog(opt.cmdargs.cache_dir)
+    tests = []
+    for filename in filenames:
+        try:
+            entry = catalog.Entry(filename)
+            if opt.cmdargs.id and not fnmatch.fnmatchcase(
+                entry["id"], opt.cmdargs.id
+            ):
+                continue
+            if selector and not selector.match(dict(entry, file=filename)):
+                continue
+            atest = SingleTest(filename, catalog.Definition(filename))
+        except (OSError, ValueError, yaml.YAMLError) as error:
+            log.stdout.error(f"Can not load test {filename}: {error}")
+            log.file.error(f"Can not load test {filename}: {error}")
+            continue
+        atest.filename = filename
+        tests.append(atest)
+    catalog.Save()
+    log.file.info(f"Selected {len(tests)} of {len(filenames)} tests")
+    return tests
+
+
+class ResourceSampler:
+    """
+    Samples resource usage of the server in a background thread through its
+    own attachment. Samples are kept in memory and appended to soak.jsonl in
+    results dir.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = []
+        self.conn = None
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.filename = None
+        if opt.cmdargs.results_dir:
+            self.filename = opt.cmdargs.results_dir + os.sep + "soak.jsonl"
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+
+    def Start(self):
+        self.timestart = time.perf_counter()
+        self.thread.start()
+
+    def Stop(self):
+        """
+        Stops sampling, the last sample is taken right away
+        """
+        self.stop.set()
+        self.thread.join()
+        self._sample()
+        if self.conn is not None:
+            self.conn.Close()
+
+    def _run(self):
+        self._sample()
+        while not self.stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        if self.conn is None:
+            try:
+                self.conn = connect_database(opt, log)
+            except fdb.Error as error:
+                log.file.error(f"Soak: can not connect to sample: {error}")
+                return
+        snap = self.conn.ServerSnapshot()
+        if type(snap) is str:
+            log.file.error(f"Soak: can not sample monitoring tables: {snap}")
+            # the database may have been replaced, connect again next time
+            try:
+                self.conn.Close()
+            except fdb.Error:
+                pass
+            self.conn = None
+            return
+        snap["elapsed"] = time.perf_counter() - self.timestart
+        snap["time"] = time.time()
+        self.samples.append(snap)
+        if self.filename:
+            with open(self.filename, mode="a", encoding="utf-8") as f:
+                f.write(json.dumps(snap) + "\n")
+
+
+class Soak:
+    """
+    Long run of the selected tests in loops. Memory of the database, the gap
+    between the oldest active and the next transaction and duration of loops
+    must not grow faster than configured slopes.
+    """
+
+    def __init__(self, cmdargs):
+        self.duration = cmdargs.soak
+        self.limits = {
+            "memory": cmdargs.max_memory_slope,
+            "gap": cmdargs.max_gap_slope,
+            "latency": cmdargs.max_latency_drift,
+        }
+        self.sampler = ResourceSampler(cmdargs.soak_interval)
+        self.loops = []
+
+    def Slope(points):
+        """
+        Least squares slope of (seconds, value) points per hour, None if
+        there are not enough of them
+        """
+        if len(points) < 2:
+            return None
+        mean_x = statistics.mean(x for x, _ in points)
+        mean_y = statistics.mean(y for _, y in points)
+        var = sum((x - mean_x) ** 2 for x, _ in points)
+        if not var:
+            return None
+        cov = sum((x - mean_x) * (y - mean_y) for x, y in points)
+        return cov / var * 3600
+
+    def Slopes(self):
+        """
+        Returns slopes per hour of memory, transaction gap, attachments and
+        of loop duration in percent of the average loop
+        """
+        slopes = {
+            key: Soak.Slope(
+                [(snap["elapsed"], snap[key]) for snap in self.sampler.samples]
+            )
+            for key in ("memory", "gap", "attachments")
+        }
+        slopes["latency"] = None
+        drift = Soak.Slope(
+            [(loop["elapsed"], loop["duration"]) for loop in self.loops]
+        )
+        if drift is not None:
+            average = statistics.mean(loop["duration"] for loop in self.loops)
+            slopes["latency"] = drift / average * 100 if average else None
+        return slopes
+
+    def Check(self):
+        """
+        Returns list of slopes exceeding their limits
+        """
+        slopes = self.Slopes()
+        failures = []
+        for key, limit in self.limits.items():
+            if limit is None:
+                continue
+            if slopes[key] is None:
+                failures.append(f"{key} slope can not be computed")
+            elif slopes[key] > limit:
+                failures.append(
+                    f"{key} grows by {slopes[key]:.1f} per hour,"
+                    f" limit is {limit}"
+                )
+        return slopes, failures
+
+
+def run_single_test(atest):
+    """
+    Runs one test and returns a short summary of its outcome
+    """
+    timestart = time.perf_counter()
+    if snapshot and opt.cmdargs.snapshot_per_test:
+        fb.Close()
+        # the database file is replaced, no attachment may stay open
+        watchdog.Close()
+        pool.Drain()
+        snapshot.Reset()
+        fb.Connect(fb.database, fb.username, fb.password, fb.host, fb.port)
+    if profiler is not None:
+        profiler.Start()
+    try:
+        test_passed = atest.RunFulltest()
+    except Exception as error:
+        log.stdout.error(f"Test {atest.filename} crashed: {error!r}")
+        log.file.exception(f"Test {atest.filename} crashed")
+        test_passed = False
+        atest.failures = getattr(atest, "failures", []) + [
+            f"test crashed: {error!r}"
+        ]
+    duration = time.perf_counter() - timestart
+    return {
+        "file": atest.filename,
+        "id": getattr(atest, "id", ""),
+        "name": getattr(atest, "name", ""),
+        "passed": test_passed,
+        "duration": duration,
+        "benchmarks": getattr(atest, "benchmarks", {}),
+        "failures": getattr(atest, "failures", []),
+        "histograms": (
+            atest.timings.Export() if hasattr(atest, "timings") else []
+        ),
+        "phases": profiler.Stop(duration) if profiler is not None else {},
+        "statements": getattr(atest, "statements", []),
+    }
+
+
+def init_worker(cmdargs, version):
+    """
+    Prepares a worker process of a parallel run: its own options, log and
+    database attachment
+    """
+    global log
+    global opt
+    global fb
+    global ledger
+    global watchdog
+    global pool
+    global profiler
+    global cassette
+    global metadata_version
+    opt = FBTOptions(cmdargs)
+    metadata_version = version
+    log = FBTLog(opt, worker=os.getpid())
+    fb = connect_database(opt, log)
+    if opt.cmdargs.fixture_ledger:
+        ledger = FixtureLedger()
+    watchdog = Watchdog()
+    pool = AttachmentPool(load_profiles(opt, log))
+    if opt.cmdargs.timing_profile:
+        profiler = Profiler(
+            opt.cmdargs.timing_profile,
+            profile_path(opt, f"fdbtest.{os.getpid()}"),
+        )
+    cassette = open_cassette(opt)
+    # runs when the worker exits after the pool is closed
+    multiprocessing.util.Finalize(None, close_worker, exitpriority=10)
+
+
+def close_worker():
+    """
+    Closes attachments a worker process keeps between tests
+    """
+    watchdog.Close()
+    pool.Close()
+
+
+def run_test_group(group):
+    """
+    Runs tests of one scheduling unit one by one in a worker process.
+    Returns list of (position, summary) pairs.
+    """
+    return [(pos, run_single_test(atest)) for pos, atest in group]
+
+
+def split_tests(tests):
+    """
+    Splits tests into groups that may run in parallel and a list of exclusive
+    tests. Tests that share a resource_group, or with --fixture_ledger share
+    any of data files, always run one after another.
+    """
+    parent = list(range(len(tests)))
+
+    def find(pos):
+        while parent[pos] != pos:
+            parent[pos] = parent[parent[pos]]
+            pos = parent[pos]
+        return pos
+
+    owners = {}
+    exclusive = []
+    for pos, atest in enumerate(tests):
+        if getattr(atest, "exclusive", False):
+            exclusive.append((pos, atest))
+            continue
+        keys = []
+        if getattr(atest, "resource_group", None):
+            keys.append(("group", atest.resource_group))
+        if opt.cmdargs.fixture_ledger and not opt.cmdargs.no_test_data:
+            for filename in getattr(atest, "data_files", []):
+                keys.append(("file", os.path.abspath(filename)))
+        for key in keys:
+            if key in owners:
+                parent[find(pos)] = find(owners[key])
+            else:
+                owners[key] = pos
+    groups = {}
+    for pos, atest in enumerate(tests):
+        if not getattr(atest, "exclusive", False):
+            groups.setdefault(find(pos), []).append((pos, atest))
+    groups = sorted(groups.values(), key=lambda group: group[0][0])
+    return groups, exclusive
+
+
+def skipped_test(atest, reason):
+    """
+    Summary of a test that was not run
+    """
+    return {
+        "file": atest.filename,
+        "id": getattr(atest, "id", ""),
+        "name": getattr(atest, "name", ""),
+        "passed": True,
+        "skipped": reason,
+        "duration": 0.0,
+        "benchmarks": {},
+        "failures": [],
+    }
+
+
+def select_tests(tests, history, log):
+    """
+    Chooses tests that fit into --time_budget, returns positions of them
+    """
+    capacity = opt.cmdargs.time_budget * max(opt.cmdargs.jobs, 1)
+    planned = 0.0
+    selected = set()
+    order = sorted(
+        range(len(tests)), key=lambda pos: history.Priority(tests[pos])
+    )
+    for pos in order:
+        expected = history.Expected(tests[pos])
+        if planned + expected <= capacity:
+            planned += expected
+            selected.add(pos)
+    log.file.info(
+        f"Time budget {opt.cmdargs.time_budget}s: selected {len(selected)}"
+        f" of {len(tests)} tests, expected {planned:.1f}s of work"
+    )
+    return selected
+
+
+def run_tests(opt, log, final=True):
+    """
+    Runs selected tests once and returns their summaries. JUnit report,
+    baseline and run history are written only by the final run, loops of a
+    soak run leave them to finish_run.
+    """
+    started = time.time()
+    tests = load_tests(opt, log)
+    history = TestHistory(opt.cmdargs)
+    results = {}
+    if opt.cmdargs.time_budget is not None:
+        selected = select_tests(tests, history, log)
+        for pos, atest in enumerate(tests):
+            if pos not in selected:
+                results[pos] = skipped_test(atest, "time budget")
+        tests = [atest for pos, atest in enumerate(tests) if pos in selected]
+        positions = sorted(selected)
+    else:
+        positions = list(range(len(tests)))
+    groups, exclusive = split_tests(tests)
+    # split_tests numbers tests of the selection, map them back
+    groups = [
+        [(positions[pos], atest) for pos, atest in group] for group in groups
+    ]
+    exclusive = [(positions[pos], atest) for pos, atest in exclusive]
+    failed = 0
+    limit = opt.cmdargs.max_failures
+    metrics = Metrics(
+        opt.cmdargs.metrics or opt.cmdargs.results_dir,
+        opt.cmdargs.metrics_interval,
+    )
+    if opt.cmdargs.jobs > 1 and len(tests) > 1:
+        log.file.info(
+            f"Running {len(tests)} tests in {opt.cmdargs.jobs} workers,"
+            f" {len(exclusive)} of them exclusively"
+        )
+        # the longest groups go first so they don't finish the run alone
+        groups.sort(
+            key=lambda group: sum(
+                history.Expected(atest) for _, atest in group
+            ),
+            reverse=True,
+        )
+        with multiprocessing.Pool(
+            opt.cmdargs.jobs,
+            initializer=init_worker,
+            initargs=(opt.cmdargs, metadata_version),
+        ) as workers:
+            for group_results in workers.imap_unordered(
+                run_test_group, groups
+            ):
+                for pos, res in group_results:
+                    results[pos] = res
+                    failed += not res["passed"]
+                    metrics.Collect(res)
+                if limit and failed >= limit:
+                    workers.terminate()
+                    break
+            else:
+                # let workers exit on their own to close their attachments
+                workers.close()
+                workers.join()
+        for pos, atest in exclusive:
+            if limit and failed >= limit:
+                break
+            results[pos] = run_single_test(atest)
+            failed += not results[pos]["passed"]
+            metrics.Collect(results[pos])
+    else:
+        # in a single process exclusive tests keep their places between
+        # groups, and tests of a group still run one after another
+        units = sorted(
+            groups + [[item] for item in exclusive],
+            key=lambda unit: unit[0][0],
+        )
+        for pos, atest in [item for unit in units for item in unit]:
+            if limit and failed >= limit:
+                break
+            results[pos] = run_single_test(atest)
+            failed += not results[pos]["passed"]
+            metrics.Collect(results[pos])
+    if limit and failed >= limit:
+        log.stdout.info(f"Stopped after {failed} failed tests")
+        log.file.info(f"Stopped after {failed} failed tests")
+        for group in groups + [exclusive]:
+            for pos, atest in group:
+                if pos not in results:
+                    results[pos] = skipped_test(atest, "too many failures")
+    results = [results[pos] for pos in sorted(results)]
+    metrics.Write()
+    print_summary(results, log)
+    if profiler is not None:
+        print_profile(opt, results, log)
+    if final:
+        finish_run(opt, log, started, results)
+    return results
+
+
+def finish_run(opt, log, started, results):
+    """
+    Writes JUnit report and benchmark baseline, stores the run in history
+    """
+    write_junit(opt, results)
+    Benchmark.SaveBaseline(results)
+    store_run(opt, log, started, results)
+
+
+def tests_revision(opt):
+    """
+    Returns git revision of the tests or None if they are not in git
+    """
+    directory = opt.cmdargs.run_test
+    if not os.path.isdir(directory):
+        directory = os.path.dirname(directory) or "."
+    try:
+        p = subprocess.run(
+            ["git", "-C", directory, "describe", "--always", "--dirty"],
+            capture_output=True,
+            universal_newlines=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return p.stdout.strip() if p.returncode == 0 else None
+
+
+def store_run(opt, log, started, results):
+    """
+    Adds the run to the history database and reports statements that got
+    slower than they used to be
+    """
+    filename = RunHistory.Filename(opt.cmdargs)
+    if not filename:
+        return
+    if os.path.dirname(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+    meta = {
+        "started": started,
+        "tests_rev": tests_revision(opt),
+        "server_version": getattr(fb.db, "version", None),
+        "database_hash": fb.MetadataHash(),
+        "command": json.dumps(
+            {
+                key: value
+                for key, value in vars(opt.cmdargs).items()
+                if key != "password"
+            },
+            default=str,
+        ),
+    }
+    try:
+        runs = RunHistory(filename)
+        try:
+            regressions = runs.Store(meta, results)
+        finally:
+            runs.Close()
+    except sqlite3.Error as error:
+        log.stdout.error(f"Can not store the run to {filename}: {error}")
+        log.file.error(f"Can not store the run to {filename}: {error}")
+        return
+    for test, statement, duration, median in regressions:
+        message = (
+            f"Regression: {test} statement {statement} took {duration:.3f}s,"
+            f" median of previous runs is {median:.3f}s"
+        )
+        log.stdout.warning(message)
+        log.file.warning(message)
+
+
+def run_soak(opt, log):
+    """
+    Runs tests in loops for --soak seconds and fails the run when resources
+    of the server or durations of loops grow too fast
+    """
+    soak = Soak(opt.cmdargs)
+    soak.sampler.Start()
+    started = time.time()
+    timestart = time.perf_counter()
+    results = []
+    while time.perf_counter() - timestart < soak.duration:
+        log.file.info(f"Soak loop {len(soak.loops) + 1}")
+        results = run_tests(opt, log, final=False)
+        soak.loops.append(
+            {
+                "elapsed": time.perf_counter() - timestart,
+                "duration": sum(res["duration"] for res in results),
+                "failed": len([res for res in results if not res["passed"]]),
+            }
+        )
+        limit = opt.cmdargs.max_failures
+        if limit and soak.loops[-1]["failed"] >= limit:
+            break
+    soak.sampler.Stop()
+    # reports and run history get the last loop only
+    finish_run(opt, log, started, results)
+    slopes, failures = soak.Check()
+    report = (
+        f"Soak: {len(soak.loops)} loops, {len(soak.sampler.samples)} samples"
+        f" in {time.perf_counter() - timestart:.0f}s, per hour: "
+        + ", ".join(
+            f"{key} {'n/a' if slope is None else format(slope, '.1f')}"
+            for key, slope in slopes.items()
+        )
+    )
+    log.stdout.info(report)
+    log.file.info(report)
+    if opt.cmdargs.results_dir:
+        with open(
+            opt.cmdargs.results_dir + os.sep + "soak.json",
+            mode="w",
+            encoding="utf-8",
+        ) as f:
+            json.dump(
+                {
+                    "loops": soak.loops,
+                    "slopes": slopes,
+                    "limits": soak.limits,
+                    "failures": failures,
+                },
+                f,
+                indent=1,
+            )
+    for failure in failures:
+        log.stdout.error(f"Soak failed: {failure}")
+        log.file.error(f"Soak failed: {failure}")
+    return not failures
+
+
+def write_junit(opt, results):
+    """
+    Stores results of the run as JUnit XML for CI tools
+    """
+    if not opt.cmdargs.results_dir:
+        return
+    suite = ET.Element(
+        "testsuite",
+        name="fdbtest",
+        tests=str(len(results)),
+        failures=str(len([res for res in results if not res["passed"]])),
+        skipped=str(len([res for res in results if res.get("skipped")])),
+        time=f"{sum(res['duration'] for res in results):.3f}",
+    )
+    for res in results:
+        case = ET.SubElement(
+            suite,
+            "testcase",
+            classname=os.path.splitext(os.path.basename(res["file"]))[0],
+            name=f"{res['id']} {res['name']}".strip(),
+            time=f"{res['duration']:.3f}",
+        )
+        if res.get("skipped"):
+            ET.SubElement(case, "skipped", message=res["skipped"])
+        elif not res["passed"]:
+            failure = ET.SubElement(
+                case,
+                "failure",
+                message=(res["failures"] or ["test failed"])[0],
+            )
+            failure.text = "\n".join(res["failures"])
+    ET.ElementTree(suite).write(
+        opt.cmdargs.results_dir + os.sep + "junit.xml",
+        encoding="utf-8",
+        xml_declaration=True,
+    )
+
+
+def print_summary(results, log):
+    """
+    Outputs results of all tests in the order of the tests themselves
+    """
+    failed = [res for res in results if not res["passed"]]
+    skipped = [res for res in results if res.get("skipped")]
+    log.file.info("Summary:")
+    for res in results:
+        status = "Passed" if res["passed"] else "Failed"
+        if res.get("skipped"):
+            status = f"Skipped ({res['skipped']})"
+        log.file.info(
+            f"{status}: {res['id']}, {res['name']} ({res['duration']:.3f}s)"
+        )
+    for res in failed:
+        log.stdout.info(f"Failed: {res['id']}, {res['name']} ({res['file']})")
+    total = (
+        f"Total: {len(results)} tests,"
+        f" {len(results) - len(failed) - len(skipped)} passed,"
+        f" {len(failed)} failed"
+    )
+    if skipped:
+        total += f", {len(skipped)} skipped"
+    log.stdout.info(total)
+    log.file.info(total)
+
+
+def profile_path(opt, name):
+    """
+    Returns file name for python profiler stats
+    """
+    return (opt.cmdargs.results_dir or ".") + os.sep + name + ".pstats"
+
+
+def print_profile(opt, results, log):
+    """
+    Outputs where the time of tests went and, in cprofile mode, hot spots of
+    the script merged from all processes of the run
+    """
+    phases = collections.Counter()
+    lines = ["Profile:"]
+    for res in results:
+        if not res.get("phases"):
+            continue
+        phases.update(res["phases"])
+        lines.append(
+            f"{res['id']} ({res['duration']:.3f}s): "
+            + format_phases(res["phases"])
+        )
+    lines.append("All tests: " + format_phases(phases))
+    for line in lines:
+        log.file.info(line)
+    log.stdout.info(lines[-1])
+    if profiler.cprofile is None:
+        return
+    profiler.cprofile.dump_stats(profile_path(opt, "fdbtest"))
+    stats = pstats.Stats(profile_path(opt, "fdbtest"), stream=io.StringIO())
+    for file in glob.glob(profile_path(opt, "fdbtest.*")):
+        stats.add(file)
+        os.remove(file)
+    stats.dump_stats(profile_path(opt, "fdbtest"))
+    stats.sort_stats("tottime").print_stats(20)
+    log.file.info("Hot spots:\n" + stats.stream.getvalue())
+    log.stdout.info(
+        f"Python profiler stats are in {profile_path(opt, 'fdbtest')}"
+    )
+
+
+def format_phases(phases):
+    total = sum(phases.values()) or 1.0
+    return ", ".join(
+        f"{name} {phases[name]:.3f}s ({phases[name] / total:.0%})"
+        for name in Profiler.PHASES + ("harness",)
+    )
+
+
+def history_command(argv):
+    """
+    Implements `fdbtest.py history`: shows recent runs and statements that
+    slowed down most, or durations of one statement across runs
+    """
+    parser = argparse.ArgumentParser(
+        prog="fdbtest.py history",
+        description="Shows timings of previous runs kept in history database",
+    )
+    parser.add_argument(
+        "--history_db",
+        help="history database (default history.db in cache dir)",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=".fdbtest_cache",
+        help="cache dir of the runs (default .fdbtest_cache)",
+    )
+    parser.add_argument("--id", help="show statements of this test only")
+    parser.add_argument(
+        "--statement",
+        help="with --id, show durations of the statement in every run",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=RunHistory.WINDOW,
+        help="number of previous runs the median is taken from",
+    )
+    parser.add_argument(
+        "--ratio",
+        type=float,
+        default=RunHistory.RATIO,
+        help="how many times slower than the median is a regression",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        help="number of slowest movers to show",
+    )
+    cmdargs = parser.parse_args(argv)
+    if cmdargs.statement and not cmdargs.id:
+        parser.error("--statement requires --id")
+    filename = RunHistory.Filename(cmdargs)
+    if not filename or not os.path.exists(filename):
+        parser.error(f"no history database {filename}")
+    runs = RunHistory(filename)
+    try:
+        if cmdargs.statement:
+            print_statement_history(runs, cmdargs)
+        else:
+            print_movers(runs, cmdargs)
+    finally:
+        runs.Close()
+
+
+def print_statement_history(runs, cmdargs):
+    """
+    Prints every run of the statement, marking the ones slower than median
+    of the runs before them
+    """
+    rows = runs.db.execute(
+        "select s.finished, r.tests_rev, r.server_version, s.duration,"
+        " s.rows, s.passed, s.error from statements s"
+        " join runs r on r.id = s.run_id"
+        " where s.test = ? and s.statement = ? order by s.finished",
+        (cmdargs.id, cmdargs.statement),
+    ).fetchall()
+    print(f"Test {cmdargs.id} statement {cmdargs.statement}:")
+    durations = []
+    for finished, rev, version, duration, count, passed, error in rows:
+        previous = durations[-cmdargs.window:]
+        median = statistics.median(previous) if previous else None
+        mark = ""
+        if not passed:
+            mark = f"FAILED {error or ''}".strip()
+        elif RunHistory.IsRegression(
+            duration, median, len(previous), cmdargs.ratio
+        ):
+            mark = f"REGRESSION x{duration / median:.1f}"
+        print(
+            f"{time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(finished))}"
+            f" {rev or '-'} {version or '-'} {duration:.4f}s"
+            f" rows {'-' if count is None else count} {mark}".rstrip()
+        )
+        if passed:
+            durations.append(duration)
+
+
+def print_movers(runs, cmdargs):
+    """
+    Prints last runs and statements of the last run that changed most
+    against median of their previous runs
+    """
+    print("Last runs:")
+    for started, rev, version, tests, failed in reversed(
+        runs.db.execute(
+            "select started, tests_rev, server_version, tests, failed"
+            " from runs order by id desc limit ?",
+            (cmdargs.window,),
+        ).fetchall()
+    ):
+        print(
+            f"{time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(started))}"
+            f" {rev or '-'} {version or '-'} {tests} tests, {failed} failed"
+        )
+    query = (
+        "select test, statement, duration, finished from statements"
+        " where run_id = (select max(id) from runs) and passed = 1"
+    )
+    params = []
+    if cmdargs.id:
+        query += " and test = ?"
+        params.append(cmdargs.id)
+    movers = []
+    for test, statement, duration, finished in runs.db.execute(
+        query, params
+    ).fetchall():
+        median, count = runs.Median(
+            test, statement, cmdargs.window, before=finished
+        )
+        if median:
+            movers.append(
+                (duration / median, test, statement, duration, median, count)
+            )
+    movers.sort(reverse=True)
+    print("Slowest movers of the last run:")
+    for ratio, test, statement, duration, median, count in movers[
+        : cmdargs.top
+    ]:
+        mark = ""
+        if RunHistory.IsRegression(duration, median, count, cmdargs.ratio):
+            mark = " REGRESSION"
+        print(
+            f"{test} statement {statement}: {duration:.4f}s, median of"
+            f" {count} runs {median:.4f}s, x{ratio:.2f}{mark}"
+        )
+
+
+def main():
+    global log
+    global opt
+    global fb
+    global snapshot
+    global ledger
+    global watchdog
+    global pool
+    global profiler
+    global cassette
+    global metadata_version
+    if sys.argv[1:2] == ["history"]:
+        history_command(sys.argv[2:])
+        return
+    opt = FBTOptions()
+    log = FBTLog(opt)
+    log.file.info(f"Script invoked with {str(opt.cmdargs)}")
+    if opt.cmdargs.snapshot_cache:
+        snapshot = Snapshot(opt, log)
+        snapshot.Prepare()
+        snapshot.Reset()
+    elif opt.cmdargs.use_backup:
+        restore_database(opt, log)
+    fb = connect_database(opt, log)
+    if opt.cmdargs.fixture_ledger:
+        ledger = FixtureLedger()
+    watchdog = Watchdog()
+    pool = AttachmentPool(load_profiles(opt, log))
+    if opt.cmdargs.timing_profile:
+        # stats of workers of an interrupted run must not get merged
+        for file in glob.glob(profile_path(opt, "fdbtest.*")):
+            os.remove(file)
+        profiler = Profiler(opt.cmdargs.timing_profile)
+    cassette = open_cassette(opt)
+    if opt.cmdargs.jobs > 1:
+        metadata_version = multiprocessing.Value("q", 0)
+    if opt.cmdargs.soak:
+        passed = run_soak(opt, log)
+    else:
+        run_tests(opt, log)
+        passed = True
+    watchdog.Close()
+    pool.Close()
+    if cassette is not None and not cassette.replay:
+        cassette.Save()
+    if not passed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fdbtest  # noqa: E402
+
+
+@pytest.fixture
+def options(monkeypatch, tmp_path):
+    """
+    Default options of the script with results and cache in a temporary
+    dir, installed as its globals. Extra options are passed as arguments.
+    """
+
+    def make(*args):
+        monkeypatch.setattr(
+            sys,
+            "argv",
+            [
+                "fdbtest.py",
+                "-d",
+                "test.fdb",
+                "-t",
+                str(tmp_path),
+                "-r",
+                str(tmp_path / "results"),
+                "--cache_dir",
+                str(tmp_path / "cache"),
+                *args,
+            ],
+        )
+        opt = fdbtest.FBTOptions()
+        monkeypatch.setattr(fdbtest, "opt", opt)
+        monkeypatch.setattr(fdbtest, "log", fdbtest.FBTLog(opt))
+        return opt.cmdargs
+
+    return make
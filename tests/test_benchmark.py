@@ -0,0 +1,95 @@
+import statistics
+
+import pytest
+
+from fdbtest import Benchmark, SingleTest
+
+
+def test_t_critical():
+    assert Benchmark.TCritical(1) == 12.706
+    assert Benchmark.TCritical(12) == 2.131
+    assert Benchmark.TCritical(1000) == 1.96
+
+
+def test_stats_trims_fraction():
+    bench = Benchmark({"trim": 0.1})
+    samples = [1.0] * 8 + [0.0, 100.0]
+    stats = bench.Stats(samples)
+    assert stats["n"] == 8
+    assert stats["mean"] == 1.0
+    assert stats["stdev"] == 0.0
+    assert stats["ci_low"] == stats["ci_high"] == 1.0
+
+
+def test_stats_iqr():
+    bench = Benchmark({"trim": "iqr"})
+    samples = [1.0, 1.1, 1.2, 1.3, 1.4, 1.5, 50.0]
+    stats = bench.Stats(samples)
+    assert stats["n"] == 6
+    assert stats["median"] == pytest.approx(1.25)
+
+
+def test_stats_confidence_interval():
+    bench = Benchmark({"trim": 0})
+    samples = [1.0, 2.0, 3.0, 4.0, 5.0]
+    stats = bench.Stats(samples)
+    margin = 2.776 * statistics.stdev(samples) / 5**0.5
+    assert stats["ci_low"] == pytest.approx(3.0 - margin)
+    assert stats["ci_high"] == pytest.approx(3.0 + margin)
+
+
+def stats(mean, stdev=0.01, n=20):
+    return {"mean": mean, "stdev": stdev, "n": n}
+
+
+def test_compare_significant_slowdown():
+    regressed, text = Benchmark({}).Compare(stats(1.2), stats(1.0))
+    assert regressed
+    assert "+20.0%" in text
+
+
+def test_compare_within_threshold():
+    regressed, _ = Benchmark({"threshold": 0.5}).Compare(
+        stats(1.2), stats(1.0)
+    )
+    assert not regressed
+
+
+def test_compare_noise():
+    regressed, _ = Benchmark({}).Compare(
+        stats(1.1, stdev=1.0), stats(1.0, stdev=1.0)
+    )
+    assert not regressed
+
+
+def test_compare_zero_baseline():
+    regressed, text = Benchmark({}).Compare(stats(1.0), stats(0.0, 0.0))
+    assert not regressed
+    assert "zero" in text
+
+
+@pytest.mark.parametrize("trim", ["half", 0.5, -0.1, None])
+def test_invalid_trim(trim):
+    with pytest.raises(ValueError):
+        Benchmark({"trim": trim})
+
+
+def test_invalid_benchmark_fails_loading():
+    definition = {
+        "id": "b",
+        "name": "b",
+        "test_statements": [{"sql": "select 1", "benchmark": {"trim": "x"}}],
+    }
+    with pytest.raises(ValueError, match="statement 1 benchmark"):
+        SingleTest.Normalise(definition)
+
+
+@pytest.mark.parametrize(
+    "method, safe", [(None, True), ("head", True), ("POST", False)]
+)
+def test_only_reading_requests_are_benchmarked(method, safe):
+    statement = {"curl": "http://h/a", "benchmark": {}}
+    if method:
+        statement["method"] = method
+    atest = SingleTest.__new__(SingleTest)
+    assert atest._benchmark_safe(statement) is safe
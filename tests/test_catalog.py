@@ -0,0 +1,60 @@
+import os
+
+import fdbtest
+
+TEST = """
+id: "001"
+name: "first"
+tags: [Smoke]
+generate:
+  - table: t
+    rows: 10
+    columns: {a: 1}
+test_statements:
+  - sql: "select a from t join orders o on o.id = t.id"
+"""
+
+
+def write(tmp_path, text=TEST):
+    filename = tmp_path / "t1.yml"
+    filename.write_text(text, encoding="utf-8")
+    return str(filename)
+
+
+def test_entry(tmp_path):
+    catalog = fdbtest.TestCatalog(str(tmp_path / "cache"))
+    entry = catalog.Entry(write(tmp_path))
+    assert entry["id"] == "001"
+    assert entry["tags"] == ["smoke"]
+    assert entry["objects"] == ["ORDERS", "T"]
+
+
+def test_cached_definition(tmp_path):
+    filename = write(tmp_path)
+    catalog = fdbtest.TestCatalog(str(tmp_path / "cache"))
+    catalog.Entry(filename)
+    catalog.Save()
+    catalog = fdbtest.TestCatalog(str(tmp_path / "cache"))
+    catalog.Entry(filename)
+    assert catalog.definitions == {}
+    definition = catalog.Definition(filename)
+    assert definition["generate"][0]["columns"]["a"] == {"value": 1}
+
+
+def test_other_format_is_parsed_again(tmp_path, monkeypatch):
+    filename = write(tmp_path)
+    catalog = fdbtest.TestCatalog(str(tmp_path / "cache"))
+    catalog.Entry(filename)
+    catalog.Save()
+    monkeypatch.setattr(fdbtest.TestCatalog, "FORMAT", "old")
+    catalog = fdbtest.TestCatalog(str(tmp_path / "cache"))
+    catalog.Entry(filename)
+    assert os.path.abspath(filename) in catalog.definitions
+    assert catalog.index[os.path.abspath(filename)]["format"] == "old"
+
+
+def test_without_cache(tmp_path):
+    catalog = fdbtest.TestCatalog("")
+    filename = write(tmp_path)
+    assert catalog.Entry(filename)["name"] == "first"
+    assert fdbtest.SingleTest(filename, catalog.Definition(filename)).id == "001"
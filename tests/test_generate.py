@@ -0,0 +1,99 @@
+import fdbtest
+from fdbtest import DataGenerator
+
+
+class Connection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = False
+
+    def ExecuteMany(self, statement, rows):
+        self.rows.extend(rows)
+        return {}
+
+    def Values(self, statement):
+        return [3, 1, 2]
+
+    def Close(self):
+        self.closed = True
+
+
+def config(**values):
+    result = {
+        "table": "t",
+        "rows": 25,
+        "batch": 10,
+        "columns": {
+            "id": {"sequence": 1},
+            "qty": {"random": [1, 5]},
+            "kind": {"choice": ["a", "b"]},
+            "ref": {"references": "r.id"},
+        },
+    }
+    result.update(values)
+    return result
+
+
+def test_rows_do_not_depend_on_partitions(options, monkeypatch):
+    options()
+    serial = []
+    passed, _ = DataGenerator(config()).Run(Connection(serial))
+    assert passed
+    parallel = []
+    monkeypatch.setattr(
+        fdbtest, "connect_database", lambda opt, log: Connection(parallel)
+    )
+    passed, _ = DataGenerator(config(partitions=3)).Run(Connection([]))
+    assert passed
+    assert sorted(parallel) == sorted(serial)
+    assert [row[0] for row in serial] == list(range(1, 26))
+    assert {row[3] for row in serial} <= {1, 2, 3}
+
+
+def test_generator_error(options):
+    options()
+    columns = {"id": {"random": "1..2"}}
+    passed, debug_str = DataGenerator(config(columns=columns)).Run(
+        Connection([])
+    )
+    assert not passed
+    assert "batch 1" in debug_str
+
+
+def test_generator_error_in_partition(options, monkeypatch):
+    options()
+    conns = []
+
+    def connect(opt, log):
+        conns.append(Connection([]))
+        return conns[-1]
+
+    monkeypatch.setattr(fdbtest, "connect_database", connect)
+    columns = {"id": {"unknown": 1}}
+    passed, debug_str = DataGenerator(
+        config(columns=columns, partitions=2)
+    ).Run(Connection([]))
+    assert not passed
+    assert "unknown generator" in debug_str
+    assert all(conn.closed for conn in conns)
+
+
+def test_partitions_are_registered(options, monkeypatch):
+    options()
+    background = []
+    seen = []
+
+    class Partition(Connection):
+        def ExecuteMany(self, statement, rows):
+            seen.append(self in background)
+            return super().ExecuteMany(statement, rows)
+
+    monkeypatch.setattr(
+        fdbtest, "connect_database", lambda opt, log: Partition([])
+    )
+    passed, _ = DataGenerator(config(partitions=2)).Run(
+        Connection([]), background
+    )
+    assert passed
+    assert seen and all(seen)
+    assert background == []
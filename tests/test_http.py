@@ -0,0 +1,228 @@
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+import requests
+import yaml
+
+import fdbtest
+from fdbtest import HttpCassette
+
+
+class Response:
+    """
+    What HttpCassette.Record reads from requests.Response
+    """
+
+    status_code = 404
+    reason = "Not Found"
+    headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    text = '{"error": "missing"}'
+
+    class elapsed:
+        def total_seconds():
+            return 0.25
+
+
+def test_key():
+    key = HttpCassette.Key("GET", "http://h/a", {"x": 1})
+    assert key == HttpCassette.Key("GET", "http://h/a", {"y": 2})
+    assert key != HttpCassette.Key("GET", "http://h/b", {})
+    assert HttpCassette.Key("POST", "http://h/a", {"x": 1, "y": 2}) == (
+        HttpCassette.Key("POST", "http://h/a", {"y": 2, "x": 1})
+    )
+    assert HttpCassette.Key("POST", "http://h/a", {"x": 1}) != (
+        HttpCassette.Key("POST", "http://h/a", {"x": 2})
+    )
+
+
+@pytest.mark.parametrize(
+    "spec, latency",
+    [
+        (None, None),
+        ("recorded", "recorded"),
+        ("0.5", (0.5, 0.0)),
+        ("0.05+-0.02", (0.05, 0.02)),
+    ],
+)
+def test_latency(spec, latency):
+    assert HttpCassette.Latency(spec) == latency
+
+
+@pytest.mark.parametrize("spec", ["fast", "-1", "0.1+-x"])
+def test_invalid_latency(spec):
+    with pytest.raises(ValueError):
+        HttpCassette.Latency(spec)
+
+
+def test_record_and_replay(tmp_path):
+    recorder = HttpCassette(str(tmp_path), False)
+    recorder.Record("POST", "http://h/a", {"x": 1}, Response)
+    recorder.Save()
+    with open(tmp_path / "index.json", encoding="utf-8") as f:
+        index = json.load(f)
+    assert list(index.values()) == [
+        {"method": "POST", "url": "http://h/a", "status": 404}
+    ]
+
+    player = HttpCassette(str(tmp_path), True, "recorded")
+    response = player.Replay("POST", "http://h/a", {"x": 1})
+    assert response.status_code == 404
+    assert response.json() == {"error": "missing"}
+    assert response.headers["content-type"] == "application/json"
+    assert "Content-Encoding" not in response.headers
+    assert response.elapsed.total_seconds() == 0.25
+    with pytest.raises(requests.HTTPError):
+        response.raise_for_status()
+
+
+def test_replay_missing(tmp_path):
+    player = HttpCassette(str(tmp_path), True)
+    with pytest.raises(requests.RequestException):
+        player.Replay("GET", "http://h/a", {})
+
+
+def test_record_leaves_no_temporary_files(tmp_path):
+    HttpCassette(str(tmp_path), False).Record("GET", "http://h/a", {}, Response)
+    assert [name for name in os.listdir(tmp_path)] == [
+        HttpCassette.Key("GET", "http://h/a", {}) + ".json"
+    ]
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers every request with its path after a delay and remembers client
+    addresses of the connections used
+    """
+
+    protocol_version = "HTTP/1.1"
+    delay = 0.3
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        self.server.connections.add(self.client_address)
+        body = json.dumps({"ok": 1, "path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.connections = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def stub_test(tmp_path, statements):
+    filename = tmp_path / "http.yml"
+    filename.write_text(
+        yaml.dump(
+            {"id": "http", "name": "http", "test_statements": statements}
+        ),
+        encoding="utf-8",
+    )
+    atest = fdbtest.SingleTest(str(filename))
+    atest.results = fdbtest.ResultWriter(atest.id)
+    atest.failures = []
+    atest.statements = []
+    atest.timings = fdbtest.Metrics()
+    atest.timed_out = False
+    return atest
+
+
+def test_session_per_host():
+    fdbtest.HttpPool.sessions.clear()
+    session = fdbtest.HttpPool.Session("http://127.0.0.1:1/a")
+    assert fdbtest.HttpPool.Session("http://127.0.0.1:1/b?x=1") is session
+    assert fdbtest.HttpPool.Session("http://127.0.0.1:2/a") is not session
+
+
+def test_parallel_group(options, tmp_path, monkeypatch, stub_server):
+    options()
+    monkeypatch.setattr(fdbtest, "fb", None)
+    monkeypatch.setattr(fdbtest, "pool", fdbtest.AttachmentPool({}))
+    fdbtest.HttpPool.sessions.clear()
+    url = stub_server.url
+    atest = stub_test(
+        tmp_path,
+        [
+            {
+                "curl": f"{url}/{name}",
+                "parallel": "g",
+                "expect_values": {"path": f"/{name}"},
+            }
+            for name in ("a", "b", "c")
+        ]
+        + [{"curl": f"{url}/d", "expect_values": {"ok": "1"}}],
+    )
+    timestart = time.perf_counter()
+    assert atest.RunTest()
+    # three statements of the group run at once, the last one after them
+    assert time.perf_counter() - timestart < 3 * StubHandler.delay
+    assert [stmt["passed"] for stmt in atest.statements] == [True] * 4
+
+
+def test_keep_alive(options, tmp_path, monkeypatch, stub_server):
+    options()
+    monkeypatch.setattr(fdbtest, "fb", None)
+    monkeypatch.setattr(fdbtest, "pool", fdbtest.AttachmentPool({}))
+    monkeypatch.setattr(StubHandler, "delay", 0)
+    fdbtest.HttpPool.sessions.clear()
+    url = stub_server.url
+    atest = stub_test(
+        tmp_path,
+        [{"curl": f"{url}/{n}"} for n in range(5)],
+    )
+    assert atest.RunTest()
+    assert len(stub_server.connections) == 1
+    timings = [record["http"] for record in atest.results.records]
+    assert all(set(item) == {"connect", "ttfb", "total"} for item in timings)
+    # only the first request opens the connection
+    assert timings[0]["connect"] > 0
+    assert all(item["connect"] == 0 for item in timings[1:])
+
+
+def test_replay_broken(tmp_path):
+    key = HttpCassette.Key("GET", "http://h/a", {})
+    (tmp_path / f"{key}.json").write_text("{", encoding="utf-8")
+    player = HttpCassette(str(tmp_path), True)
+    with pytest.raises(requests.RequestException, match="Broken"):
+        player.Replay("GET", "http://h/a", {})
+
+
+def test_record_error_is_statement_error(
+    options, tmp_path, monkeypatch, stub_server
+):
+    options()
+    monkeypatch.setattr(fdbtest, "fb", None)
+    monkeypatch.setattr(fdbtest, "pool", fdbtest.AttachmentPool({}))
+    monkeypatch.setattr(StubHandler, "delay", 0)
+    directory = tmp_path / "cassette"
+    monkeypatch.setattr(
+        fdbtest, "cassette", HttpCassette(str(directory), False)
+    )
+    # the cassette dir disappears, so the response can not be stored
+    directory.rmdir()
+    fdbtest.HttpPool.sessions.clear()
+    url = stub_server.url
+    atest = stub_test(
+        tmp_path,
+        [{"curl": f"{url}/a", "expect_values": {"ok": "1"}}, {"curl": url}],
+    )
+    assert not atest.RunTest()
+    assert len(atest.statements) == 1
+    assert atest.statements[0]["error"].startswith("HTTP cassette: ")
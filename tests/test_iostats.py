@@ -0,0 +1,50 @@
+from fdbtest import Firebird, SingleTest
+
+
+def snapshot(reads, tables):
+    return {
+        "reads": reads,
+        "writes": 0,
+        "fetches": 0,
+        "marks": 0,
+        "seq_reads": 0,
+        "idx_reads": 0,
+        "memory": 0,
+        "max_memory": 0,
+        "tables": tables,
+    }
+
+
+def check(statement, tables):
+    atest = SingleTest.__new__(SingleTest)
+    atest.matchers = [SingleTest.CompileExpectations(statement)]
+    return atest._check_io_stats(statement, snapshot(0, tables), "", 0)
+
+
+def test_table_delta():
+    conn = Firebird.__new__(Firebird)
+    delta = conn._io_diff(
+        snapshot(1, {"T": (1, 1), "U": (5, 0)}),
+        snapshot(4, {"T": (3, 1), "U": (5, 0), "V": (0, 2)}),
+        {"reads": 1},
+    )
+    assert delta["reads"] == 2
+    assert delta["tables"] == {"T": (2, 0), "V": (0, 2)}
+
+
+def test_natural_reads():
+    statement = {"sql": "select 1", "expect_no_natural_reads_on": ["t"]}
+    assert check(statement, {"U": (10, 0), "T": (0, 3)})[0]
+    passed, debug_str = check(statement, {"T": (7, 0)})
+    assert not passed
+    assert "Table T read naturally 7 records" in debug_str
+
+
+def test_natural_reads_without_table_stats():
+    conn = Firebird.__new__(Firebird)
+    delta = conn._io_diff(snapshot(0, None), snapshot(0, None), {})
+    assert delta["tables"] is None
+    statement = {"sql": "select 1", "expect_no_natural_reads_on": ["t"]}
+    passed, debug_str = check(statement, None)
+    assert not passed
+    assert "unsupported on this server version" in debug_str
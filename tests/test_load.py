@@ -0,0 +1,89 @@
+import fdbtest
+from fdbtest import LoadTest, SingleTest
+
+
+class Connection:
+    def __init__(self, name, executed):
+        self.name = name
+        self.executed = executed
+
+    def Execute(self, statement, params=None, savepoint=None, stream=None):
+        self.executed.append((self.name, statement))
+        return {}
+
+    def Begin(self):
+        self.executed.append((self.name, "begin"))
+
+    def Rollback(self):
+        self.executed.append((self.name, "rollback"))
+
+
+class Pool:
+    def __init__(self):
+        self.executed = []
+        self.acquired = []
+        self.released = []
+
+    def Acquire(self, name=None, isolation=None, lock_timeout=None):
+        self.acquired.append((name, isolation))
+        return Connection(name, self.executed)
+
+    def Release(self, conn):
+        self.released.append(conn.name)
+
+
+def load_test(**attributes):
+    atest = SingleTest.__new__(SingleTest)
+    atest.id = "l"
+    atest.timed_out = False
+    atest.background = []
+    atest.__dict__.update(attributes)
+    atest.results = fdbtest.ResultWriter(atest.id)
+    return atest
+
+
+def test_sessions_use_profiles(options, monkeypatch):
+    options()
+    pool = Pool()
+    monkeypatch.setattr(fdbtest, "pool", pool)
+    atest = load_test(
+        profile="reporting",
+        sessions={"s": {"profile": "branch", "isolation": "snapshot"}},
+        test_statements=[
+            {"sql": "select 1 from rdb$database"},
+            {"sql": "commit"},
+            {"sql": "select 2 from rdb$database", "profile": "other"},
+            {"sql": "select 3 from rdb$database", "session": "s"},
+        ],
+    )
+    assert LoadTest(atest, {"sessions": 2, "iterations": 3}).Run()
+    assert sorted(pool.acquired) == sorted(
+        [("reporting", None), ("other", None), ("branch", "snapshot")] * 2
+    )
+    assert sorted(pool.released) == sorted(
+        ["reporting", "other", "branch"] * 2
+    )
+    assert atest.background == []
+    # commit is skipped, every statement runs on its own attachment
+    assert sorted(set(pool.executed)) == [
+        ("branch", "select 3 from rdb$database"),
+        ("other", "select 2 from rdb$database"),
+        ("reporting", "select 1 from rdb$database"),
+    ]
+    assert len(pool.executed) == 3 * 2 * 3
+
+
+def test_rollback_transaction_per_round(options, monkeypatch):
+    options()
+    pool = Pool()
+    monkeypatch.setattr(fdbtest, "pool", pool)
+    atest = load_test(
+        transaction="rollback",
+        test_statements=[{"sql": "insert into t values (1)"}],
+    )
+    assert LoadTest(atest, {"sessions": 1, "iterations": 2}).Run()
+    assert pool.executed == [
+        (None, "begin"),
+        (None, "insert into t values (1)"),
+        (None, "rollback"),
+    ] * 2
@@ -0,0 +1,62 @@
+import decimal
+import pickle
+
+import pytest
+
+from fdbtest import Matcher
+
+
+@pytest.mark.parametrize(
+    "expected, value, result",
+    [
+        (5, 5, True),
+        (5, "5.0", True),
+        (5, 6, False),
+        ("abc", "abc", True),
+        ("abc", "abd", False),
+        (None, None, True),
+        (None, 0, False),
+        ([1, "x"], "x", True),
+        ([1, "x"], 2, False),
+        (">10", 11, True),
+        (">10", 10, False),
+        (">=10", 10, True),
+        ("<0.5", 0.4, True),
+        ("<=0.5", 0.6, False),
+        ("10..20", 15, True),
+        ("10..20", 20, True),
+        ("10..20", 21, False),
+        ("100 +- 0.5", 100.4, True),
+        ("100 +- 0.5", 100.6, False),
+        ("100 +- 1%", 99, True),
+        ("100 +- 1%", 98.9, False),
+        ("re:^ab+c$", "abbbc", True),
+        ("re:^ab+c$", "ac", False),
+        ("decimal:12.50", decimal.Decimal("12.5"), True),
+        ("decimal:12.50", 12.51, False),
+    ],
+)
+def test_match(expected, value, result):
+    assert Matcher(expected).Match(value) is result
+
+
+def test_numeric_forms_compare_text_values_as_strings():
+    assert Matcher(">10").Match(">10")
+    assert not Matcher(">10").Match("many")
+
+
+def test_bool_is_not_a_number():
+    assert not Matcher(1).Match(True)
+
+
+def test_pickle_recompiles():
+    matcher = pickle.loads(pickle.dumps(Matcher("10..20")))
+    assert matcher.Match(12)
+    assert not matcher.Match(30)
+    assert repr(matcher) == "'10..20'"
+
+
+@pytest.mark.parametrize("expected", ["re:(ab", "decimal:12,50"])
+def test_bad_expectation(expected):
+    with pytest.raises(ValueError, match="bad expectation"):
+        Matcher(expected)
@@ -0,0 +1,79 @@
+import json
+import re
+
+import pytest
+
+from fdbtest import Metrics
+
+SAMPLE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+
+
+def parse(text):
+    """
+    Returns samples of the exposition as (name, labels, value)
+    """
+    samples = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels))
+        samples.append((name, labels, float(value)))
+    return samples
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    metrics = Metrics(str(tmp_path))
+    for seconds in (0.0005, 0.003, 0.003, 0.2, 7.0, 1000.0):
+        metrics.Observe("t1", 1, "sql", seconds)
+    metrics.Observe('t"2', "data.sql", "file", 0.02)
+    return metrics
+
+
+def test_openmetrics(metrics, tmp_path):
+    other = Metrics()
+    other.Merge(metrics.Export())
+    other.directory = str(tmp_path)
+    other.Write()
+    text = (tmp_path / "fdbtest.prom").read_text(encoding="utf-8")
+    lines = text.splitlines()
+    assert lines[0] == f"# TYPE {Metrics.NAME} histogram"
+    assert lines[-1] == "# EOF"
+    samples = parse(text)
+    series = {}
+    for name, labels, value in samples:
+        key = (labels["test"], labels["statement"], labels["kind"])
+        series.setdefault(key, []).append((name, labels.get("le"), value))
+    assert set(series) == {("t1", "1", "sql"), ('t\\"2', "data.sql", "file")}
+    for items in series.values():
+        buckets = [item for item in items if item[0].endswith("_bucket")]
+        counts = [value for _, _, value in buckets]
+        # cumulative buckets never decrease, +Inf one holds all samples
+        assert counts == sorted(counts)
+        assert len(buckets) == len(Metrics.BUCKETS)
+        assert buckets[-1][1] == "+Inf"
+        count = [value for name, _, value in items if name.endswith("_count")]
+        assert counts[-1] == count[0]
+    t1 = dict(
+        (le or name, value) for name, le, value in series[("t1", "1", "sql")]
+    )
+    assert t1["0.001"] == 1
+    assert t1["0.005"] == 3
+    assert t1["300.0"] == 5
+    assert t1["+Inf"] == 6
+    assert t1[f"{Metrics.NAME}_sum"] == pytest.approx(1007.2065)
+
+
+def test_json_summary(metrics, tmp_path):
+    metrics.Write()
+    with open(tmp_path / "fdbtest.json", encoding="utf-8") as f:
+        summary = {item["test"]: item for item in json.load(f)}
+    t1 = summary["t1"]
+    assert t1["count"] == 6
+    assert t1["min"] == 0.0005
+    assert t1["max"] == 1000.0
+    assert t1["p50"] == 0.005
+    assert t1["p99"] == 1000.0
+    assert summary['t"2']["kind"] == "file"
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,35 @@
+import pytest
+
+from fdbtest import SingleTest
+
+
+def plan_test(patterns):
+    atest = SingleTest.__new__(SingleTest)
+    atest.id = "p"
+    statement = {"sql": "select 1", "forbid_plan_pattern": patterns}
+    atest.matchers = [SingleTest.CompileExpectations(statement)]
+    return atest, statement
+
+
+def test_forbidden_pattern(options, tmp_path):
+    options()
+    atest, statement = plan_test(["natural", "INDEX \\(T_X\\)"])
+    passed, debug_str = atest._check_plan(
+        statement, "PLAN (T NATURAL)", 0, ""
+    )
+    assert not passed
+    assert "forbidden pattern natural" in debug_str
+    assert (tmp_path / "results" / "plans" / "p.1.plan").exists()
+    passed, _ = atest._check_plan(statement, "PLAN (T INDEX (T_Y))", 0, "")
+    assert passed
+
+
+def test_bad_pattern_fails_loading(tmp_path):
+    filename = tmp_path / "t.yml"
+    filename.write_text(
+        "id: p\nname: p\ntest_statements:\n"
+        "  - sql: select 1\n    forbid_plan_pattern: 'INDEX ('\n",
+        encoding="utf-8",
+    )
+    with pytest.raises(ValueError, match="bad forbid_plan_pattern"):
+        SingleTest(str(filename))
@@ -0,0 +1,84 @@
+import pytest
+
+import fdbtest
+from fdbtest import AttachmentPool
+
+
+class Connection:
+    def __init__(self, profile):
+        self.profile = profile
+        self.broken = False
+        self.closed = False
+
+    def Execute(self, statement, params=None, cache=True):
+        if self.broken:
+            return ("connection lost", statement)
+        return {"ALIVE": [1]}
+
+    def Close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(options, monkeypatch):
+    options()
+    opened = []
+
+    def connect(opt, log, tpb=None, profile=None):
+        opened.append(Connection(profile))
+        return opened[-1]
+
+    monkeypatch.setattr(fdbtest, "connect_database", connect)
+    return opened
+
+
+def test_released_attachment_is_reused(connections):
+    pool = AttachmentPool({"reporting": {"user": "REPORTER"}})
+    conn = pool.Acquire()
+    pool.Release(conn)
+    assert pool.Acquire() is conn
+    assert len(connections) == 1
+    assert pool.reused == {None: 1}
+
+
+def test_profiles_have_own_attachments(connections):
+    pool = AttachmentPool({"reporting": {"user": "REPORTER"}})
+    default = pool.Acquire()
+    pool.Release(default)
+    reporting = pool.Acquire("reporting")
+    assert reporting is not default
+    assert reporting.profile == {"user": "REPORTER"}
+    pool.Release(reporting)
+    isolated = pool.Acquire("reporting", isolation="snapshot")
+    assert isolated not in (default, reporting)
+    assert len(connections) == 3
+
+
+def test_unknown_profile(connections):
+    with pytest.raises(ValueError, match="unknown connection profile"):
+        AttachmentPool().Acquire("reporting")
+
+
+def test_broken_attachment_is_dropped(connections):
+    pool = AttachmentPool()
+    conn = pool.Acquire()
+    pool.Release(conn)
+    conn.broken = True
+    fresh = pool.Acquire()
+    assert fresh is not conn
+    assert conn.closed
+    assert pool.reused == {}
+
+
+def test_drain_and_close(connections):
+    pool = AttachmentPool()
+    first, second = pool.Acquire(), pool.Acquire()
+    pool.Release(first)
+    pool.Drain()
+    assert first.closed and not second.closed
+    assert pool.Acquire() not in (first, second)
+    pool.Release(second)
+    pool.Close()
+    assert second.closed
+    assert pool.idle == {}
+    assert len(pool.attached[None]) == 3
@@ -0,0 +1,32 @@
+import threading
+import time
+
+import fdbtest
+from fdbtest import Profiler, phase
+
+
+def test_other_threads_are_not_measured(options, monkeypatch):
+    args = options("--timing_profile")
+    assert args.timing_profile == "phases"
+    profiler = Profiler(args.timing_profile)
+    monkeypatch.setattr(fdbtest, "profiler", profiler)
+    profiler.Start()
+    with phase("execute"):
+        pass
+
+    def watchdog():
+        with phase("execute"):
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=watchdog)
+    thread.start()
+    thread.join()
+    phases = profiler.Stop(10.0)
+    assert set(phases) == set(Profiler.PHASES) | {"harness"}
+    assert 0.0 < phases["execute"] < 0.05
+    assert abs(sum(phases.values()) - 10.0) < 1e-9
+
+
+def test_phases_are_off_without_profiler(monkeypatch):
+    monkeypatch.setattr(fdbtest, "profiler", None)
+    assert phase("execute") is fdbtest.NO_PHASE
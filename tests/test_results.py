@@ -0,0 +1,100 @@
+import json
+import threading
+import types
+import xml.etree.ElementTree as ET
+
+import fdbtest
+from fdbtest import ResultWriter, skipped_test, write_junit
+
+
+def summary(id, passed=True, duration=0.5, failures=()):
+    return {
+        "file": f"/tests/{id}.yml",
+        "id": id,
+        "name": f"test {id}",
+        "passed": passed,
+        "duration": duration,
+        "failures": list(failures),
+    }
+
+
+def test_junit(options, tmp_path):
+    options()
+    skipped = skipped_test(
+        types.SimpleNamespace(filename="/tests/t3.yml", id="t3"),
+        "time budget",
+    )
+    results = [
+        summary("t1", duration=1.25),
+        summary("t2", False, 0.5, ["statement 2 failed", "file x failed"]),
+        skipped,
+    ]
+    write_junit(fdbtest.opt, results)
+    suite = ET.parse(tmp_path / "results" / "junit.xml").getroot()
+    assert suite.tag == "testsuite"
+    assert suite.get("tests") == "3"
+    assert suite.get("failures") == "1"
+    assert suite.get("skipped") == "1"
+    assert suite.get("time") == "1.750"
+    cases = suite.findall("testcase")
+    assert [case.get("classname") for case in cases] == ["t1", "t2", "t3"]
+    assert cases[0].get("name") == "t1 test t1"
+    assert cases[0].get("time") == "1.250"
+    assert list(cases[0]) == []
+    failure = cases[1].find("failure")
+    assert failure.get("message") == "statement 2 failed"
+    assert failure.text == "statement 2 failed\nfile x failed"
+    assert cases[2].find("skipped").get("message") == "time budget"
+    assert cases[2].get("name") == "t3"
+
+
+def test_result_writer(options, tmp_path):
+    options()
+    writer = ResultWriter("t1")
+
+    def report(thread):
+        for i in range(50):
+            writer.Write(f"thread {thread} line {i}")
+            writer.Record({"thread": thread, "statement": i})
+
+    threads = [threading.Thread(target=report, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # nothing is written until the test is finished
+    assert not (tmp_path / "results" / "t1.jsonl").exists()
+    writer.Close()
+    with open(tmp_path / "results" / "t1.jsonl", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 200
+    assert sorted(
+        (record["thread"], record["statement"]) for record in records
+    ) == [(n, i) for n in range(4) for i in range(50)]
+    text = (tmp_path / "results" / "t1.log").read_text(encoding="utf-8")
+    assert text.count("=" * 80 + "\n") == 200
+
+
+def test_result_writer_flushes_big_buffers(options, tmp_path, monkeypatch):
+    options()
+    monkeypatch.setattr(ResultWriter, "BUFFER_LIMIT", 100)
+    writer = ResultWriter("t2")
+    writer.Write("x" * 60)
+    assert not (tmp_path / "results" / "t2.log").exists()
+    writer.Write("y" * 60)
+    assert (tmp_path / "results" / "t2.log").exists()
+    writer.Record({"value": 1})
+    writer.Close()
+    lines = (tmp_path / "results" / "t2.jsonl").read_text().splitlines()
+    assert lines == ['{"value": 1}']
+
+
+def test_without_results_dir(options, tmp_path):
+    args = options()
+    args.results_dir = ""
+    writer = ResultWriter("t3")
+    writer.Write("text")
+    writer.Record({"value": 1})
+    writer.Close()
+    write_junit(fdbtest.opt, [summary("t3")])
+    assert not list(tmp_path.glob("**/t3.*"))
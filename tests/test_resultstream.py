@@ -0,0 +1,73 @@
+import hashlib
+
+from fdbtest import Matcher, ResultStream
+
+
+class Cursor:
+    def __init__(self, rows, columns=("ID", "NAME")):
+        self.rows = list(rows)
+        self.description = [(name,) for name in columns]
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+ROWS = [(1, "a"), (2, None), (3, "")]
+
+
+def test_count_and_hash():
+    stream = ResultStream({"expect_rowcount": 3}, batch=2)
+    first = stream.Consume(Cursor(ROWS))
+    assert first == {"ID": 1, "NAME": "a"}
+    assert stream.rows == 3
+    expected = hashlib.sha256(b"1\ta\n2\t\\N\n3\t\n").hexdigest()
+    assert stream.Record()["sha256"] == expected
+
+
+def test_null_differs_from_empty_string():
+    with_null = ResultStream({})
+    with_null.Consume(Cursor([(1, None)]))
+    empty = ResultStream({})
+    empty.Consume(Cursor([(1, "")]))
+    assert with_null.hash.hexdigest() != empty.hash.hexdigest()
+
+
+def test_golden_file(tmp_path):
+    golden = tmp_path / "golden.csv"
+    golden.write_text("1,a\n2,\\N\n3,\n", encoding="utf-8")
+    stream = ResultStream({"expect_result_file": str(golden)}, batch=2)
+    stream.Consume(Cursor(ROWS))
+    assert stream.mismatch is None
+    assert stream.error is None
+
+
+def test_golden_file_mismatch(tmp_path):
+    golden = tmp_path / "golden.csv"
+    golden.write_text("1,a\n2,\n3,\n", encoding="utf-8")
+    stream = ResultStream({"expect_result_file": str(golden)})
+    stream.Consume(Cursor(ROWS))
+    assert stream.mismatch == (2, ["2", ""], ["2", "\\N"])
+
+
+def test_golden_file_extra_rows(tmp_path):
+    golden = tmp_path / "golden.csv"
+    golden.write_text("1,a\n2,\\N\n3,\n4,d\n", encoding="utf-8")
+    stream = ResultStream({"expect_result_file": str(golden)})
+    stream.Consume(Cursor(ROWS))
+    assert stream.mismatch == (4, ["4", "d"], None)
+
+
+def test_expect_all():
+    stream = ResultStream(
+        {"expect_all": {"ID": "<3"}}, batch=2, matchers={"ID": Matcher("<3")}
+    )
+    stream.Consume(Cursor(ROWS))
+    number, name, value, matcher = stream.wrong_value
+    assert (number, name, value) == (3, "ID", 3)
+
+
+def test_expect_all_unknown_column():
+    stream = ResultStream({}, matchers={"QTY": Matcher(">0")})
+    stream.Consume(Cursor(ROWS))
+    assert stream.error == "Column QTY is not in the result"
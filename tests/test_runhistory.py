@@ -0,0 +1,94 @@
+import itertools
+import types
+
+import fdbtest
+from fdbtest import RunHistory, print_movers
+
+META = {
+    "started": 0.0,
+    "tests_rev": "abc",
+    "server_version": "WI-V3.0.10",
+    "database_hash": None,
+    "command": "{}",
+}
+
+
+def result(filename, duration, passed=True, statements=()):
+    return {
+        "id": "t1",
+        "file": str(filename),
+        "passed": passed,
+        "duration": duration,
+        "statements": [
+            {
+                "statement": i + 1,
+                "kind": "sql",
+                "passed": True,
+                "duration": value,
+            }
+            for i, value in enumerate(statements)
+        ],
+    }
+
+
+def store(tmp_path, runs, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr(fdbtest.time, "time", lambda: float(next(clock)))
+    filename = tmp_path / "t1.yml"
+    filename.write_text("id: t1\n", encoding="utf-8")
+    history = RunHistory(str(tmp_path / "history.db"))
+    regressions = [
+        history.Store(META, [result(filename, *run)]) for run in runs
+    ]
+    return history, regressions
+
+
+def test_regression_flag(tmp_path, monkeypatch):
+    runs = [(1.0, True, [0.010, 0.1])] * 3 + [(1.0, True, [0.020, 0.1])]
+    history, regressions = store(tmp_path, runs, monkeypatch)
+    # not enough runs to judge before the fourth one
+    assert regressions[:3] == [[], [], []]
+    assert regressions[3] == [("t1", "1", 0.020, 0.010)]
+    flags = history.db.execute(
+        "select statement, regression from statements where run_id = 4"
+    ).fetchall()
+    assert flags == [("1", 1), ("2", 0)]
+    history.Close()
+
+
+def test_short_statements_are_not_judged():
+    assert not RunHistory.IsRegression(0.0009, 0.0002, 5, 1.5)
+    assert RunHistory.IsRegression(0.004, 0.002, 5, 1.5)
+    assert not RunHistory.IsRegression(0.004, 0.002, 2, 1.5)
+
+
+def test_scheduler_reads_run_history(options, tmp_path, monkeypatch):
+    args = options()
+    runs = [(1.0,), (2.0,), (3.0,), (6.0, False)]
+    history, _ = store(tmp_path, runs, monkeypatch)
+    history.Close()
+    args.history_db = str(tmp_path / "history.db")
+    tests = fdbtest.TestHistory(args)
+    atest = types.SimpleNamespace(filename=str(tmp_path / "t1.yml"))
+    # average of the last three runs
+    assert tests.Expected(atest) == (2.0 + 3.0 + 6.0) / 3
+    # failed last time
+    assert tests.Priority(atest)[0] == 0
+    new = types.SimpleNamespace(filename=str(tmp_path / "new.yml"))
+    assert tests.Priority(new) == (1, 0)
+
+
+def test_print_movers(tmp_path, monkeypatch, capsys):
+    runs = [(1.0, True, [0.010, 0.100])] * 3 + [(1.0, True, [0.030, 0.090])]
+    history, _ = store(tmp_path, runs, monkeypatch)
+    cmdargs = types.SimpleNamespace(window=10, id=None, top=5, ratio=1.5)
+    print_movers(history, cmdargs)
+    history.Close()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "Last runs:"
+    assert len([line for line in lines if "1 tests, 0 failed" in line]) == 4
+    movers = lines[lines.index("Slowest movers of the last run:") + 1 :]
+    assert movers == [
+        "t1 statement 1: 0.0300s, median of 3 runs 0.0100s, x3.00 REGRESSION",
+        "t1 statement 2: 0.0900s, median of 3 runs 0.1000s, x0.90",
+    ]
@@ -0,0 +1,138 @@
+import types
+
+import fdbtest
+from fdbtest import split_tests
+
+
+def atest(**attributes):
+    return types.SimpleNamespace(**attributes)
+
+
+def positions(groups):
+    return [[pos for pos, _ in group] for group in groups]
+
+
+def test_independent_tests(options):
+    options()
+    groups, exclusive = split_tests([atest(), atest(), atest()])
+    assert positions(groups) == [[0], [1], [2]]
+    assert exclusive == []
+
+
+def test_resource_groups_and_exclusive(options):
+    options()
+    tests = [
+        atest(resource_group="a"),
+        atest(exclusive=True),
+        atest(resource_group="b"),
+        atest(resource_group="a"),
+        atest(),
+    ]
+    groups, exclusive = split_tests(tests)
+    assert positions(groups) == [[0, 3], [2], [4]]
+    assert [pos for pos, _ in exclusive] == [1]
+
+
+def test_shared_data_files_with_ledger(options):
+    options("--fixture_ledger")
+    tests = [
+        atest(data_files=["a.sql"]),
+        atest(data_files=["b.sql"]),
+        atest(data_files=["b.sql", "c.sql"]),
+        atest(data_files=["c.sql"], resource_group="x"),
+        atest(resource_group="x"),
+    ]
+    groups, _ = split_tests(tests)
+    assert positions(groups) == [[0], [1, 2, 3, 4]]
+
+
+def test_shared_data_files_without_ledger(options):
+    options()
+    groups, _ = split_tests([atest(data_files=["a.sql"])] * 2)
+    assert positions(groups) == [[0], [1]]
+
+
+class History:
+    """
+    Expected durations and priorities of tests by their names
+    """
+
+    def __init__(self, durations, priorities):
+        self.durations = durations
+        self.priorities = priorities
+
+    def Expected(self, test):
+        return self.durations[test.filename]
+
+    def Priority(self, test):
+        return self.priorities[test.filename]
+
+
+def named(*names):
+    return [
+        atest(filename=name, id=name, name=name, exclusive=False)
+        for name in names
+    ]
+
+
+def test_time_budget(options):
+    options("--time_budget", "10")
+    tests = named("failed", "new", "old", "recent", "long")
+    history = History(
+        {"failed": 4, "new": 3, "old": 2, "recent": 2, "long": 20},
+        {
+            "failed": (0, 5),
+            "new": (1, 0),
+            "old": (2, 1),
+            "recent": (2, 9),
+            "long": (1, 3),
+        },
+    )
+    # failed, new and the oldest tests go first while they fit
+    assert fdbtest.select_tests(tests, history, fdbtest.log) == {0, 1, 2}
+
+
+def test_time_budget_of_parallel_run(options):
+    options("--time_budget", "10", "-j", "2")
+    tests = named("a", "b", "c")
+    history = History(
+        {"a": 8, "b": 8, "c": 8}, {"a": (2, 1), "b": (2, 2), "c": (2, 3)}
+    )
+    assert fdbtest.select_tests(tests, history, fdbtest.log) == {0, 1}
+
+
+def test_skipped_tests_are_reported(options, monkeypatch):
+    args = options("--max_failures", "1", "--time_budget", "10")
+    args.cache_dir = ""
+    tests = named("t1", "t2", "t3", "t4")
+    monkeypatch.setattr(fdbtest, "load_tests", lambda opt, log: tests)
+    monkeypatch.setattr(
+        fdbtest.TestHistory,
+        "Expected",
+        lambda self, test: 20 if test.id == "t3" else 1,
+    )
+    monkeypatch.setattr(
+        fdbtest.TestHistory, "Priority", lambda self, test: (2, test.id)
+    )
+
+    def run(test):
+        return {
+            "file": test.filename,
+            "id": test.id,
+            "name": test.name,
+            "passed": test.id != "t2",
+            "duration": 1.0,
+            "failures": [],
+        }
+
+    monkeypatch.setattr(fdbtest, "run_single_test", run)
+    results = fdbtest.run_tests(fdbtest.opt, fdbtest.log, final=False)
+    outcomes = [
+        (res["id"], res["passed"], res.get("skipped")) for res in results
+    ]
+    assert outcomes == [
+        ("t1", True, None),
+        ("t2", False, None),
+        ("t3", True, "time budget"),
+        ("t4", True, "too many failures"),
+    ]
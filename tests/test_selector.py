@@ -0,0 +1,47 @@
+import pytest
+
+from fdbtest import Selector
+
+
+def entry(**values):
+    result = {
+        "id": "001",
+        "name": "orders report",
+        "file": "/tests/t1.yml",
+        "tags": ["smoke", "orders"],
+        "objects": ["ORDERS", "CUSTOMERS"],
+    }
+    result.update(values)
+    return result
+
+
+@pytest.mark.parametrize(
+    "expression, result",
+    [
+        ("smoke", True),
+        ("tag:slow", False),
+        ("tag:ord*", True),
+        ("object:orders", True),
+        ("object:items", False),
+        ("id:00?", True),
+        ("name:orders*", True),
+        ("file:t1.yml", True),
+        ("file:t2*", False),
+        ("smoke and not slow", True),
+        ("slow or id:001", True),
+        ("not (smoke or slow)", False),
+        ("smoke and (slow or object:CUST*)", True),
+        ("NOT smoke", False),
+    ],
+)
+def test_select(expression, result):
+    assert Selector(expression).match(entry()) is result
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["", "smoke and", "(smoke", "smoke)", "color:red"],
+)
+def test_invalid(expression):
+    with pytest.raises(ValueError):
+        Selector(expression)
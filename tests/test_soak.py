@@ -0,0 +1,53 @@
+import fdb
+import pytest
+
+from fdbtest import Firebird, Soak
+
+
+def test_slope_per_hour():
+    points = [(0, 100), (1800, 150), (3600, 200)]
+    assert Soak.Slope(points) == pytest.approx(100)
+
+
+def test_slope_least_squares():
+    points = [(0, 0), (3600, 10), (7200, 8)]
+    assert Soak.Slope(points) == pytest.approx(4)
+
+
+def test_slope_needs_two_moments():
+    assert Soak.Slope([]) is None
+    assert Soak.Slope([(10, 1)]) is None
+    assert Soak.Slope([(10, 1), (10, 2)]) is None
+
+
+class LostTransaction:
+    def cursor(self):
+        raise fdb.DatabaseError("connection lost")
+
+    def commit(self):
+        raise fdb.DatabaseError("connection lost")
+
+
+class LostDatabase:
+    def trans(self, tpb):
+        return LostTransaction()
+
+
+def test_snapshot_of_lost_attachment():
+    conn = Firebird.__new__(Firebird)
+    conn.db = LostDatabase()
+    assert conn.ServerSnapshot() == "connection lost"
+
+
+def test_soak_refuses_snapshot_per_test(options, capsys):
+    with pytest.raises(SystemExit):
+        options(
+            "--use_backup",
+            "test.fbk",
+            "--snapshot_cache",
+            "snapshots",
+            "--snapshot_per_test",
+            "--soak",
+            "60",
+        )
+    assert "can not be used with --soak" in capsys.readouterr().err
@@ -0,0 +1,190 @@
+import pytest
+
+from fdbtest import IsqlOnly, SqlScript
+
+
+class Connection:
+    """
+    Records what the script does with the attachment
+    """
+
+    def __init__(self, failing=()):
+        self.calls = []
+        self.failing = failing
+
+    def Begin(self):
+        self.calls.append("begin")
+
+    def Commit(self):
+        self.calls.append("commit")
+
+    def Rollback(self):
+        self.calls.append("rollback")
+
+    def Execute(self, statement, cache=True):
+        self.calls.append(statement)
+        if any(text in statement for text in self.failing):
+            return ("failed", -104, 335544569)
+        return {}
+
+
+def parse(text):
+    run = SqlScript.__new__(SqlScript)
+    run.charset = "UTF8"
+    return run.Parse(text)
+
+
+def script(tmp_path, text):
+    filename = tmp_path / "script.sql"
+    filename.write_text(text, encoding="utf-8")
+    return SqlScript(str(filename))
+
+
+def test_parse_splits_statements():
+    assert parse("select 1 from rdb$database;\nselect 2 from rdb$database;") == [
+        ("sql", "select 1 from rdb$database"),
+        ("sql", "select 2 from rdb$database"),
+    ]
+
+
+def test_parse_ignores_terminators_in_strings_and_comments():
+    statements = parse(
+        "insert into t values ('a;b', \"c;\");\n"
+        "-- comment; with terminator\n"
+        "/* block; comment */ insert into t values ('it''s;');\n"
+    )
+    assert [command for command, _ in statements] == ["sql", "sql"]
+    assert statements[0][1] == "insert into t values ('a;b', \"c;\")"
+    assert statements[1][1].endswith("values ('it''s;')")
+
+
+def test_parse_set_term():
+    statements = parse(
+        "set term ^ ;\n"
+        "create procedure p as begin exit; end^\n"
+        "set term ; ^\n"
+        "commit;"
+    )
+    assert statements == [
+        ("sql", "create procedure p as begin exit; end"),
+        ("commit", "commit"),
+    ]
+
+
+def test_parse_session_commands():
+    statements = parse(
+        "set autoddl off; set bail on; set list on; commit work; rollback;"
+    )
+    assert statements == [
+        ("autoddl", False),
+        ("bail", True),
+        ("commit", "commit work"),
+        ("rollback", "rollback"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "show tables;",
+        "create database 'x.fdb';",
+        "set names win1251;",
+        "set names;",
+        "set sql dialect 1;",
+        "set transaction read committed;",
+    ],
+)
+def test_parse_isql_only(text):
+    with pytest.raises(IsqlOnly):
+        parse(text)
+
+
+def test_run_batches_inserts(options, tmp_path):
+    options()
+    conn = Connection()
+    passed, _ = script(
+        tmp_path, "insert into t values (1);\ninsert into t values (2);\n"
+    ).Run(conn)
+    assert passed
+    assert conn.calls == [
+        "begin",
+        "EXECUTE BLOCK AS BEGIN\n"
+        "insert into t values (1);\ninsert into t values (2);\nEND",
+        "commit",
+    ]
+
+
+def test_run_batch_respects_statement_count(options, tmp_path):
+    options("--script_batch", "2")
+    conn = Connection()
+    run = script(tmp_path, "insert into t values (1);" * 5)
+    assert run.Run(conn)[0]
+    assert run.blocks == 2
+    assert run.executed == 5
+
+
+def test_run_batch_limit_counts_bytes(options, tmp_path, monkeypatch):
+    options()
+    # every statement is 30 characters but 58 bytes long
+    statement = "insert into t values ('" + "ж" * 28 + "')"
+    monkeypatch.setattr(SqlScript, "BLOCK_LIMIT", 100)
+    conn = Connection()
+    run = script(tmp_path, f"{statement};\n{statement};\n")
+    assert run.Run(conn)[0]
+    assert run.blocks == 0
+    assert conn.calls == ["begin", statement, statement, "commit"]
+
+
+def test_run_failed_batch_repeats_statements(options, tmp_path):
+    options()
+    conn = Connection(failing=("EXECUTE BLOCK", "values (2)"))
+    run = script(
+        tmp_path, "insert into t values (1);\ninsert into t values (2);\n"
+    )
+    passed, debug_str = run.Run(conn)
+    assert not passed
+    assert conn.calls[-3:] == [
+        "insert into t values (1)",
+        "insert into t values (2)",
+        "commit",
+    ]
+    assert "insert into t values (2)\nfailed" in debug_str
+
+
+def test_run_autoddl_commits_ddl(options, tmp_path):
+    options()
+    conn = Connection()
+    script(tmp_path, "create table t (a int);\nupdate t set a = 1;").Run(conn)
+    assert conn.calls == [
+        "begin",
+        "create table t (a int)",
+        "commit",
+        "begin",
+        "update t set a = 1",
+        "commit",
+    ]
+
+
+def test_run_without_autoddl(options, tmp_path):
+    options()
+    conn = Connection()
+    script(
+        tmp_path, "set autoddl off;\ncreate table t (a int);\ncommit;"
+    ).Run(conn)
+    assert conn.calls == [
+        "begin",
+        "create table t (a int)",
+        "commit",
+        "begin",
+        "commit",
+    ]
+
+
+def test_run_bail_stops_and_rolls_back(options, tmp_path):
+    options()
+    conn = Connection(failing=("t1",))
+    passed, _ = script(
+        tmp_path, "set bail on;\nupdate t1 set a = 1;\nupdate t2 set a = 1;"
+    ).Run(conn)
+    assert not passed
+    assert conn.calls == ["begin", "update t1 set a = 1", "rollback"]
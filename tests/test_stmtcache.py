@@ -0,0 +1,56 @@
+import multiprocessing
+
+import fdbtest
+from fdbtest import Firebird
+
+
+class Cursor:
+    def prep(self, statement):
+        return object()
+
+
+def attachment(cache_size=64):
+    conn = Firebird(cache_size)
+    conn.cur = Cursor()
+    return conn
+
+
+def test_reuse_and_lru():
+    conn = attachment(2)
+    first = conn.Prepare("select 1 from rdb$database")
+    assert conn.Prepare(" select 1 from rdb$database ") is first
+    conn.Prepare("select 2 from rdb$database")
+    conn.Prepare("select 3 from rdb$database")
+    assert list(conn.statements) == [
+        "select 2 from rdb$database",
+        "select 3 from rdb$database",
+    ]
+    assert conn.CacheStats() == (1, 3)
+
+
+def test_one_off_statements_are_not_counted():
+    conn = attachment()
+    conn.Prepare("select 1 from rdb$database", cache=False)
+    assert conn.CacheStats() == (0, 0)
+    assert not conn.statements
+
+
+def test_ddl_drops_caches_of_all_attachments():
+    main, session = attachment(), attachment()
+    main.Prepare("select 1 from rdb$database")
+    session.Prepare("select 2 from rdb$database")
+    assert main.Prepare("create table t (i int)") == "create table t (i int)"
+    assert not main.statements
+    assert not session.statements
+
+
+def test_other_worker_changed_metadata(monkeypatch):
+    version = multiprocessing.Value("q", 0)
+    monkeypatch.setattr(fdbtest, "metadata_version", version)
+    conn = attachment()
+    first = conn.Prepare("select 1 from rdb$database")
+    assert conn.Prepare("select 1 from rdb$database") is first
+    # what MetadataChanged of another worker does
+    with version.get_lock():
+        version.value += 1
+    assert conn.Prepare("select 1 from rdb$database") is not first